@@ -1,94 +1,204 @@
 import os
-import subprocess
+import queue
+import re
+import time
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 import webbrowser
 import sys
+from mi_adb_core import (DeviceScheduler, FLEET_WORKERS, FPS_CHOICES, FrameSampler, INSTALLED, LOG_LEVELS, LogcatStream, PRIORITY_PREFETCH,
+                         PRIORITY_READ, PRIORITY_WRITE, PackageInventory, SYSTEM, ScreenPreview, UNKNOWN_DISPLAY_STATE, UNKNOWN_INFO_STATE,
+                         apk_sets, apply_profile, check_adb_connection, check_adb_installed, device_change_event, device_states,
+                         device_states_lock, device_tracker_live, export_trace, fetch_package_metadata, fleet_fps, fleet_install,
+                         fleet_pool, fleet_reinstall, fleet_status, fleet_uninstall, fleet_wm, format_size, get_display_state, get_dpi,
+                         get_info_state, get_resolution, install_apk_sets, invalidate_reads, is_package_name, list_backups, load_device,
+                         load_profile, online_serials, package_error, parse_device_info, patch_snapshot, refresh_snapshot, reset_trace,
+                         restore_packages, run_package_commands, save_snapshot, start_device_tracker, trace_summary, transfer_pool,
+                         uninstall_commands, uninstall_with_backup, validate_snapshot, write_refresh_rate, write_wm)
+from mi_adb_store import STORE_PATH, record_snapshot
 
-installed_cache = None
-uninstalled_cache = None
-system_all_cache = None
-user_all_cache = None
+STARTUP_STARTED = time.perf_counter()
+
+inventory = None
+device_record = None
 search_after_id1 = None
 search_after_id2 = None
 last_adb_state = None
+selected_serial = None
+snapshot_key = (None, "Unknown")
+search_indexes = {}
+package_metadata = {}
+EMPTY_ROW = "__empty__"
 
-def check_adb_installed():
-    adb_path = os.path.join(os.path.dirname(sys.executable), "adb.exe")
-    if os.path.exists(adb_path):
-        subprocess.run([adb_path, "start-server"], capture_output=True, creationflags=subprocess.CREATE_NO_WINDOW)
-        return True
-    try:
-        result = subprocess.run(['adb', '--version'], capture_output=True, text=True, timeout=3, creationflags=subprocess.CREATE_NO_WINDOW)
-        return result.returncode == 0
-    except:
-        return False
+FLEET_COLUMNS = ('model', 'packages', 'resolution', 'dpi', 'fps', 'result')
+PACKAGE_COLUMNS = (('type', "Type", 70), ('version', "Version", 110), ('state', "State", 110),
+                   ('installer', "Installer", 150), ('size', "Size", 80), ('updated', "Updated", 90))
+LOADING = "Loading..."
+LOADING_DISPLAY_STATE = ((LOADING, LOADING), (LOADING, LOADING), LOADING, LOADING)
+LOADING_INFO_STATE = ((LOADING, LOADING, LOADING, LOADING), LOADING, LOADING, LOADING)
+DEBUG_COLUMNS = ('kind', 'count', 'errors', 'avg_ms', 'p50_ms', 'p95_ms', 'max_ms', 'total_ms', 'bytes')
+MEASURE_INTERVAL_MS = 500
+PREVIEW_INTERVAL_MS = 500
+LOG_POLL_MS = 200
+LOG_VIEW_LINES = 5000
+LOG_COLORS = {'V': "gray", 'D': "gray", 'I': "black", 'W': "orange", 'E': "red", 'F': "red"}
+startup_times = {}
+fps_sampler = None
+fps_expected = None
+fps_measure_after = None
+fleet_loaded = False
+preview = None
+preview_after = None
+preview_started = 0
+log_stream = None
+log_after = None
+debug_window = None
+debug_after_id = None
+backups_window = None
+
+scheduler = None
+ui_queue = queue.Queue()
+task_tokens = {}
+task_futures = {}
+busy_count = 0
+
+def set_inventory(new_inventory):
+    global inventory
+    inventory = new_inventory
+
+def record_inventory_snapshot():
+    if device_record is not None and os.path.exists(STORE_PATH):
+        run_in_background(None, record_snapshot, lambda _: None, *device_record, inventory, busy=False, priority=PRIORITY_PREFETCH)
 
-def check_adb_connection():
+def set_busy(delta):
+    global busy_count
+    busy_count += delta
+    if busy_count > 0 and busy_count == delta:
+        busy_label.config(text="Working...")
+        busy_bar.config(mode='indeterminate')
+        busy_bar.start(10)
+    elif busy_count <= 0:
+        busy_count = 0
+        busy_label.config(text="")
+        busy_bar.stop()
+
+def run_in_background(key, work, on_done, *args, busy=True, priority=PRIORITY_READ):
+    token = task_tokens.get(key, 0) + 1
+    if key is not None:
+        task_tokens[key] = token
+        if key in task_futures:
+            task_futures[key].cancel()
+    if busy:
+        set_busy(1)
+    future = scheduler.submit(selected_serial, priority, work, *args)
+    if key is not None:
+        task_futures[key] = future
+    future.add_done_callback(lambda f: post_to_ui(finish_task, key, token, f, on_done, busy))
+    return future
+
+def cancel_background(*keys):
+    for key in keys:
+        task_tokens[key] = task_tokens.get(key, 0) + 1
+        if key in task_futures:
+            task_futures.pop(key).cancel()
+
+def post_to_ui(callback, *args):
+    ui_queue.put((callback, args))
+
+def finish_task(key, token, future, on_done, busy):
+    if busy:
+        set_busy(-1)
+    if key is not None:
+        if task_tokens.get(key) != token:
+            return
+        task_futures.pop(key, None)
+    if future.cancelled():
+        return
     try:
-        result = subprocess.run(['adb', 'devices'], capture_output=True, text=True, timeout=3, creationflags=subprocess.CREATE_NO_WINDOW)
-        return len(result.stdout.strip().split('\n')) > 1
-    except:
+        result = future.result()
+    except Exception as e:
+        messagebox.showerror("Error", f"ADB failed: {e}")
+        return
+    on_done(result)
+
+def show_progress(label, done, total):
+    busy_label.config(text=f"{label} {done}/{total}")
+    busy_bar.stop()
+    busy_bar.config(mode='determinate', maximum=total, value=done)
+
+def show_transfer(label, sent, total, rate):
+    busy_label.config(text=f"{label} {format_size(sent)} of {format_size(total)} at {format_size(rate)}/s")
+    busy_bar.stop()
+    busy_bar.config(mode='determinate', maximum=total or 1, value=sent)
+
+def transfer_progress(label):
+    started = time.perf_counter()
+    last_update = [0]
+    def on_progress(sent, total):
+        now = time.perf_counter()
+        if now - last_update[0] >= 0.1 or sent == total:
+            last_update[0] = now
+            post_to_ui(show_transfer, label, sent, total, sent / max(now - started, 0.001))
+    return on_progress
+
+def mark_startup(stage):
+    if stage in startup_times:
+        return
+    startup_times[stage] = round((time.perf_counter() - STARTUP_STARTED) * 1000)
+    if stage == 'device':
+        summary = "Startup: " + ", ".join(f"{name} {ms} ms" for name, ms in startup_times.items())
+        if busy_count == 0:
+            busy_label.config(text=summary)
+
+def start_adb():
+    if not check_adb_installed():
         return False
+    start_device_tracker()
+    return True
 
-def run_adb_cmd(cmd):
-    allowed_cmds = ['pm list packages', 'pm list packages -u', 'pm uninstall -k --user 0',
-                    'pm uninstall --user 0', 'cmd package install-existing', 'getprop ro.product.brand',
-                    'getprop ro.product.model', 'getprop ro.product.device',
-                    'getprop ro.system.build.version.incremental', 'wm size',
-                    'wm density', 'settings get secure miui_refresh_rate', 'settings get secure user_refresh_rate', 
-                    'which su', 'getprop ro.boot.verifiedbootstate', 'cat /proc/version']
-    if not any(cmd.startswith(allowed) for allowed in allowed_cmds):
-        return ["Error: Invalid command"]
-    if not check_adb_connection():
-        return ["Error: No device connected"]
-    try:
-        result = subprocess.run(['adb', 'shell', cmd], capture_output=True, text=True, timeout=5, creationflags=subprocess.CREATE_NO_WINDOW)
-        return result.stdout.strip().split('\n')
-    except:
-        return ["Error: ADB failed"]
-
-def get_installed():
-    global installed_cache
-    if installed_cache is None:
-        installed_cache = [line.replace('package:', '') for line in run_adb_cmd('pm list packages') if line.startswith('package:')]
-    return installed_cache
-
-def get_uninstalled():
-    global uninstalled_cache
-    if uninstalled_cache is None:
-        all_pkgs = set(line.replace('package:', '') for line in run_adb_cmd('pm list packages -u') if line.startswith('package:'))
-        installed = set(get_installed())
-        uninstalled_cache = sorted(all_pkgs - installed)
-    return uninstalled_cache
-
-def get_system_all():
-    global system_all_cache
-    if system_all_cache is None:
-        system_all_cache = set(line.replace('package:', '') for line in run_adb_cmd('pm list packages -s -u') if line.startswith('package:'))
-    return system_all_cache
-
-def get_user_all():
-    global user_all_cache
-    if user_all_cache is None:
-        user_all_cache = set(line.replace('package:', '') for line in run_adb_cmd('pm list packages -3 -u') if line.startswith('package:'))
-    return user_all_cache
-
-def update_display_tab():
-    original_res, current_res = get_resolution()
+def on_adb_started(installed):
+    mark_startup('adb')
+    if not installed:
+        messagebox.showerror("Error", "ADB not found. Please install ADB and ensure it is added to your system PATH.")
+        root.destroy()
+        sys.exit(1)
+    update_device_choices()
+    refresh_adb(show_popup=False)
+    root.after(2000, periodic_check)
+
+def load_fleet_tab():
+    global fleet_loaded
+    if not fleet_loaded and online_serials():
+        fleet_loaded = True
+        run_fleet_action(fleet_status)
+
+def on_tab_changed(e):
+    if nb.select() == str(tab4):
+        load_fleet_tab()
+
+def drain_ui_queue():
+    while True:
+        try:
+            callback, args = ui_queue.get_nowait()
+        except queue.Empty:
+            break
+        callback(*args)
+    root.after(50, drain_ui_queue)
+
+def update_display_tab(state):
+    (original_res, current_res), (original_dpi, current_dpi), fps, user_fps = state
     res_original_label.config(text=f"Original: {original_res}")
     res_current_label.config(text=f"Current: {current_res}")
-    original_dpi, current_dpi = get_dpi()
     dpi_original_label.config(text=f"Original: {original_dpi}")
     dpi_current_label.config(text=f"Current: {current_dpi}")
-    fps_system_label.config(text=f"System: {get_fps()}")
-    fps_user_label.config(text=f"User: {get_user_fps()}")
-
-def update_device_info_tab():
-    brand, model, code, version = get_device_info()
-    kernel = get_kernel()
-    root_status = check_root()
-    bootloader_status = check_bootloader()
+    fps_system_label.config(text=f"System: {fps}")
+    fps_user_label.config(text=f"User: {user_fps}")
+
+def refresh_display_tab():
+    run_in_background('display', get_display_state, update_display_tab, None, selected_serial)
+
+def update_device_info_tab(state):
+    (brand, model, code, version), kernel, root_status, bootloader_status = state
     device_info_labels[0].config(text=f"Brand: {brand}")
     device_info_labels[1].config(text=f"Model: {model}")
     device_info_labels[2].config(text=f"Code: {code}")
@@ -99,262 +209,455 @@ def update_device_info_tab():
     bootloader_color = "red" if bootloader_status == "Yes" else "green" if bootloader_status == "No" else "black"
     device_info_labels[6].config(text=bootloader_status, foreground=bootloader_color)
 
+def reload_packages():
+    def done(new_inventory):
+        set_inventory(new_inventory)
+        refresh_lists()
+    run_in_background('packages', refresh_snapshot, done, snapshot_key)
+
 def refresh_lists():
-    global installed_cache, uninstalled_cache
-    installed_packages = get_installed()
-    uninstalled_packages = get_uninstalled()
-    system_all = get_system_all()
-    user_all = get_user_all()
-    installed_system = [pkg for pkg in installed_packages if pkg in system_all]
-    installed_user = [pkg for pkg in installed_packages if pkg in user_all]
-    uninstalled_system = [pkg for pkg in uninstalled_packages if pkg in system_all]
-    uninstalled_user = [pkg for pkg in uninstalled_packages if pkg in user_all]
-    for widget in total_frame1.winfo_children():
-        widget.destroy()
-    total_label1 = ttk.Frame(total_frame1)
-    total_label1.pack(side='right')
-    ttk.Label(total_label1, text="System: ").pack(side='left')
-    ttk.Label(total_label1, text=f"{len(installed_system)}", foreground="red").pack(side='left')
-    if installed_user:
-        ttk.Label(total_label1, text=" User: ").pack(side='left')
-        ttk.Label(total_label1, text=f"{len(installed_user)}", foreground="green").pack(side='left')
-    for widget in total_frame2.winfo_children():
+    if inventory is None:
+        reload_packages()
+        return
+    installed_system, installed_user = refresh_list(tree1, INSTALLED, search_entry1)
+    uninstalled_system, uninstalled_user = refresh_list(tree2, 0, search_entry2)
+    update_totals(total_frame1, installed_system, installed_user)
+    update_totals(total_frame2, uninstalled_system, uninstalled_user)
+
+def update_totals(total_frame, system_count, user_count):
+    for widget in total_frame.winfo_children():
         widget.destroy()
-    total_label2 = ttk.Frame(total_frame2)
-    total_label2.pack(side='right')
-    ttk.Label(total_label2, text="System: ").pack(side='left')
-    ttk.Label(total_label2, text=f"{len(uninstalled_system)}", foreground="red").pack(side='left')
-    if uninstalled_user:
-        ttk.Label(total_label2, text=" User: ").pack(side='left')
-        ttk.Label(total_label2, text=f"{len(uninstalled_user)}", foreground="green").pack(side='left')
-    refresh_list(canvas1, package_frame1, installed_packages, "installed", search_entry1)
-    refresh_list(canvas2, package_frame2, uninstalled_packages, "uninstalled", search_entry2)
+    total_label = ttk.Frame(total_frame)
+    total_label.pack(side='right')
+    ttk.Label(total_label, text="System: ").pack(side='left')
+    ttk.Label(total_label, text=f"{system_count}", foreground="red").pack(side='left')
+    if user_count:
+        ttk.Label(total_label, text=" User: ").pack(side='left')
+        ttk.Label(total_label, text=f"{user_count}", foreground="green").pack(side='left')
 
 def refresh_adb(show_popup=True, force_refresh=False):
-    global installed_cache, uninstalled_cache, system_all_cache, user_all_cache, last_adb_state
-    current_adb_state = check_adb_connection()
-    if not force_refresh and current_adb_state == last_adb_state and show_popup:
-        return
-    last_adb_state = current_adb_state
-    if not current_adb_state:
-        if show_popup:
-            messagebox.showerror("Error", "No device connected")
-        device_name_label.config(text="No device connected", foreground="red")
-        installed_cache = []
-        uninstalled_cache = []
-        system_all_cache = set()
-        user_all_cache = set()
+    def validated(new_inventory):
+        if new_inventory is not None:
+            set_inventory(new_inventory)
+            refresh_lists()
+            record_inventory_snapshot()
+    def done(result):
+        global last_adb_state, snapshot_key, device_record
+        current_adb_state, new_inventory, out, snapshot_key, from_cache = result
+        if 'device' not in startup_times:
+            mark_startup('device')
+            root.after_idle(load_fleet_tab)
+        if not force_refresh and current_adb_state == last_adb_state and show_popup:
+            return
+        last_adb_state = current_adb_state
+        if not current_adb_state:
+            cancel_background('packages', 'display')
+            device_record = None
+            if show_popup:
+                messagebox.showerror("Error", "No device connected")
+            device_name_label.config(text="No device connected", foreground="red")
+            cancel_background('metadata')
+            set_package_metadata({})
+            set_inventory(PackageInventory())
+            refresh_lists()
+            update_display_tab(UNKNOWN_DISPLAY_STATE)
+            update_device_info_tab(UNKNOWN_INFO_STATE)
+            return
+        set_inventory(new_inventory)
+        brand, model, code, version = parse_device_info(out)
+        device_name = f"{brand} {model} ({code})" if model != "Unknown" and code != "Unknown" else "No device connected"
+        device_color = "green" if model != "Unknown" and code != "Unknown" else "red"
+        device_name_label.config(text=device_name, foreground=device_color)
         refresh_lists()
-        update_display_tab()
-        update_device_info_tab()
-        return
-    installed_cache = None
-    uninstalled_cache = None
-    system_all_cache = None
-    user_all_cache = None
-    brand, model, code, version = get_device_info()
-    device_name = f"{brand} {model} ({code})" if model != "Unknown" and code != "Unknown" else "No device connected"
-    device_color = "green" if model != "Unknown" and code != "Unknown" else "red"
-    device_name_label.config(text=device_name, foreground=device_color)
+        load_package_metadata()
+        update_display_tab(get_display_state(out))
+        info_state = get_info_state(out)
+        update_device_info_tab(info_state)
+        device_record = (snapshot_key[0], info_state[0], info_state[1]) if snapshot_key[0] else None
+        record_inventory_snapshot()
+        if from_cache:
+            run_in_background('packages', validate_snapshot, validated, snapshot_key, new_inventory, priority=PRIORITY_PREFETCH)
+        if show_popup and device_color == "green":
+            messagebox.showinfo("Success", f"{device_name} connected")
+    cancel_background('packages')
+    if force_refresh:
+        invalidate_reads(selected_serial)
+    run_in_background('device', load_device, done, selected_serial)
+
+def package_values(pkg, app_type):
+    meta = package_metadata.get(pkg)
+    if meta is None:
+        return (app_type,)
+    sizes = [meta[key] for key in ('code_size', 'data_size') if meta.get(key) is not None]
+    return (app_type, meta['version'], meta['enabled'] if meta['installed'] else "Not installed", meta['installer'],
+            format_size(sum(sizes)) if sizes else "", meta['last_update'].split(' ')[0])
+
+def set_package_metadata(metadata):
+    global package_metadata
+    package_metadata = metadata
+    for tree in (tree1, tree2):
+        index = search_indexes.get(str(tree))
+        if index:
+            for pkg, is_system in zip(index['rows'], index['system']):
+                tree.item(pkg, values=package_values(pkg, "System" if is_system else "User"))
+
+def load_package_metadata():
+    run_in_background('metadata', fetch_package_metadata, set_package_metadata, selected_serial, busy=False, priority=PRIORITY_PREFETCH)
+
+def report_package_results(action, packages, errors):
+    done = action.rstrip('e') + 'ed'
+    if len(packages) == 1:
+        if errors[0] is None:
+            messagebox.showinfo("Success", f"Successfully {done} {packages[0]}")
+        elif errors[0] == "System app protected":
+            messagebox.showerror("Error", f"Cannot {action} {packages[0]}: System app protected")
+        elif errors[0] == "Backup failed":
+            messagebox.showerror("Error", f"Failed to back up {packages[0]}, it was not uninstalled")
+        else:
+            messagebox.showerror("Error", f"Failed to {action} {packages[0]}")
+        return
+    failed = [(pkg, error) for pkg, error in zip(packages, errors) if error]
+    if not failed:
+        messagebox.showinfo("Success", f"Successfully {done} {len(packages)} packages")
+        return
+    details = '\n'.join(f"{pkg}: {error}" for pkg, error in failed[:15])
+    if len(failed) > 15:
+        details += f"\n...and {len(failed) - 15} more"
+    messagebox.showwarning(action.capitalize(), f"{done.capitalize()} {len(packages) - len(failed)} of {len(packages)} packages.\n\nFailed:\n{details}")
+
+def patch_inventory(key, uninstalled=(), removed=(), reinstalled=()):
+    if key != snapshot_key:
+        run_in_background(None, patch_snapshot, lambda _: None, key, uninstalled, removed, reinstalled, busy=False, priority=PRIORITY_PREFETCH)
+        return
+    set_inventory(inventory.with_changes(uninstalled, removed, reinstalled))
     refresh_lists()
-    update_display_tab()
-    update_device_info_tab()
-    if show_popup and device_color == "green":
-        messagebox.showinfo("Success", f"{device_name} connected")
+    run_in_background(None, save_snapshot, lambda _: None, snapshot_key, inventory, busy=False, priority=PRIORITY_PREFETCH)
+    record_inventory_snapshot()
 
-def uninstall_package(package, canvas, search_entry):
-    if not check_adb_connection():
+def uninstall_packages(packages):
+    serial = selected_serial
+    key = snapshot_key
+    if not packages:
+        return
+    if not check_adb_connection(serial):
         messagebox.showerror("Error", "No device connected")
         return
-    system_all = get_system_all()
-    user_all = get_user_all()
-    if package in system_all:
-        response = messagebox.askyesnocancel("Uninstall", f"This is system app ({package}). Do you want to keep its data for future reinstall?", icon="warning")
-        if response is True:
-            cmd = f'pm uninstall -k --user 0 {package}'
-        elif response is False:
-            cmd = f'pm uninstall --user 0 {package}'
-        else:
+    system_all = {pkg for pkg in packages if inventory is not None and inventory.has(pkg, SYSTEM)}
+    backup = backup_apks.get()
+    if len(packages) == 1 and packages[0] in system_all:
+        keep_data = messagebox.askyesnocancel("Uninstall", f"This is system app ({packages[0]}). Do you want to keep its data for future reinstall?", icon="warning")
+        if keep_data is None:
+            return
+    elif len(packages) == 1:
+        if not messagebox.askyesno("Uninstall", f"This is user app ({packages[0]}). All its data will be permanently deleted."
+                                   f"{' Its APK will be backed up first.' if backup else ''}", icon="warning"):
             return
+        keep_data = False
     else:
-        response = messagebox.askyesno("Uninstall", f"This is user app ({package}). All its data will be permanently deleted.", icon="warning")
-        if not response:
+        system_count = sum(pkg in system_all for pkg in packages)
+        keep_data = messagebox.askyesnocancel("Uninstall", f"Uninstall {len(packages)} packages ({system_count} system, {len(packages) - system_count} user)? "
+                                              f"User app data will be permanently deleted.\n\nDo you want to keep the data of system apps for future reinstall?", icon="warning")
+        if keep_data is None:
             return
-        cmd = f'pm uninstall --user 0 {package}'
-    result = subprocess.run(['adb', 'shell', cmd], capture_output=True, text=True, timeout=5, creationflags=subprocess.CREATE_NO_WINDOW)
-    output = result.stdout.strip() or result.stderr.strip()
-    if "Success" in output:
-        messagebox.showinfo("Success", f"Successfully uninstalled {package}")
-        global installed_cache, uninstalled_cache
-        installed_cache = None
-        uninstalled_cache = None
-        refresh_lists()
-    elif "Operation not allowed" in output or "Permission denied" in output:
-        messagebox.showerror("Error", f"Cannot uninstall {package}: System app protected")
+    def done(outputs):
+        errors = [package_error(output, ["Success"]) for output in outputs]
+        succeeded = [pkg for pkg, error in zip(packages, errors) if error is None]
+        if succeeded:
+            patch_inventory(key, uninstalled=[pkg for pkg in succeeded if pkg in system_all],
+                            removed=[pkg for pkg in succeeded if pkg not in system_all])
+        report_package_results("uninstall", packages, errors)
+    on_progress = lambda count, total: post_to_ui(show_progress, "Uninstalling", count, total)
+    if backup:
+        on_backup = lambda count, total: post_to_ui(show_progress, "Backing up", count, total)
+        run_in_background(None, uninstall_with_backup, done, packages, system_all, keep_data, serial, on_backup, on_progress, priority=PRIORITY_WRITE)
     else:
-        messagebox.showerror("Error", f"Failed to uninstall {package}")
+        run_in_background(None, run_package_commands, done, uninstall_commands(packages, system_all, keep_data), serial, on_progress, priority=PRIORITY_WRITE)
 
-def reinstall_package(package, canvas, search_entry):
-    if not check_adb_connection():
+def reinstall_packages(packages):
+    serial = selected_serial
+    key = snapshot_key
+    if not packages:
+        return
+    if not check_adb_connection(serial):
         messagebox.showerror("Error", "No device connected")
         return
-    response = messagebox.askyesno("Reinstall", f"Reinstall ({package})? This will restore the app to its previous state.", icon="warning")
-    if not response:
+    if len(packages) == 1:
+        message = f"Reinstall ({packages[0]})? This will restore the app to its previous state."
+    else:
+        message = f"Reinstall {len(packages)} packages? This will restore the apps to their previous state."
+    if not messagebox.askyesno("Reinstall", message, icon="warning"):
         return
-    result = subprocess.run(['adb', 'shell', f'cmd package install-existing {package}'], capture_output=True, text=True, timeout=5, creationflags=subprocess.CREATE_NO_WINDOW)
-    output = result.stdout.strip() or result.stderr.strip()
-    if "Success" in output or "Package" in output:
-        messagebox.showinfo("Success", f"Successfully reinstalled {package}")
-        global installed_cache, uninstalled_cache
-        installed_cache = None
-        uninstalled_cache = None
-        refresh_lists()
-    elif "Operation not allowed" in output or "Permission denied" in output:
-        messagebox.showerror("Error", f"Cannot reinstall {package}: System app protected")
+    def done(outputs):
+        errors = [package_error(output, ["Success", "Package"]) for output in outputs]
+        succeeded = [pkg for pkg, error in zip(packages, errors) if error is None]
+        if succeeded:
+            patch_inventory(key, reinstalled=succeeded)
+        report_package_results("reinstall", packages, errors)
+    cmds = [f'cmd package install-existing {pkg}' for pkg in packages]
+    run_in_background(None, run_package_commands, done, cmds, serial, lambda count, total: post_to_ui(show_progress, "Reinstalling", count, total), priority=PRIORITY_WRITE)
+
+def ask_apk_sets(parent=None):
+    paths = filedialog.askopenfilenames(parent=parent or root, title="Select APK files", filetypes=[("APK", "*.apk"), ("All files", "*.*")])
+    return apk_sets(paths) if paths else []
+
+def install_apk_files():
+    serial = selected_serial
+    if not check_adb_connection(serial):
+        messagebox.showerror("Error", "No device connected")
+        return
+    sets = ask_apk_sets()
+    if not sets:
+        return
+    def done(results):
+        if any(result['error'] is None for result in results):
+            reload_packages()
+        lines = [f"{result['name']}: {result['error']}" if result['error'] else f"{result['name']}: {format_size(result['bytes'])} at {result['mb_per_s']} MB/s"
+                 for result in results]
+        failed = sum(result['error'] is not None for result in results)
+        (messagebox.showwarning if failed else messagebox.showinfo)("Install", f"Installed {len(results) - failed} of {len(results)} apps.\n\n" + "\n".join(lines[:15]))
+    run_in_background(None, install_apk_sets, done, sets, serial, transfer_progress("Installing"), priority=PRIORITY_WRITE)
+
+def open_backups_window():
+    global backups_window
+    if backups_window is not None:
+        backups_window.lift()
+        return
+    backups_window = tk.Toplevel(root)
+    backups_window.title("APK Backups")
+    backups_window.geometry("640x360")
+    def close():
+        global backups_window
+        backups_window.destroy()
+        backups_window = None
+    backups_window.protocol("WM_DELETE_WINDOW", close)
+    button_frame = ttk.Frame(backups_window)
+    button_frame.pack(side='bottom', fill='x', padx=10, pady=5)
+    tree = ttk.Treeview(backups_window, columns=('files', 'size', 'time', 'serial'), selectmode='extended')
+    tree.heading('#0', text="Package", anchor='w')
+    tree.column('#0', width=260)
+    for column, title, width in (('files', "Files", 50), ('size', "Size", 80), ('time', "Backed up", 120), ('serial', "Device", 110)):
+        tree.heading(column, text=title, anchor='w')
+        tree.column(column, width=width, stretch=False)
+    tree.pack(expand=True, fill='both', padx=10, pady=(10, 0))
+    rows = {}
+    ttk.Button(button_frame, text="Restore", style="Green.TButton", command=lambda: restore_backups([rows[item] for item in tree.selection()])).pack(side='right')
+    for backup in list_backups():
+        item = tree.insert('', 'end', text=backup['package'],
+                           values=(len(backup['files']), format_size(sum(file['size'] for file in backup['files'])),
+                                   time.strftime('%Y-%m-%d %H:%M', time.localtime(backup['time'])), backup['serial'] or ""))
+        rows[item] = (backup['package'], backup['serial'])
+
+def restore_backups(selected):
+    serial = selected_serial
+    packages = list(dict.fromkeys(pkg for pkg, _ in selected))
+    if not packages:
+        return
+    if not check_adb_connection(serial):
+        messagebox.showerror("Error", "No device connected", parent=backups_window)
+        return
+    if not messagebox.askyesno("Restore", f"Install {len(packages)} packages from backup?", parent=backups_window):
+        return
+    def done(errors):
+        if None in errors:
+            reload_packages()
+        report_package_results("restore", packages, errors)
+    run_in_background(None, restore_packages, done, packages, serial, lambda count, total: post_to_ui(show_progress, "Restoring", count, total),
+                      dict(selected), priority=PRIORITY_WRITE)
+
+def apply_profile_file():
+    serial = selected_serial
+    path = filedialog.askopenfilename(title="Apply Profile", filetypes=[("Profiles", "*.json *.toml"), ("All files", "*.*")])
+    if not path:
+        return
+    try:
+        profile = load_profile(path)
+    except (OSError, ValueError) as e:
+        messagebox.showerror("Error", f"Invalid profile: {e}")
+        return
+    if not check_adb_connection(serial):
+        messagebox.showerror("Error", "No device connected")
+        return
+    def done(results):
+        if not results:
+            messagebox.showinfo("Profile", "Device already matches profile")
+            return
+        refresh_adb(show_popup=False, force_refresh=True)
+        failed = [f"{action} {target}: {error}" for action, target, error in results if error]
+        if failed:
+            details = '\n'.join(failed[:15])
+            if len(failed) > 15:
+                details += f"\n...and {len(failed) - 15} more"
+            messagebox.showwarning("Profile", f"Applied {len(results) - len(failed)} of {len(results)} changes.\n\nFailed:\n{details}")
+        else:
+            messagebox.showinfo("Profile", f"Applied {len(results)} changes")
+    on_progress = lambda count, total: post_to_ui(show_progress, "Applying profile", count, total)
+    run_in_background(None, apply_profile, done, profile, serial, False, on_progress, priority=PRIORITY_WRITE)
+
+def build_search_index(inventory, want):
+    system_rows = inventory.select(want | SYSTEM, INSTALLED | SYSTEM)
+    rows = system_rows + inventory.select(want, INSTALLED | SYSTEM)
+    lowered = [pkg.lower() for pkg in rows]
+    trigrams = {}
+    for i, name in enumerate(lowered):
+        for gram in {name[j:j + 3] for j in range(len(name) - 2)}:
+            trigrams.setdefault(gram, []).append(i)
+    return {'inventory': inventory, 'rows': rows, 'lower': lowered,
+            'system': [i < len(system_rows) for i in range(len(rows))], 'system_count': len(system_rows),
+            'trigrams': trigrams, 'query': None, 'matches': range(len(rows))}
+
+def search_packages(index, query):
+    query = query.lower()
+    if query == index['query']:
+        return index['matches']
+    lowered = index['lower']
+    if index['query'] is not None and index['query'] in query:
+        candidates = index['matches']
     else:
-        messagebox.showerror("Error", f"Failed to reinstall {package}")
+        candidates = range(len(lowered))
+    if len(query) >= 3:
+        postings = min((index['trigrams'].get(query[j:j + 3], []) for j in range(len(query) - 2)), key=len)
+        if len(postings) < len(candidates):
+            candidates = postings
+    index['query'] = query
+    index['matches'] = [i for i in candidates if query in lowered[i]]
+    return index['matches']
 
-def refresh_list(canvas, package_frame, packages, status, search_entry):
-    for widget in package_frame.winfo_children():
-        widget.destroy()
-    query = search_entry.get()
-    filtered = [pkg for pkg in packages if query.lower() in pkg.lower()]
-    if not filtered:
-        ttk.Label(package_frame, text="No matching packages found").pack(anchor='w', pady=2)
-        canvas.update_idletasks()
-        canvas.configure(scrollregion=canvas.bbox("all"))
-        canvas.yview_moveto(0)
-        return
-    system_all = get_system_all()
-    user_all = get_user_all()
-    system_pkgs = [pkg for pkg in filtered if pkg in system_all]
-    user_pkgs = [pkg for pkg in filtered if pkg in user_all]
-    filtered = system_pkgs + user_pkgs
-    for pkg in filtered:
-        frame = ttk.Frame(package_frame)
-        frame.pack(fill='x', pady=2)
-        ttk.Label(frame, text=pkg, width=60, anchor='w').pack(side='left')
-        ttk.Label(frame, text="").pack(side='left', expand=True, fill='x')
-        app_type = "System" if pkg in system_all else "User" if pkg in user_all else "Unknown"
-        color = "red" if app_type == "System" else "green" if app_type == "User" else "black"
-        btn = ttk.Button(frame, text="Uninstall" if status == "installed" else "Reinstall",
-                         command=lambda p=pkg: uninstall_package(p, canvas, search_entry) if status == "installed" else reinstall_package(p, canvas, search_entry))
-        btn.pack(side='right', padx=5)
-        btn.configure(style="Green.TButton" if app_type == "User" else "Red.TButton" if status == "installed" else "Green.TButton")
-        ttk.Label(frame, text=app_type, foreground=color).pack(side='right', padx=5)
-    canvas.update_idletasks()
-    canvas.configure(scrollregion=canvas.bbox("all"))
-    canvas.yview_moveto(0)
+def refresh_list(tree, want, search_entry):
+    old = search_indexes.get(str(tree))
+    if old is None or old['inventory'] is not inventory:
+        index = build_search_index(inventory, want)
+        search_indexes[str(tree)] = index
+        if old is None or old['rows'] != index['rows']:
+            if old is not None:
+                tree.delete(*old['rows'])
+            for pkg, is_system in zip(index['rows'], index['system']):
+                app_type = "System" if is_system else "User"
+                tree.insert('', 'end', iid=pkg, text=pkg, values=package_values(pkg, app_type), tags=(app_type,))
+        filter_list(tree, search_entry.get())
+    return inventory.count(want | SYSTEM, INSTALLED | SYSTEM), inventory.count(want, INSTALLED | SYSTEM)
 
-def periodic_check():
-    global last_adb_state
-    current_adb_state = check_adb_connection()
-    if current_adb_state != last_adb_state:
+def filter_list(tree, query):
+    index = search_indexes.get(str(tree))
+    if index is None or query.lower() == index['query']:
+        return
+    rows = index['rows']
+    tree.set_children('', *([rows[i] for i in search_packages(index, query)] or [EMPTY_ROW]))
+    tree.yview_moveto(0)
+
+def selected_packages(tree):
+    return [iid for iid in tree.selection() if iid != EMPTY_ROW]
+
+def on_package_action(tree, status):
+    packages = selected_packages(tree)
+    if status == "installed":
+        uninstall_packages(packages)
+    else:
+        reinstall_packages(packages)
+
+def create_package_tree(parent, status):
+    tree_frame = ttk.Frame(parent)
+    tree_frame.pack(expand=True, fill='both', padx=10)
+    tree = ttk.Treeview(tree_frame, columns=[column for column, title, width in PACKAGE_COLUMNS], selectmode='extended')
+    tree.heading('#0', text="Package", anchor='w')
+    tree.column('#0', width=260, stretch=True)
+    for column, title, width in PACKAGE_COLUMNS:
+        tree.heading(column, text=title, anchor='w')
+        tree.column(column, width=width, stretch=False)
+    tree.tag_configure("System", foreground="red")
+    tree.tag_configure("User", foreground="green")
+    tree.insert('', 'end', iid=EMPTY_ROW, text="No matching packages found")
+    scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=tree.yview)
+    tree.configure(yscrollcommand=scrollbar.set)
+    scrollbar.pack(side='right', fill='y')
+    tree.pack(side='left', expand=True, fill='both')
+    menu = tk.Menu(tree, tearoff=0)
+    menu.add_command(label="Uninstall" if status == "installed" else "Reinstall", command=lambda: on_package_action(tree, status))
+    def show_menu(e):
+        row = tree.identify_row(e.y)
+        if row and row != EMPTY_ROW:
+            if row not in tree.selection():
+                tree.selection_set(row)
+            menu.tk_popup(e.x_root, e.y_root)
+    tree.bind('<Button-3>', show_menu)
+    tree.bind('<Button-2>', show_menu)
+    tree.bind('<Double-1>', lambda e: on_package_action(tree, status))
+    tree.bind('<Return>', lambda e: on_package_action(tree, status))
+    tree.bind('<Control-a>', lambda e: tree.selection_set([iid for iid in tree.get_children() if iid != EMPTY_ROW]))
+    return tree
+
+def update_device_choices():
+    global selected_serial
+    serials = online_serials()
+    device_combo.config(values=serials)
+    if selected_serial not in serials:
+        selected_serial = serials[0] if serials else None
+    device_combo.set(selected_serial or "")
+    update_fleet_rows()
+
+def select_device(serial):
+    global selected_serial
+    if serial and serial != selected_serial:
+        selected_serial = serial
+        if fps_sampler is not None:
+            stop_fps_measurement()
+            fps_measure_label.config(text="")
+        if preview is not None:
+            start_preview()
+        if log_stream is not None:
+            start_logcat()
+        refresh_adb(show_popup=False, force_refresh=True)
+
+def on_adb_state(current_adb_state):
+    if current_adb_state != last_adb_state or selected_serial != snapshot_key[0]:
         refresh_adb(show_popup=True, force_refresh=True)
-    root.after(2000, periodic_check)
 
-def get_resolution():
-    if not check_adb_connection():
-        return "Unknown", "Unknown"
-    output = run_adb_cmd('wm size')
-    original = current = "Unknown"
-    for line in output:
-        if "Physical size" in line:
-            original = line.split(': ')[1].strip()
-        if "Override size" in line:
-            current = line.split(': ')[1].strip()
-    if current == "Unknown":
-        current = original
-    return original, current
-
-def get_dpi():
-    if not check_adb_connection():
-        return "Unknown", "Unknown"
-    output = run_adb_cmd('wm density')
-    original = current = "Unknown"
-    for line in output:
-        if "Physical density" in line:
-            original = line.split(': ')[1].strip()
-        if "Override density" in line:
-            current = line.split(': ')[1].strip()
-    if current == "Unknown":
-        current = original
-    return original, current
-
-def get_fps():
-    if not check_adb_connection():
-        return "Unknown"
-    output = run_adb_cmd('settings get secure miui_refresh_rate')
-    return output[0].strip() if output and output[0].strip().isdigit() else "Unknown"
-
-def get_user_fps():
-    if not check_adb_connection():
-        return "Unknown"
-    output = run_adb_cmd('settings get secure user_refresh_rate')
-    return output[0].strip() if output and output[0].strip().isdigit() else "Unknown"
-
-def get_device_info():
-    if not check_adb_connection():
-        return "Unknown", "Unknown", "Unknown", "Unknown"
-    brand = run_adb_cmd('getprop ro.product.brand')
-    model = run_adb_cmd('getprop ro.product.model')
-    code = run_adb_cmd('getprop ro.product.device')
-    version = run_adb_cmd('getprop ro.system.build.version.incremental')
-    return (
-        brand[0].strip() if brand and brand[0].strip() else "Unknown",
-        model[0].strip() if model and model[0].strip() else "Unknown",
-        code[0].strip() if code and code[0].strip() else "Unknown",
-        version[0].strip() if version and version[0].strip() else "Unknown"
-    )
-
-def check_root():
-    if not check_adb_connection():
-        return "Unknown"
-    output = run_adb_cmd('which su')
-    return "Yes" if output and output[0].strip() and '/su' in output[0] else "No"
-
-def check_bootloader():
-    if not check_adb_connection():
-        return "Unknown"
-    output = run_adb_cmd('getprop ro.boot.verifiedbootstate')
-    return "Yes" if output and output[0].strip() in ['orange', 'yellow'] else "No"
-
-def get_kernel():
-    if not check_adb_connection():
-        return "Unknown"
-    output = run_adb_cmd('cat /proc/version')
-    return output[0].strip().split()[2] if output and output[0].strip() else "Unknown"
+def periodic_check():
+    if device_tracker_live.is_set():
+        if device_change_event.is_set():
+            device_change_event.clear()
+            update_device_choices()
+            on_adb_state(check_adb_connection(selected_serial))
+        root.after(500, periodic_check)
+        return
+    run_in_background('poll', check_adb_connection, on_adb_state, busy=False, priority=PRIORITY_PREFETCH)
+    root.after(2000, periodic_check)
 
 def set_resolution(width, height):
-    if not check_adb_connection():
+    serial = selected_serial
+    if not check_adb_connection(serial):
         messagebox.showerror("Error", "No device connected")
         return
     if not (width.isdigit() and height.isdigit() and int(width) > 0 and int(height) > 0):
         messagebox.showerror("Error", "Invalid input")
         return
-    result = subprocess.run(['adb', 'shell', f'wm size {width}x{height}'], capture_output=True, text=True, timeout=5, creationflags=subprocess.CREATE_NO_WINDOW)
-    output = result.stdout.strip() or result.stderr.strip()
-    if "override" in output.lower() or not output:
-        messagebox.showinfo("Success", f"Resolution set to {width}x{height}")
-        update_display_tab()
-    else:
-        messagebox.showerror("Error", "Failed to set resolution")
+    def done(ok):
+        if ok:
+            messagebox.showinfo("Success", f"Resolution set to {width}x{height}")
+            refresh_display_tab()
+        else:
+            messagebox.showerror("Error", "Failed to set resolution")
+    run_in_background(None, write_wm, done, 'size', f'{width}x{height}', serial, priority=PRIORITY_WRITE)
 
 def reset_resolution():
-    if not check_adb_connection():
+    serial = selected_serial
+    if not check_adb_connection(serial):
         messagebox.showerror("Error", "No device connected")
         return
-    original, _ = get_resolution()
-    result = subprocess.run(['adb', 'shell', 'wm size reset'], capture_output=True, text=True, timeout=5, creationflags=subprocess.CREATE_NO_WINDOW)
-    output = result.stdout.strip() or result.stderr.strip()
-    if not output or "reset" in output.lower():
-        messagebox.showinfo("Success", f"Resolution reset to {original}")
-        update_display_tab()
-    else:
-        messagebox.showerror("Error", "Failed to reset resolution")
+    def work():
+        original, _ = get_resolution(serial)
+        return original, write_wm('size', 'reset', serial)
+    def done(result):
+        original, ok = result
+        if ok:
+            messagebox.showinfo("Success", f"Resolution reset to {original}")
+            refresh_display_tab()
+        else:
+            messagebox.showerror("Error", "Failed to reset resolution")
+    run_in_background(None, work, done, priority=PRIORITY_WRITE)
 
 def set_dpi(dpi):
-    if not check_adb_connection():
+    serial = selected_serial
+    if not check_adb_connection(serial):
         messagebox.showerror("Error", "No device connected")
         return
     if not (dpi.isdigit() and int(dpi) > 0):
@@ -369,29 +672,34 @@ def set_dpi(dpi):
         response = messagebox.askyesno("DPI", f"DPI {dpi_val} may make the display appear too large. Continue?", icon="warning")
         if not response:
             return
-    result = subprocess.run(['adb', 'shell', f'wm density {dpi}'], capture_output=True, text=True, timeout=5, creationflags=subprocess.CREATE_NO_WINDOW)
-    output = result.stdout.strip() or result.stderr.strip()
-    if "override" in output.lower() or not output:
-        messagebox.showinfo("Success", f"DPI set to {dpi}")
-        update_display_tab()
-    else:
-        messagebox.showerror("Error", "Failed to set DPI")
+    def done(ok):
+        if ok:
+            messagebox.showinfo("Success", f"DPI set to {dpi}")
+            refresh_display_tab()
+        else:
+            messagebox.showerror("Error", "Failed to set DPI")
+    run_in_background(None, write_wm, done, 'density', dpi, serial, priority=PRIORITY_WRITE)
 
 def reset_dpi():
-    if not check_adb_connection():
+    serial = selected_serial
+    if not check_adb_connection(serial):
         messagebox.showerror("Error", "No device connected")
         return
-    original, _ = get_dpi()
-    result = subprocess.run(['adb', 'shell', 'wm density reset'], capture_output=True, text=True, timeout=5, creationflags=subprocess.CREATE_NO_WINDOW)
-    output = result.stdout.strip() or result.stderr.strip()
-    if not output or "reset" in output.lower():
-        messagebox.showinfo("Success", f"DPI reset to {original}")
-        update_display_tab()
-    else:
-        messagebox.showerror("Error", "Failed to reset DPI")
+    def work():
+        original, _ = get_dpi(serial)
+        return original, write_wm('density', 'reset', serial)
+    def done(result):
+        original, ok = result
+        if ok:
+            messagebox.showinfo("Success", f"DPI reset to {original}")
+            refresh_display_tab()
+        else:
+            messagebox.showerror("Error", "Failed to reset DPI")
+    run_in_background(None, work, done, priority=PRIORITY_WRITE)
 
 def apply_fps(fps, reset=False):
-    if not check_adb_connection():
+    serial = selected_serial
+    if not check_adb_connection(serial):
         messagebox.showerror("Error", "No device connected")
         return
     if not reset:
@@ -399,25 +707,303 @@ def apply_fps(fps, reset=False):
             messagebox.showerror("Error", "Invalid input")
             return
         fps_val = int(fps)
-        if fps_val not in [30, 60, 90, 120, 144, 165]:
+        if fps_val not in FPS_CHOICES:
             messagebox.showwarning("FPS", "FPS must be 30, 60, 90, 120, 144, or 165.")
             return
     else:
         fps_val = 60
-    current_fps = get_fps()
-    current_user_fps = get_user_fps()
-    if current_fps != "Unknown" and int(current_fps) == fps_val and current_user_fps != "Unknown" and int(current_user_fps) == fps_val:
-        messagebox.showinfo("Info", f"FPS is already set to {fps_val}")
-        return
-    result1 = subprocess.run(['adb', 'shell', f'settings put secure miui_refresh_rate {fps_val}'], capture_output=True, text=True, timeout=5, creationflags=subprocess.CREATE_NO_WINDOW)
-    result2 = subprocess.run(['adb', 'shell', f'settings put secure user_refresh_rate {fps_val}'], capture_output=True, text=True, timeout=5, creationflags=subprocess.CREATE_NO_WINDOW)
-    output1 = result1.stdout.strip() or result1.stderr.strip()
-    output2 = result2.stdout.strip() or result2.stderr.strip()
-    if (not output1 or "success" in output1.lower()) and (not output2 or "success" in output2.lower()):
-        messagebox.showinfo("Success", f"FPS {'reset to 60' if reset else f'set to {fps_val}'}")
-        update_display_tab()
+    def done(ok):
+        if ok is None:
+            messagebox.showinfo("Info", f"FPS is already set to {fps_val}")
+            return
+        if ok:
+            messagebox.showinfo("Success", f"FPS {'reset to 60' if reset else f'set to {fps_val}'}")
+            refresh_display_tab()
+            start_fps_measurement(fps_val)
+        else:
+            messagebox.showerror("Error", "Failed to set FPS")
+    run_in_background(None, write_refresh_rate, done, fps_val, serial, priority=PRIORITY_WRITE)
+
+def start_fps_measurement(expected=None):
+    global fps_sampler, fps_expected
+    fps_expected = expected
+    if fps_sampler is not None and fps_sampler.serial == selected_serial:
+        return
+    stop_fps_measurement()
+    fps_sampler = FrameSampler(selected_serial)
+    fps_measure_button.config(text="Stop")
+    fps_measure_label.config(text="Measuring...", foreground="black")
+    sample_fps()
+
+def stop_fps_measurement():
+    global fps_sampler, fps_measure_after
+    if fps_measure_after:
+        root.after_cancel(fps_measure_after)
+        fps_measure_after = None
+    cancel_background('measure')
+    fps_sampler = None
+    fps_measure_button.config(text="Measure")
+
+def toggle_fps_measurement():
+    if fps_sampler is None:
+        start_fps_measurement()
+    else:
+        stop_fps_measurement()
+        fps_measure_label.config(text="")
+
+def sample_fps():
+    run_in_background('measure', fps_sampler.sample, show_fps_stats, busy=False, priority=PRIORITY_PREFETCH)
+
+def show_fps_stats(stats):
+    global fps_measure_after
+    if fps_sampler is None:
+        return
+    panel = stats['panel_hz']
+    lines = [f"Panel: {panel:g} Hz" if panel else "Panel: Unknown"]
+    if 'fps' in stats:
+        lines.append(f"Effective: {stats['fps']:g} FPS  Jank: {stats['jank_pct']:g}%")
+        lines.append(f"Frame time p50 {stats['p50_ms']:g} / p95 {stats['p95_ms']:g} / p99 {stats['p99_ms']:g} ms")
+    else:
+        lines.append("Waiting for frames, scroll something on the device")
+    capped = fps_expected is not None and panel is not None and panel < fps_expected - 1
+    if capped:
+        lines.append(f"Requested {fps_expected} Hz but the panel runs at {panel:g} Hz")
+    fps_measure_label.config(text="\n".join(lines), foreground="red" if capped else "black")
+    fps_measure_after = root.after(MEASURE_INTERVAL_MS, sample_fps)
+
+def start_preview():
+    global preview
+    stop_preview()
+    preview = ScreenPreview(selected_serial)
+    preview_button.config(text="Stop Preview")
+    preview_label.config(text="Capturing...")
+    request_preview_frame()
+
+def stop_preview():
+    global preview, preview_after
+    if preview_after:
+        root.after_cancel(preview_after)
+        preview_after = None
+    cancel_background('preview')
+    preview = None
+    preview_button.config(text="Preview")
+
+def toggle_preview():
+    if preview is None:
+        start_preview()
+    else:
+        stop_preview()
+
+def request_preview_frame():
+    global preview_started
+    preview_started = time.perf_counter()
+    run_in_background('preview', preview.grab, show_preview_frame, busy=False, priority=PRIORITY_PREFETCH)
+
+def show_preview_frame(frame):
+    global preview_after
+    if preview is None:
+        return
+    if frame is None:
+        preview_label.config(text="No frame", image='')
+    else:
+        preview_image.configure(data=frame[0], format='PPM')
+        preview_label.config(text="", image=preview_image)
+    elapsed = (time.perf_counter() - preview_started) * 1000
+    preview_after = root.after(max(10, round(PREVIEW_INTERVAL_MS - elapsed)), request_preview_frame)
+
+def start_logcat():
+    global log_stream
+    stop_logcat()
+    log_stream = LogcatStream(selected_serial, log_level.get())
+    log_stream.set_filter(log_tag_entry.get().strip(), log_package_entry.get().strip())
+    log_stream.start()
+    log_button.config(text="Stop")
+    poll_logcat()
+
+def stop_logcat():
+    global log_stream, log_after
+    if log_after:
+        root.after_cancel(log_after)
+        log_after = None
+    if log_stream is not None:
+        log_stream.stop()
+        log_stream = None
+    log_button.config(text="Start")
+
+def toggle_logcat():
+    if log_stream is None:
+        start_logcat()
+    else:
+        stop_logcat()
+
+def clear_logcat():
+    log_text.config(state='normal')
+    log_text.delete('1.0', 'end')
+    log_text.config(state='disabled')
+
+def apply_log_filter():
+    if log_stream is not None:
+        clear_logcat()
+        log_stream.set_filter(log_tag_entry.get().strip(), log_package_entry.get().strip())
+
+def poll_logcat():
+    global log_after
+    entries = log_stream.drain()
+    if entries:
+        at_bottom = log_text.yview()[1] >= 0.999
+        chunks = []
+        for time_text, pid, level, tag, message in entries:
+            chunks += [f"{time_text} {pid:>5} {level} {tag}: {message}\n", level]
+        log_text.config(state='normal')
+        log_text.insert('end', *chunks)
+        excess = int(log_text.index('end-1c').split('.')[0]) - 1 - LOG_VIEW_LINES
+        if excess > 0:
+            log_text.delete('1.0', f'{excess + 1}.0')
+        log_text.config(state='disabled')
+        if at_bottom:
+            log_text.see('end')
+    state = "" if log_stream.thread.is_alive() else "  (stream ended)"
+    log_status.config(text=f"{log_stream.received} lines received, {log_stream.dropped} dropped{state}")
+    log_after = root.after(LOG_POLL_MS, poll_logcat)
+
+def update_fleet_row(serial, values):
+    if not fleet_tree.exists(serial):
+        fleet_tree.insert('', 'end', iid=serial, text=serial, values=[""] * len(FLEET_COLUMNS))
+    for column, value in values.items():
+        fleet_tree.set(serial, column, value)
+
+def update_fleet_rows():
+    with device_states_lock:
+        states = dict(device_states)
+    for serial, state in states.items():
+        if state != 'device':
+            update_fleet_row(serial, {'result': state})
+        elif not fleet_tree.exists(serial):
+            update_fleet_row(serial, {'result': "Connected"})
+    for serial in fleet_tree.get_children():
+        if serial not in states:
+            update_fleet_row(serial, {'result': "Disconnected"})
+
+def run_fleet_action(operation, *args):
+    serials = online_serials()
+    if not serials:
+        messagebox.showerror("Error", "No device connected")
+        return
+    priority = PRIORITY_READ if operation is fleet_status else PRIORITY_WRITE
+    for serial in serials:
+        update_fleet_row(serial, {'result': "Working..."})
+        future = scheduler.submit(serial, priority, operation, serial, *args)
+        future.add_done_callback(lambda f, serial=serial: post_to_ui(update_fleet_row, serial, fleet_result(f)))
+
+def fleet_result(future):
+    if future.cancelled():
+        return {'result': "Cancelled"}
+    try:
+        return future.result()
+    except Exception as e:
+        return {'result': f"Error: {e}"}
+
+def fleet_packages_action(text, reinstall=False, keep_data=False, backup=False):
+    packages = [pkg for pkg in re.split(r'[\s,]+', text.strip()) if pkg]
+    if not packages:
+        messagebox.showerror("Error", "Invalid input")
+        return
+    invalid = [pkg for pkg in packages if not is_package_name(pkg)]
+    if invalid:
+        messagebox.showerror("Error", f"Invalid package name: {invalid[0]}")
+        return
+    action = "Reinstall" if reinstall else "Uninstall"
+    if not messagebox.askyesno(action, f"{action} {len(packages)} packages on {len(online_serials())} devices?", icon="warning"):
+        return
+    if reinstall:
+        run_fleet_action(fleet_reinstall, packages)
     else:
-        messagebox.showerror("Error", "Failed to set FPS")
+        run_fleet_action(fleet_uninstall, packages, keep_data, backup)
+
+def fleet_install_action():
+    sets = ask_apk_sets()
+    if not sets:
+        return
+    if not messagebox.askyesno("Install", f"Install {len(sets)} apps on {len(online_serials())} devices?", icon="warning"):
+        return
+    run_fleet_action(fleet_install, sets)
+
+def fleet_resolution_action(width, height):
+    if not (width.isdigit() and height.isdigit() and int(width) > 0 and int(height) > 0):
+        messagebox.showerror("Error", "Invalid input")
+        return
+    run_fleet_action(fleet_wm, 'size', f'{width}x{height}')
+
+def fleet_dpi_action(dpi):
+    if not (dpi.isdigit() and int(dpi) > 0):
+        messagebox.showerror("Error", "Invalid input")
+        return
+    run_fleet_action(fleet_wm, 'density', dpi)
+
+def fleet_fps_action(fps):
+    if not (fps.isdigit() and int(fps) in FPS_CHOICES):
+        messagebox.showwarning("FPS", "FPS must be 30, 60, 90, 120, 144, or 165.")
+        return
+    run_fleet_action(fleet_fps, int(fps))
+
+def toggle_debug_panel():
+    global debug_window, debug_tree, debug_label
+    if debug_window is not None:
+        close_debug_panel()
+        return
+    debug_window = tk.Toplevel(root)
+    debug_window.title("Debug")
+    debug_window.geometry("820x360")
+    debug_window.protocol("WM_DELETE_WINDOW", close_debug_panel)
+    debug_label = ttk.Label(debug_window, text="", anchor='w', justify='left')
+    debug_label.pack(fill='x', padx=10, pady=5)
+    button_frame = ttk.Frame(debug_window)
+    button_frame.pack(side='bottom', fill='x', padx=10, pady=5)
+    ttk.Button(button_frame, text="Export Chrome Trace", command=lambda: export_debug_trace(True)).pack(side='left')
+    ttk.Button(button_frame, text="Export JSON", command=lambda: export_debug_trace(False)).pack(side='left', padx=5)
+    ttk.Button(button_frame, text="Reset", command=reset_trace).pack(side='right')
+    debug_tree = ttk.Treeview(debug_window, columns=DEBUG_COLUMNS, selectmode='none')
+    debug_tree.heading('#0', text="Command", anchor='w')
+    debug_tree.column('#0', width=220)
+    for column in DEBUG_COLUMNS:
+        debug_tree.heading(column, text=column.replace('_', ' '), anchor='w')
+        debug_tree.column(column, width=60, stretch=False)
+    debug_tree.pack(expand=True, fill='both', padx=10)
+    update_debug_panel()
+
+def close_debug_panel():
+    global debug_window, debug_after_id
+    if debug_after_id:
+        root.after_cancel(debug_after_id)
+        debug_after_id = None
+    debug_window.destroy()
+    debug_window = None
+
+def update_debug_panel():
+    global debug_after_id
+    rows = trace_summary()
+    totals = {}
+    for row in rows:
+        count, total_ms = totals.get(row['kind'], (0, 0))
+        totals[row['kind']] = count + row['count'], total_ms + row['total_ms']
+    lines = ["  ".join(f"{kind}: {count} calls, {total_ms:.0f} ms" for kind, (count, total_ms) in sorted(totals.items())) or "No adb calls yet"]
+    if startup_times:
+        lines.append("Startup: " + ", ".join(f"{name} {ms} ms" for name, ms in startup_times.items()))
+    debug_label.config(text="\n".join(lines))
+    debug_tree.delete(*debug_tree.get_children())
+    for row in rows:
+        debug_tree.insert('', 'end', text=row['command'], values=[row[column] for column in DEBUG_COLUMNS])
+    debug_after_id = root.after(1000, update_debug_panel)
+
+def export_debug_trace(chrome):
+    path = filedialog.asksaveasfilename(parent=debug_window, defaultextension='.json', filetypes=[("JSON", "*.json")],
+                                        initialfile="mi_adb_trace.json" if chrome else "mi_adb_stats.json")
+    if not path:
+        return
+    try:
+        export_trace(path, chrome)
+    except OSError as e:
+        messagebox.showerror("Error", f"Failed to export trace: {e}", parent=debug_window)
 
 def open_telegram():
     webbrowser.open("https://t.me/sickseiha")
@@ -426,20 +1012,24 @@ def open_github():
     webbrowser.open("https://github.com/sickseiha/Mi_Adb_Kit")
 
 def create_debloater_tab(tab):
-    global sub_nb, sub_tab1, sub_tab2, canvas1, canvas2, package_frame1, package_frame2, scrollbar1, scrollbar2, search_entry1, search_entry2, device_name_label, total_frame1, total_frame2, search_after_id1, search_after_id2
+    global sub_nb, sub_tab1, sub_tab2, tree1, tree2, search_entry1, search_entry2, device_name_label, device_combo, total_frame1, total_frame2, search_after_id1, search_after_id2, backup_apks
     style = ttk.Style()
     style.configure("Red.TButton", foreground="red")
     style.configure("Green.TButton", foreground="green")
     top_frame = ttk.Frame(tab)
     top_frame.pack(fill='x', padx=10, pady=5)
     ttk.Label(top_frame, text="Device Connected: ").pack(side='left')
-    brand, model, code, version = get_device_info()
-    device_name = f"{brand} {model} ({code})" if model != "Unknown" and code != "Unknown" else "No device connected"
-    device_color = "green" if model != "Unknown" and code != "Unknown" else "red"
-    device_name_label = ttk.Label(top_frame, text=device_name, foreground=device_color)
+    device_name_label = ttk.Label(top_frame, text=LOADING)
     device_name_label.pack(side='left')
     ttk.Label(top_frame, text="").pack(side='left', expand=True, fill='x')
     ttk.Button(top_frame, text="Refresh", command=lambda: refresh_adb(show_popup=True, force_refresh=True)).pack(side='right')
+    ttk.Button(top_frame, text="Apply Profile", command=apply_profile_file).pack(side='right', padx=(0, 5))
+    ttk.Button(top_frame, text="Backups", command=open_backups_window).pack(side='right', padx=(0, 5))
+    ttk.Button(top_frame, text="Install APK", command=install_apk_files).pack(side='right', padx=(0, 5))
+    device_combo = ttk.Combobox(top_frame, state='readonly', width=24, values=online_serials())
+    device_combo.set(selected_serial or "")
+    device_combo.pack(side='right', padx=5)
+    device_combo.bind('<<ComboboxSelected>>', lambda e: select_device(device_combo.get()))
     sub_nb = ttk.Notebook(tab)
     sub_nb.pack(expand=True, fill='both')
     sub_tab1 = ttk.Frame(sub_nb)
@@ -447,17 +1037,12 @@ def create_debloater_tab(tab):
     search_frame1 = ttk.Frame(sub_tab1)
     search_frame1.pack(fill='x', padx=10, pady=5)
     ttk.Label(search_frame1, text="Search:").pack(side='left')
+    ttk.Button(search_frame1, text="Uninstall", style="Red.TButton", command=lambda: on_package_action(tree1, "installed")).pack(side='right', padx=(5, 0))
+    backup_apks = tk.BooleanVar(value=False)
+    ttk.Checkbutton(search_frame1, text="Back up user apps", variable=backup_apks).pack(side='right', padx=(5, 0))
     search_entry1 = ttk.Entry(search_frame1)
     search_entry1.pack(fill='x', expand=True)
-    canvas_frame1 = ttk.Frame(sub_tab1)
-    canvas_frame1.pack(expand=True, fill='both', padx=10)
-    canvas1 = tk.Canvas(canvas_frame1)
-    scrollbar1 = ttk.Scrollbar(canvas_frame1, orient=tk.VERTICAL, command=canvas1.yview)
-    canvas1.configure(yscrollcommand=scrollbar1.set)
-    scrollbar1.pack(side='right', fill='y')
-    canvas1.pack(side='left', expand=True, fill='both')
-    package_frame1 = ttk.Frame(canvas1)
-    canvas1.create_window((0, 0), window=package_frame1, anchor='nw')
+    tree1 = create_package_tree(sub_tab1, "installed")
     total_frame1 = ttk.Frame(sub_tab1)
     total_frame1.pack(fill='x', padx=10, pady=5)
     sub_tab2 = ttk.Frame(sub_nb)
@@ -465,51 +1050,44 @@ def create_debloater_tab(tab):
     search_frame2 = ttk.Frame(sub_tab2)
     search_frame2.pack(fill='x', padx=10, pady=5)
     ttk.Label(search_frame2, text="Search:").pack(side='left')
+    ttk.Button(search_frame2, text="Reinstall", style="Green.TButton", command=lambda: on_package_action(tree2, "uninstalled")).pack(side='right', padx=(5, 0))
     search_entry2 = ttk.Entry(search_frame2)
     search_entry2.pack(fill='x', expand=True)
-    canvas_frame2 = ttk.Frame(sub_tab2)
-    canvas_frame2.pack(expand=True, fill='both', padx=10)
-    canvas2 = tk.Canvas(canvas_frame2)
-    scrollbar2 = ttk.Scrollbar(canvas_frame2, orient=tk.VERTICAL, command=canvas2.yview)
-    canvas2.configure(yscrollcommand=scrollbar2.set)
-    scrollbar2.pack(side='right', fill='y')
-    canvas2.pack(side='left', expand=True, fill='both')
-    package_frame2 = ttk.Frame(canvas2)
-    canvas2.create_window((0, 0), window=package_frame2, anchor='nw')
+    tree2 = create_package_tree(sub_tab2, "uninstalled")
     total_frame2 = ttk.Frame(sub_tab2)
     total_frame2.pack(fill='x', padx=10, pady=5)
-    package_frame1.bind('<Configure>', lambda e: canvas1.configure(scrollregion=canvas1.bbox("all")))
-    package_frame2.bind('<Configure>', lambda e: canvas2.configure(scrollregion=canvas2.bbox("all")))
-    canvas1.bind_all("<MouseWheel>", lambda e: canvas1.yview_scroll(int(-1 * (e.delta / 120)), "units") if sub_nb.index(sub_nb.select()) == 0 else canvas2.yview_scroll(int(-1 * (e.delta / 120)), "units"))
-    canvas1.bind_all("<Button-4>", lambda e: canvas1.yview_scroll(-1, "units") if sub_nb.index(sub_nb.select()) == 0 else canvas2.yview_scroll(-1, "units"))
-    canvas1.bind_all("<Button-5>", lambda e: canvas1.yview_scroll(1, "units") if sub_nb.index(sub_nb.select()) == 0 else canvas2.yview_scroll(1, "units"))
-    canvas1.bind('<Configure>', lambda e: canvas1.itemconfig(canvas1.create_window((0, 0), window=package_frame1, anchor='nw'), width=e.width))
-    canvas2.bind('<Configure>', lambda e: canvas2.itemconfig(canvas2.create_window((0, 0), window=package_frame2, anchor='nw'), width=e.width))
     def search1_handler(e):
         global search_after_id1
         if search_after_id1:
             root.after_cancel(search_after_id1)
-        search_after_id1 = root.after(300, refresh_lists)
+        search_after_id1 = root.after(300, lambda: filter_list(tree1, search_entry1.get()))
     def search2_handler(e):
         global search_after_id2
         if search_after_id2:
             root.after_cancel(search_after_id2)
-        search_after_id2 = root.after(300, refresh_lists)
+        search_after_id2 = root.after(300, lambda: filter_list(tree2, search_entry2.get()))
     search_entry1.bind('<KeyRelease>', search1_handler)
     search_entry2.bind('<KeyRelease>', search2_handler)
-    root.after(100, lambda: refresh_adb(show_popup=False))
 
 def create_display_tab(tab):
-    global res_original_label, res_current_label, dpi_original_label, dpi_current_label, fps_system_label, fps_user_label
+    global res_original_label, res_current_label, dpi_original_label, dpi_current_label, fps_system_label, fps_user_label, fps_measure_button, fps_measure_label
+    global preview_button, preview_label, preview_image
     style = ttk.Style()
     style.configure("Red.TButton", foreground="red")
     style.configure("Green.TButton", foreground="green")
+    preview_frame = ttk.Frame(tab)
+    preview_frame.pack(side='right', fill='y', padx=10, pady=10)
+    preview_button = ttk.Button(preview_frame, text="Preview", command=toggle_preview)
+    preview_button.pack(side='bottom', pady=5)
+    preview_image = tk.PhotoImage(master=tab)
+    preview_label = ttk.Label(preview_frame, text="", anchor='center')
+    preview_label.pack(expand=True)
     frame = ttk.Frame(tab)
     frame.pack(expand=True, fill='both', padx=10, pady=10)
     res_frame = ttk.Frame(frame)
     res_frame.pack(expand=True, pady=10)
     ttk.Label(res_frame, text="Resolution:", anchor='center').pack(anchor='center')
-    original_res, current_res = get_resolution()
+    (original_res, current_res), (original_dpi, current_dpi), fps, user_fps = LOADING_DISPLAY_STATE
     res_original_label = ttk.Label(res_frame, text=f"Original: {original_res}", anchor='center')
     res_current_label = ttk.Label(res_frame, text=f"Current: {current_res}", anchor='center')
     res_original_label.pack(anchor='center', pady=2)
@@ -528,7 +1106,6 @@ def create_display_tab(tab):
     dpi_frame = ttk.Frame(frame)
     dpi_frame.pack(expand=True, pady=10)
     ttk.Label(dpi_frame, text="DPI:", anchor='center').pack(anchor='center')
-    original_dpi, current_dpi = get_dpi()
     dpi_original_label = ttk.Label(dpi_frame, text=f"Original: {original_dpi}", anchor='center')
     dpi_current_label = ttk.Label(dpi_frame, text=f"Current: {current_dpi}", anchor='center')
     dpi_original_label.pack(anchor='center', pady=2)
@@ -544,9 +1121,9 @@ def create_display_tab(tab):
     fps_frame = ttk.Frame(frame)
     fps_frame.pack(expand=True, pady=10)
     ttk.Label(fps_frame, text="FPS:", anchor='center').pack(anchor='center')
-    fps_system_label = ttk.Label(fps_frame, text=f"System: {get_fps()}", anchor='center')
+    fps_system_label = ttk.Label(fps_frame, text=f"System: {fps}", anchor='center')
     fps_system_label.pack(anchor='center', pady=2)
-    fps_user_label = ttk.Label(fps_frame, text=f"User: {get_user_fps()}", anchor='center')
+    fps_user_label = ttk.Label(fps_frame, text=f"User: {user_fps}", anchor='center')
     fps_user_label.pack(anchor='center', pady=2)
     fps_input_frame = ttk.Frame(fps_frame)
     fps_input_frame.pack(anchor='center', pady=5)
@@ -556,15 +1133,16 @@ def create_display_tab(tab):
     fps_button_frame.pack(anchor='center', pady=5)
     ttk.Button(fps_button_frame, text="Apply", command=lambda: apply_fps(fps_entry.get()), style="Red.TButton").pack(side='left', padx=5)
     ttk.Button(fps_button_frame, text="Reset", command=lambda: apply_fps("60", reset=True), style="Green.TButton").pack(side='left', padx=5)
+    fps_measure_button = ttk.Button(fps_button_frame, text="Measure", command=toggle_fps_measurement)
+    fps_measure_button.pack(side='left', padx=5)
+    fps_measure_label = ttk.Label(fps_frame, text="", anchor='center', justify='center')
+    fps_measure_label.pack(anchor='center', pady=2)
 
 def create_device_info_tab(tab):
     global device_info_labels
     frame = ttk.Frame(tab)
     frame.pack(expand=True, fill='both', padx=10, pady=10)
-    brand, model, code, version = get_device_info()
-    kernel = get_kernel()
-    root_status = check_root()
-    bootloader_status = check_bootloader()
+    (brand, model, code, version), kernel, root_status, bootloader_status = LOADING_INFO_STATE
     device_info_labels = []
     device_info_labels.append(ttk.Label(frame, text=f"Brand: {brand}", anchor='center'))
     device_info_labels[0].pack(anchor='center', pady=2)
@@ -598,26 +1176,128 @@ def create_device_info_tab(tab):
     github_label.pack(anchor='center', pady=2)
     github_label.bind("<Button-1>", lambda e: open_github())
 
-if not check_adb_installed():
+def create_fleet_tab(tab):
+    global fleet_tree
+    frame = ttk.Frame(tab)
+    frame.pack(expand=True, fill='both', padx=10, pady=10)
+    tree_frame = ttk.Frame(frame)
+    tree_frame.pack(expand=True, fill='both')
+    fleet_tree = ttk.Treeview(tree_frame, columns=FLEET_COLUMNS, selectmode='none')
+    fleet_tree.heading('#0', text="Serial", anchor='w')
+    for column, title, width in zip(FLEET_COLUMNS, ("Model", "Packages", "Resolution", "DPI", "FPS", "Result"), (140, 70, 90, 50, 50, 160)):
+        fleet_tree.heading(column, text=title, anchor='w')
+        fleet_tree.column(column, width=width, stretch=column == 'result')
+    fleet_tree.column('#0', width=140, stretch=False)
+    scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=fleet_tree.yview)
+    fleet_tree.configure(yscrollcommand=scrollbar.set)
+    scrollbar.pack(side='right', fill='y')
+    fleet_tree.pack(side='left', expand=True, fill='both')
+    pkg_frame = ttk.Frame(frame)
+    pkg_frame.pack(fill='x', pady=5)
+    ttk.Label(pkg_frame, text="Packages:").pack(side='left')
+    keep_data = tk.BooleanVar(value=True)
+    backup = tk.BooleanVar(value=False)
+    ttk.Button(pkg_frame, text="Reinstall", style="Green.TButton", command=lambda: fleet_packages_action(pkg_entry.get(), reinstall=True)).pack(side='right', padx=(5, 0))
+    ttk.Button(pkg_frame, text="Uninstall", style="Red.TButton", command=lambda: fleet_packages_action(pkg_entry.get(), keep_data=keep_data.get(), backup=backup.get())).pack(side='right', padx=(5, 0))
+    ttk.Checkbutton(pkg_frame, text="Keep system app data", variable=keep_data).pack(side='right', padx=(5, 0))
+    ttk.Checkbutton(pkg_frame, text="Back up user apps", variable=backup).pack(side='right', padx=(5, 0))
+    pkg_entry = ttk.Entry(pkg_frame)
+    pkg_entry.pack(fill='x', expand=True, padx=(5, 0))
+    display_frame = ttk.Frame(frame)
+    display_frame.pack(fill='x', pady=5)
+    ttk.Label(display_frame, text="Resolution:").pack(side='left')
+    width_entry = ttk.Entry(display_frame, width=6)
+    width_entry.pack(side='left')
+    ttk.Label(display_frame, text=" x ").pack(side='left')
+    height_entry = ttk.Entry(display_frame, width=6)
+    height_entry.pack(side='left')
+    ttk.Button(display_frame, text="Apply", style="Red.TButton", command=lambda: fleet_resolution_action(width_entry.get(), height_entry.get())).pack(side='left', padx=5)
+    ttk.Button(display_frame, text="Reset", style="Green.TButton", command=lambda: run_fleet_action(fleet_wm, 'size', 'reset')).pack(side='left')
+    ttk.Label(display_frame, text="  DPI:").pack(side='left')
+    dpi_entry = ttk.Entry(display_frame, width=5)
+    dpi_entry.pack(side='left')
+    ttk.Button(display_frame, text="Apply", style="Red.TButton", command=lambda: fleet_dpi_action(dpi_entry.get())).pack(side='left', padx=5)
+    ttk.Button(display_frame, text="Reset", style="Green.TButton", command=lambda: run_fleet_action(fleet_wm, 'density', 'reset')).pack(side='left')
+    ttk.Label(display_frame, text="  FPS:").pack(side='left')
+    fps_entry = ttk.Entry(display_frame, width=4)
+    fps_entry.pack(side='left')
+    ttk.Button(display_frame, text="Apply", style="Red.TButton", command=lambda: fleet_fps_action(fps_entry.get())).pack(side='left', padx=5)
+    ttk.Button(display_frame, text="Refresh", command=lambda: run_fleet_action(fleet_status)).pack(side='right')
+    ttk.Button(display_frame, text="Install APK", command=fleet_install_action).pack(side='right', padx=5)
+
+def create_logs_tab(tab):
+    global log_level, log_tag_entry, log_package_entry, log_button, log_text, log_status
+    filter_frame = ttk.Frame(tab)
+    filter_frame.pack(fill='x', padx=10, pady=5)
+    ttk.Label(filter_frame, text="Level:").pack(side='left')
+    log_level = ttk.Combobox(filter_frame, state='readonly', width=3, values=list(LOG_LEVELS))
+    log_level.set('I')
+    log_level.pack(side='left', padx=(0, 10))
+    log_level.bind('<<ComboboxSelected>>', lambda e: log_stream is not None and start_logcat())
+    ttk.Label(filter_frame, text="Tag:").pack(side='left')
+    log_tag_entry = ttk.Entry(filter_frame, width=16)
+    log_tag_entry.pack(side='left', padx=(0, 10))
+    ttk.Label(filter_frame, text="Package:").pack(side='left')
+    log_package_entry = ttk.Entry(filter_frame, width=24)
+    log_package_entry.pack(side='left')
+    for entry in (log_tag_entry, log_package_entry):
+        entry.bind('<Return>', lambda e: apply_log_filter())
+    ttk.Button(filter_frame, text="Clear", command=clear_logcat).pack(side='right')
+    log_button = ttk.Button(filter_frame, text="Start", command=toggle_logcat)
+    log_button.pack(side='right', padx=5)
+    ttk.Button(filter_frame, text="Filter", command=apply_log_filter).pack(side='right')
+    log_status = ttk.Label(tab, text="", anchor='w')
+    log_status.pack(side='bottom', fill='x', padx=10, pady=(0, 5))
+    text_frame = ttk.Frame(tab)
+    text_frame.pack(expand=True, fill='both', padx=10)
+    log_text = tk.Text(text_frame, wrap='none', state='disabled', font=("Consolas", 9), undo=False)
+    for level, color in LOG_COLORS.items():
+        log_text.tag_configure(level, foreground=color)
+    scrollbar = ttk.Scrollbar(text_frame, orient=tk.VERTICAL, command=log_text.yview)
+    log_text.configure(yscrollcommand=scrollbar.set)
+    scrollbar.pack(side='right', fill='y')
+    log_text.pack(side='left', expand=True, fill='both')
+
+if __name__ == "__main__":
+    scheduler = DeviceScheduler(FLEET_WORKERS)
     root = tk.Tk()
-    root.withdraw()
-    messagebox.showerror("Error", "ADB not found. Please install ADB and ensure it is added to your system PATH.")
-    root.destroy()
-    sys.exit(1)
-
-root = tk.Tk()
-root.title("Mi Adb Kit")
-root.geometry("800x600")
-nb = ttk.Notebook(root)
-nb.pack(expand=True, fill='both')
-tab1 = ttk.Frame(nb)
-nb.add(tab1, text="Apps")
-create_debloater_tab(tab1)
-tab2 = ttk.Frame(nb)
-nb.add(tab2, text="Display")
-create_display_tab(tab2)
-tab3 = ttk.Frame(nb)
-nb.add(tab3, text="Info")
-create_device_info_tab(tab3)
-root.after(2000, periodic_check)
-root.mainloop()
+    root.title("Mi Adb Kit")
+    root.geometry("800x600")
+    status_frame = ttk.Frame(root)
+    status_frame.pack(side='bottom', fill='x')
+    busy_label = ttk.Label(status_frame, text="")
+    busy_label.pack(side='left', padx=10)
+    busy_bar = ttk.Progressbar(status_frame, mode='indeterminate', length=120)
+    busy_bar.pack(side='right', padx=10, pady=2)
+    nb = ttk.Notebook(root)
+    nb.pack(expand=True, fill='both')
+    tab1 = ttk.Frame(nb)
+    nb.add(tab1, text="Apps")
+    create_debloater_tab(tab1)
+    tab2 = ttk.Frame(nb)
+    nb.add(tab2, text="Display")
+    create_display_tab(tab2)
+    tab3 = ttk.Frame(nb)
+    nb.add(tab3, text="Info")
+    create_device_info_tab(tab3)
+    tab4 = ttk.Frame(nb)
+    nb.add(tab4, text="Fleet")
+    create_fleet_tab(tab4)
+    tab5 = ttk.Frame(nb)
+    nb.add(tab5, text="Logs")
+    create_logs_tab(tab5)
+    nb.bind('<<NotebookTabChanged>>', on_tab_changed)
+    def on_close():
+        stop_logcat()
+        scheduler.shutdown()
+        fleet_pool.shutdown(wait=False, cancel_futures=True)
+        transfer_pool.shutdown(wait=False, cancel_futures=True)
+        root.destroy()
+
+    root.protocol("WM_DELETE_WINDOW", on_close)
+    root.bind('<Control-Shift-D>', lambda e: toggle_debug_panel())
+    root.bind('<Control-Shift-d>', lambda e: toggle_debug_panel())
+    root.after(50, drain_ui_queue)
+    root.after_idle(mark_startup, 'window')
+    run_in_background(None, start_adb, on_adb_started)
+    root.mainloop()
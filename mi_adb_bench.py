@@ -0,0 +1,486 @@
+import argparse
+import json
+import os
+import queue
+import re
+import shutil
+import socketserver
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from mi_adb_core import APP_DIR
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_FILE = os.path.join(APP_DIR, "mi_adb_bench_results.jsonl")
+SEARCH_QUERIES = ["com.android.", "miui", "com.user.app1"]
+APK_SIZE = 256 * 1024
+LOG_LINES = 50000
+STORE_DEVICES = 200
+STORE_FIRMWARES = 8
+SCRIPT_RE = re.compile(r'\{ (.*)\n\} </dev/null; echo "(\S+) \$\?"; echo \S+ >&2\n', re.S)
+
+class FakeDevice:
+    def __init__(self, serial, system_count, user_count):
+        self.serial = serial
+        self.lock = threading.Lock()
+        self.packages = {}
+        for i in range(system_count):
+            vendor = ("com.android", "com.miui", "com.xiaomi", "com.qualcomm")[i % 4]
+            self.packages[f"{vendor}.system{i}"] = [True, True]
+        for i in range(user_count):
+            self.packages[f"com.user.app{i}"] = [False, True]
+        self.props = {'ro.product.brand': "Xiaomi", 'ro.product.model': f"Fake {serial}", 'ro.product.device': "fake",
+                      'ro.system.build.version.incremental': "V1.0.0.0", 'ro.boot.verifiedbootstate': "green"}
+        self.wm = {'size': ["1080x2400", None], 'density': ["440", None]}
+        self.settings = {'miui_refresh_rate': "60", 'user_refresh_rate': "60"}
+        self.sessions = {}
+        self.screen = struct.pack('<IIII', 1080, 2400, 1, 0) + bytes(range(256)) * (1080 * 2400 * 4 // 256)
+
+    def apk_files(self, name):
+        with self.lock:
+            state = self.packages.get(name)
+        if not state or not state[1]:
+            return {}
+        directory = f"/system/app/{name}" if state[0] else f"/data/app/~~fake/{name}-1"
+        content = (name + "\n").encode() * (APK_SIZE // (len(name) + 1))
+        return {f"{directory}/base.apk": content, f"{directory}/split_config.arm64_v8a.apk": content[:APK_SIZE // 4]}
+
+    def read_file(self, path):
+        parts = path.split('/')
+        return self.apk_files(parts[-2].rsplit('-', 1)[0] if parts[1] == 'data' else parts[-2]).get(path)
+
+    def install_write(self, session, data):
+        with self.lock:
+            if session not in self.sessions:
+                return "Failure [invalid session]\n"
+            self.sessions[session].append(data)
+        return f"Success: streamed {len(data)} bytes\n"
+
+    def install_commit(self, session):
+        with self.lock:
+            files = self.sessions.pop(session, None)
+            if not files:
+                return "Failure [no APKs written]\n"
+            self.packages.setdefault(files[0].split(b'\n', 1)[0].decode(), [False, True])[1] = True
+        return "Success\n"
+
+    def list_packages(self, flags):
+        with self.lock:
+            items = list(self.packages.items())
+        return ''.join(f"package:{name}\n" for name, (system, installed) in items
+                       if (installed or '-u' in flags) and not ('-s' in flags and not system) and not ('-3' in flags and system))
+
+    def run(self, cmd):
+        cmd = cmd.replace(' 2>&1', '').strip()
+        words = cmd.split()
+        if cmd == 'echo':
+            return "\n"
+        if words[0] == 'echo':
+            return cmd[5:] + "\n"
+        if cmd.startswith('pm list packages'):
+            return self.list_packages(words[3:])
+        if words[0] == 'getprop':
+            return self.props.get(words[1], "") + "\n"
+        if words[0] == 'wm':
+            physical, override = self.wm[words[1]]
+            if len(words) > 2:
+                self.wm[words[1]][1] = None if words[2] == 'reset' else words[2]
+                return ""
+            return f"Physical {words[1]}: {physical}\n" + (f"Override {words[1]}: {override}\n" if override else "")
+        if words[:2] == ['settings', 'get']:
+            return self.settings.get(words[3], "null") + "\n"
+        if words[:2] == ['settings', 'put']:
+            self.settings[words[3]] = words[4]
+            return ""
+        if words[:2] == ['pm', 'uninstall']:
+            with self.lock:
+                state = self.packages.get(words[-1])
+                if not state or not state[1]:
+                    return "Failure [not installed for 0]\n"
+                if state[0]:
+                    state[1] = False
+                else:
+                    del self.packages[words[-1]]
+            return "Success\n"
+        if words[:3] == ['cmd', 'package', 'install-existing']:
+            with self.lock:
+                state = self.packages.get(words[-1])
+                if not state:
+                    return f"Package {words[-1]} doesn't exist\n"
+                state[1] = True
+            return f"Package {words[-1]} installed for user: 0\n"
+        if words[:2] == ['pm', 'path']:
+            return ''.join(f"package:{path}\n" for path in self.apk_files(words[2]))
+        if words[:3] == ['cmd', 'package', 'install-create']:
+            with self.lock:
+                session = str(len(self.sessions) + 1000)
+                self.sessions[session] = []
+            return f"Success: created install session [{session}]\n"
+        if words[:3] == ['cmd', 'package', 'install-commit']:
+            return self.install_commit(words[3])
+        if words[:3] == ['cmd', 'package', 'install-abandon']:
+            with self.lock:
+                self.sessions.pop(words[3], None)
+            return "Success\n"
+        if cmd == 'dumpsys package packages':
+            return self.dumpsys_package()
+        if cmd == 'dumpsys diskstats':
+            with self.lock:
+                names = list(self.packages)
+            return (f"Package Names: {json.dumps(names)}\nApp Sizes: {json.dumps([4096 * len(name) for name in names])}\n"
+                    f"App Data Sizes: {json.dumps([1024 * len(name) for name in names])}\nCache Sizes: {json.dumps([0] * len(names))}\n")
+        if cmd == 'cat /proc/version':
+            return "Linux version 5.10.0-fake (builder@fake)\n"
+        return ""
+
+    def dumpsys_package(self):
+        with self.lock:
+            items = list(self.packages.items())
+        lines = ["Database versions:", "  Internal:", "    sdkVersion=34", "", "Packages:"]
+        for i, (name, (system, installed)) in enumerate(items):
+            lines += [f"  Package [{name}] ({i:07x}):", f"    userId={10000 + i}",
+                      f"    codePath=/{'system/app' if system else 'data/app'}/{name}", f"    versionCode={i + 1} minSdk=28 targetSdk=34",
+                      f"    versionName=1.{i}", f"    pkgFlags=[ {'SYSTEM ' if system else ''}HAS_CODE ALLOW_CLEAR_USER_DATA ]",
+                      "    firstInstallTime=2024-01-01 00:00:00", "    lastUpdateTime=2024-06-01 12:00:00",
+                      f"    installerPackageName={'null' if system else 'com.android.vending'}",
+                      f"    User 0: ceDataInode={i} installed={'true' if installed else 'false'} hidden=false enabled=0",
+                      "      gids=[3003]"]
+        lines += ["", "Hidden system packages:", "  Package [com.hidden] (0):", ""]
+        return '\n'.join(lines)
+
+    def run_script(self, script):
+        return ''.join(self.run(part) for part in script.split('; '))
+
+class FakeAdbHandler(socketserver.BaseRequestHandler):
+    def recv_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return bytes(data)
+
+    def reply(self, payload=None):
+        self.request.sendall(b'OKAY' + (b'' if payload is None else b'%04x' % len(payload) + payload))
+
+    def fail(self, message):
+        self.request.sendall(b'FAIL%04x' % len(message) + message.encode())
+
+    def handle(self):
+        server = self.server
+        device = None
+        try:
+            while True:
+                request = self.recv_exact(int(self.recv_exact(4), 16)).decode()
+                if request == 'host:devices':
+                    return self.reply(server.device_list())
+                if request == 'host:track-devices':
+                    self.reply(server.device_list())
+                    server.stopped.wait()
+                    return
+                if request.startswith('host:transport'):
+                    serial = request.partition('host:transport:')[2]
+                    device = server.devices.get(serial) if serial else next(iter(server.devices.values()), None)
+                    if device is None or (not serial and len(server.devices) > 1):
+                        return self.fail("device not found" if device is None else "more than one device")
+                    self.reply()
+                elif request == 'shell,v2,raw:':
+                    self.reply()
+                    return self.shell_v2(device)
+                elif request == 'sync:':
+                    self.reply()
+                    return self.sync(device)
+                elif request.startswith('exec:cmd package install-write'):
+                    self.reply()
+                    words = request.split()
+                    data = self.recv_exact(int(words[4]))
+                    self.request.sendall(device.install_write(words[5], data).encode())
+                    return
+                elif request == 'exec:screencap':
+                    self.reply()
+                    server.delay()
+                    self.request.sendall(device.screen)
+                    return
+                elif request.startswith('exec:cmd package install '):
+                    self.reply()
+                    data = self.recv_exact(int(request.split()[-1]))
+                    session = device.run('cmd package install-create').split('[')[1].split(']')[0]
+                    device.install_write(session, data)
+                    self.request.sendall(device.install_commit(session).encode())
+                    return
+                elif request.startswith('shell:logcat'):
+                    self.reply()
+                    return self.logcat(device)
+                elif request.startswith('shell:'):
+                    self.reply()
+                    server.delay()
+                    self.request.sendall(device.run_script(request[6:]).encode())
+                    return
+                else:
+                    return self.fail(f"unsupported {request}")
+        except (ConnectionError, OSError):
+            pass
+
+    def logcat(self, device):
+        with device.lock:
+            names = list(device.packages)
+        levels = "VDIWE"
+        lines = [f"10-18 12:00:{i % 60:02d}.{i % 1000:03d}  {1000 + i % 50:5d}  {2000 + i % 7:5d} {levels[i % 5]} Tag{i % 20}: message {i} from {names[i % len(names)]}\n"
+                 for i in range(LOG_LINES)]
+        for start in range(0, len(lines), 500):
+            self.request.sendall(''.join(lines[start:start + 500]).encode())
+        while self.request.recv(4096):
+            pass
+
+    def sync(self, device):
+        while True:
+            command, length = struct.unpack('<4sI', self.recv_exact(8))
+            if command != b'RECV':
+                return
+            self.server.delay()
+            content = device.read_file(self.recv_exact(length).decode())
+            if content is None:
+                message = b"No such file or directory"
+                self.request.sendall(b'FAIL' + struct.pack('<I', len(message)) + message)
+                continue
+            for start in range(0, len(content), 65536):
+                chunk = content[start:start + 65536]
+                self.request.sendall(b'DATA' + struct.pack('<I', len(chunk)) + chunk)
+            self.request.sendall(b'DONE' + struct.pack('<I', 0))
+
+    def shell_v2(self, device):
+        buffer = ""
+        while True:
+            packet_id, length = struct.unpack('<BI', self.recv_exact(5))
+            buffer += self.recv_exact(length).decode()
+            match = SCRIPT_RE.match(buffer)
+            if not match:
+                continue
+            buffer = buffer[match.end():]
+            self.server.delay()
+            output = (device.run_script(match.group(1)) + f"{match.group(2)} 0\n").encode()
+            marker = (match.group(2) + "\n").encode()
+            self.request.sendall(struct.pack('<BI', 1, len(output)) + output + struct.pack('<BI', 2, len(marker)) + marker)
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, devices, latency_ms=0, handler=None):
+        super().__init__(('127.0.0.1', 0), handler or FakeAdbHandler)
+        self.devices = {device.serial: device for device in devices}
+        self.latency = latency_ms / 1000
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def device_list(self):
+        return ''.join(f"{serial}\tdevice\n" for serial in self.devices).encode()
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def stop(self):
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
+
+def measure(work, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        work()
+        times.append((time.perf_counter() - started) * 1000)
+    return {'runs': repeat, 'min_ms': round(min(times), 2), 'median_ms': round(statistics.median(times), 2), 'mean_ms': round(statistics.mean(times), 2)}
+
+def pump_gui(app, done, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while not done():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("GUI benchmark timed out")
+        app.root.update()
+        while True:
+            try:
+                callback, args = app.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            callback(*args)
+        time.sleep(0.001)
+
+def gui_idle(app):
+    return app.busy_count == 0 and app.ui_queue.empty() and not app.task_futures
+
+def seed_store(core, store, conn, inventory, snapshots):
+    for i in range(snapshots):
+        flags = bytearray(inventory.flags)
+        for j in range(i % 20):
+            flags[(i * 31 + j * 97) % len(flags)] ^= core.INSTALLED
+        info = ("Xiaomi", f"Fake {i % STORE_DEVICES}", "fake", f"V{i % STORE_FIRMWARES}.0.0.0")
+        store.record_inventory(conn, f"dev-{i % STORE_DEVICES:04}", info, "5.10.0-fake", core.PackageInventory(inventory.names, flags), i)
+
+def build_gui(app, tk, ttk):
+    app.root = tk.Tk()
+    app.root.withdraw()
+    app.busy_label = ttk.Label(app.root)
+    app.busy_bar = ttk.Progressbar(app.root)
+    app.nb = ttk.Notebook(app.root)
+    app.startup_times['device'] = 0
+    for create in (app.create_debloater_tab, app.create_display_tab, app.create_device_info_tab):
+        create(ttk.Frame(app.nb))
+
+def run_benchmarks(args):
+    import mi_adb_core as core
+    import Mi_Adb_Kit as app
+    server = FakeAdbServer([FakeDevice("fake-0001", args.packages, args.user_packages)], args.latency_ms)
+    core.ADB_SERVER = ('127.0.0.1', server.port)
+    core.SNAPSHOT_DIR = tempfile.mkdtemp(prefix="mi_adb_bench_")
+    core.APK_STORE_DIR = os.path.join(core.SNAPSHOT_DIR, "apks")
+    device = server.devices["fake-0001"]
+    serial = device.serial
+    results = {}
+    try:
+        env = dict(os.environ, ANDROID_ADB_SERVER_PORT=str(server.port), APPDATA=core.SNAPSHOT_DIR)
+        cli = [sys.executable, os.path.join(HERE, "mi_adb_cli.py"), '--json', 'info']
+        results['cli_cold_start'] = measure(lambda: subprocess.run(cli, env=env, capture_output=True, check=True), args.repeat)
+        results['gui_import'] = measure(lambda: subprocess.run([sys.executable, '-c', 'import Mi_Adb_Kit'], cwd=HERE, env=env, capture_output=True, check=True), args.repeat)
+        core.start_device_tracker()
+        clear_snapshots = lambda: [os.remove(os.path.join(core.SNAPSHOT_DIR, name)) for name in os.listdir(core.SNAPSHOT_DIR) if name.endswith('.json')]
+        results['load_device_cold'] = measure(lambda: core.load_device(serial), args.repeat, clear_snapshots)
+        key = core.load_device(serial)[3]
+        results['load_device_cached'] = measure(lambda: core.load_device(serial), args.repeat)
+        inventory = core.load_snapshot(key)
+        results['validate_snapshot'] = measure(lambda: core.validate_snapshot(key, inventory), args.repeat)
+        results['package_metadata'] = measure(lambda: core.fetch_package_metadata(serial), args.repeat)
+        results['search_index_build'] = measure(lambda: app.build_search_index(inventory, core.INSTALLED), args.repeat)
+        index = app.build_search_index(inventory, core.INSTALLED)
+        keystrokes = [query[:i] for query in SEARCH_QUERIES for i in range(1, len(query) + 1)]
+        search = measure(lambda: [app.search_packages(index, prefix) for prefix in keystrokes], args.repeat)
+        results['search_per_keystroke'] = {name: round(value / len(keystrokes), 3) if name != 'runs' else value for name, value in search.items()}
+        victims = inventory.select(core.INSTALLED, core.INSTALLED | core.SYSTEM)[:args.batch]
+        def uninstall_refresh():
+            core.run_package_commands([f'pm uninstall --user 0 {pkg}' for pkg in victims], serial)
+            core.validate_snapshot(key, inventory)
+        def restore():
+            with device.lock:
+                device.packages.update((pkg, [False, True]) for pkg in victims)
+        results['uninstall_refresh'] = measure(uninstall_refresh, args.repeat, restore)
+        restore()
+        clear_store = lambda: shutil.rmtree(core.APK_STORE_DIR, ignore_errors=True)
+        results['apk_backup'] = measure(lambda: core.backup_packages(victims, serial), args.repeat, clear_store)
+        def remove_victims():
+            with device.lock:
+                for pkg in victims:
+                    device.packages.pop(pkg, None)
+        results['apk_restore'] = measure(lambda: core.restore_packages(victims, serial), args.repeat, remove_victims)
+        def write_dpi_and_refresh():
+            core.write_wm('density', '400', serial)
+            core.get_display_state(serial=serial)
+            core.write_wm('density', 'reset', serial)
+            core.get_display_state(serial=serial)
+        results['dpi_write_refresh'] = measure(write_dpi_and_refresh, args.repeat)
+        preview = core.ScreenPreview(serial)
+        results['screen_preview_frame'] = measure(preview.grab, args.repeat)
+        def stream_logcat():
+            stream = core.LogcatStream(serial)
+            stream.set_filter("Tag1", "com.user.app1")
+            stream.start()
+            while stream.received < LOG_LINES and stream.thread.is_alive():
+                time.sleep(0.001)
+            stream.stop()
+        results['logcat_50k_lines'] = measure(stream_logcat, args.repeat)
+        import mi_adb_store as store
+        db = os.path.join(core.SNAPSHOT_DIR, "inventory.db")
+        results['inventory_record'] = measure(lambda: store.record_device(serial, db), args.repeat)
+        conn = store.open_store(db)
+        try:
+            seed_store(core, store, conn, inventory, args.snapshots)
+            package = inventory.names[len(inventory) // 2]
+            results['inventory_where'] = measure(lambda: store.firmware_with_package(conn, package), args.repeat)
+            results['inventory_diff'] = measure(lambda: store.diff_devices(conn, "dev-0000", "dev-0001"), args.repeat)
+            results['inventory_history'] = measure(lambda: store.package_history(conn, package), args.repeat)
+        finally:
+            conn.close()
+        try:
+            import tkinter as tk
+            from tkinter import ttk
+            build_gui(app, tk, ttk)
+        except Exception as e:
+            print(f"Skipping GUI benchmarks: {e}", file=sys.stderr)
+        else:
+            app.scheduler = core.DeviceScheduler(core.FLEET_WORKERS)
+            app.selected_serial = serial
+            def refresh_adb():
+                app.refresh_adb(show_popup=False, force_refresh=True)
+                pump_gui(app, lambda: gui_idle(app))
+            results['gui_refresh_adb'] = measure(refresh_adb, args.repeat)
+            results['gui_refresh_lists'] = measure(app.refresh_lists, args.repeat)
+            gui_search = measure(lambda: [app.filter_list(app.tree1, prefix) for prefix in keystrokes], args.repeat)
+            results['gui_filter_per_keystroke'] = {name: round(value / len(keystrokes), 3) if name != 'runs' else value for name, value in gui_search.items()}
+            app.root.destroy()
+            app.scheduler.shutdown()
+    finally:
+        server.stop()
+    return results
+
+def git_revision():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True, text=True, timeout=5)
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+def load_runs(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except OSError:
+        return []
+
+def print_results(run, previous):
+    baseline = previous['results'] if previous else {}
+    print(f"{'benchmark':<26}{'median ms':>12}{'min ms':>12}{'change':>10}")
+    for name, result in run['results'].items():
+        change = ""
+        if name in baseline and baseline[name]['median_ms']:
+            change = f"{(result['median_ms'] / baseline[name]['median_ms'] - 1) * 100:+.1f}%"
+        print(f"{name:<26}{result['median_ms']:>12}{result['min_ms']:>12}{change:>10}")
+    if previous:
+        print(f"\ncompared with {previous['revision'] or 'unknown'} at {previous['time']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='mi-adb-bench', description="Benchmark Mi Adb Kit against a fake adb server.")
+    parser.add_argument('--packages', type=int, default=3000, help="system packages on the fake device")
+    parser.add_argument('--user-packages', type=int, default=300, help="user packages on the fake device")
+    parser.add_argument('--latency-ms', type=float, default=5, help="simulated round-trip latency per shell command")
+    parser.add_argument('--batch', type=int, default=20, help="packages uninstalled by the uninstall benchmark")
+    parser.add_argument('--snapshots', type=int, default=2000, help=f"inventory snapshots recorded across {STORE_DEVICES} devices for the store queries")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=RESULTS_FILE, help="JSON lines file the results are appended to")
+    parser.add_argument('--no-store', action='store_true', help="do not append this run to the results file")
+    args = parser.parse_args(argv)
+    params = {'packages': args.packages, 'user_packages': args.user_packages, 'latency_ms': args.latency_ms, 'batch': args.batch, 'snapshots': args.snapshots}
+    run = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'revision': git_revision(), 'python': sys.version.split()[0],
+           'params': params, 'results': run_benchmarks(args)}
+    previous = [past for past in load_runs(args.output) if past.get('params') == params]
+    print_results(run, previous[-1] if previous else None)
+    if not args.no_store:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(run) + '\n')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+import argparse
+import json
+import re
+import sys
+import time
+from mi_adb_core import (AdbError, DISPLAY_QUERIES, FPS_CHOICES, FrameSampler, INFO_QUERIES, INSTALLED, SYSTEM, adb_device_states, apk_sets,
+                         apply_profile, backup_packages, export_trace, fetch_inventory, fetch_package_metadata, format_size,
+                         get_display_state, get_info_state, install_apk_sets, is_package_name, list_backups, list_packages, load_profile,
+                         package_error, profile_from_state, read_profile_state, restore_packages, run_adb_batch, run_fleet,
+                         run_package_commands, trace_summary, uninstall_commands, uninstall_with_backup, write_refresh_rate, write_wm)
+from mi_adb_store import STORE_PATH, diff_devices, firmware_with_package, open_store, package_history, record_device, stored_devices
+
+def package_name(value):
+    if not is_package_name(value):
+        raise argparse.ArgumentTypeError(f"invalid package name: {value!r}")
+    return value
+
+def pick_serial(serial):
+    states = adb_device_states()
+    if serial:
+        return (serial, None) if states.get(serial) == 'device' else (None, f"Device {serial} not connected")
+    serials = [serial for serial, state in states.items() if state == 'device']
+    if not serials:
+        return None, "No device connected"
+    if len(serials) > 1:
+        return None, "More than one device connected, use --serial"
+    return serials[0], None
+
+def cmd_devices(args):
+    return {'devices': [{'serial': serial, 'state': state} for serial, state in adb_device_states().items()]}
+
+def cmd_info(args):
+    out = run_adb_batch(INFO_QUERIES + DISPLAY_QUERIES, serial=args.serial)
+    (brand, model, code, version), kernel, root_status, bootloader = get_info_state(out)
+    (original_res, current_res), (original_dpi, current_dpi), fps, user_fps = get_display_state(out)
+    return {'serial': args.serial, 'brand': brand, 'model': model, 'device': code, 'build': version,
+            'kernel': kernel, 'root': root_status, 'bootloader': bootloader,
+            'resolution': current_res, 'original_resolution': original_res,
+            'dpi': current_dpi, 'original_dpi': original_dpi, 'fps': fps, 'user_fps': user_fps}
+
+def cmd_list(args):
+    inventory = fetch_inventory(args.serial)
+    want = 0 if args.uninstalled else INSTALLED
+    mask = INSTALLED | SYSTEM if args.system or args.user else INSTALLED
+    packages = inventory.select(want | SYSTEM if args.system else want, mask)
+    metadata = fetch_package_metadata(args.serial) if args.details else {}
+    return {'serial': args.serial, 'packages': [dict(metadata.get(pkg, {}), name=pkg, system=inventory.has(pkg, SYSTEM)) for pkg in packages]}
+
+def package_results(serial, packages, outputs, success_words):
+    results = [{'name': pkg, 'error': package_error(output, success_words)} for pkg, output in zip(packages, outputs)]
+    return {'serial': serial, 'results': results, 'failed': sum(result['error'] is not None for result in results)}
+
+def cmd_uninstall(args):
+    system_all = set(list_packages('pm list packages -s -u', args.serial)) if args.keep_data or args.backup else set()
+    if args.backup:
+        outputs = uninstall_with_backup(args.packages, system_all, args.keep_data, args.serial)
+    else:
+        outputs = run_package_commands(uninstall_commands(args.packages, system_all, args.keep_data), args.serial)
+    return package_results(args.serial, args.packages, outputs, ["Success"])
+
+def cmd_reinstall(args):
+    outputs = run_package_commands([f'cmd package install-existing {pkg}' for pkg in args.packages], args.serial)
+    return package_results(args.serial, args.packages, outputs, ["Success", "Package"])
+
+def error_results(serial, packages, errors):
+    results = [{'name': pkg, 'error': error} for pkg, error in zip(packages, errors)]
+    return {'serial': serial, 'results': results, 'failed': sum(error is not None for error in errors)}
+
+def cmd_backup(args):
+    return error_results(args.serial, args.packages, backup_packages(args.packages, args.serial))
+
+def cmd_restore(args):
+    return error_results(args.serial, args.packages, restore_packages(args.packages, args.serial, sources=dict.fromkeys(args.packages, args.source) if args.source else None))
+
+def cmd_install(args):
+    results = install_apk_sets(apk_sets(args.paths), args.serial)
+    return {'serial': args.serial, 'results': results, 'failed': sum(result['error'] is not None for result in results)}
+
+def cmd_backups(args):
+    return {'backups': [{'package': backup['package'], 'serial': backup['serial'], 'time': backup['time'], 'files': len(backup['files']),
+                         'size': sum(file['size'] for file in backup['files'])} for backup in list_backups()]}
+
+def cmd_record(args):
+    if not args.all:
+        serial, error = pick_serial(args.serial)
+        return {'error': error} if error else record_device(serial, args.db)
+    serials = [serial for serial, state in adb_device_states().items() if state == 'device']
+    if not serials:
+        return {'error': "No device connected"}
+    results = [dict(result, name=serial, error=result.get('error')) for serial, result in sorted(run_fleet(serials, record_device, args.db).items())]
+    return {'results': results, 'failed': sum(result['error'] is not None for result in results)}
+
+def query_store(args, query, *params):
+    conn = open_store(args.db)
+    try:
+        return query(conn, *params)
+    finally:
+        conn.close()
+
+def cmd_where(args):
+    return {'package': args.package, 'rows': query_store(args, firmware_with_package, args.package)}
+
+def cmd_diff(args):
+    rows = query_store(args, diff_devices, args.serial_a, args.serial_b)
+    if rows is None:
+        return {'error': "Both devices must be recorded first"}
+    return {'rows': rows}
+
+def cmd_history(args):
+    rows = query_store(args, package_history, args.package)
+    for row in rows:
+        row['time'] = time.strftime('%Y-%m-%d %H:%M', time.localtime(row['time']))
+    return {'package': args.package, 'rows': rows}
+
+def cmd_stored(args):
+    rows = query_store(args, stored_devices)
+    for row in rows:
+        row['seen'] = time.strftime('%Y-%m-%d %H:%M', time.localtime(row['seen']))
+    return {'rows': rows}
+
+def cmd_set_resolution(args):
+    if args.value != 'reset' and not re.fullmatch(r'[1-9]\d*x[1-9]\d*', args.value):
+        return {'error': "Resolution must be WIDTHxHEIGHT or reset"}
+    return {'serial': args.serial, 'resolution': args.value, 'ok': write_wm('size', args.value, args.serial)}
+
+def cmd_set_dpi(args):
+    if args.value != 'reset' and not (args.value.isdigit() and int(args.value) > 0):
+        return {'error': "DPI must be a positive number or reset"}
+    return {'serial': args.serial, 'dpi': args.value, 'ok': write_wm('density', args.value, args.serial)}
+
+def cmd_set_fps(args):
+    if args.value not in FPS_CHOICES:
+        return {'error': "FPS must be 30, 60, 90, 120, 144, or 165"}
+    ok = write_refresh_rate(args.value, args.serial)
+    return {'serial': args.serial, 'fps': args.value, 'ok': ok is not False, 'changed': ok is not None}
+
+def cmd_apply_profile(args):
+    try:
+        profile = load_profile(args.path)
+        results = apply_profile(profile, args.serial, args.dry_run)
+    except (OSError, ValueError, AdbError) as e:
+        return {'error': str(e)}
+    actions = [{'action': action, 'target': target, 'error': error} for action, target, error in results]
+    return {'serial': args.serial, 'dry_run': args.dry_run, 'actions': actions, 'failed': sum(action['error'] is not None for action in actions)}
+
+def cmd_save_profile(args):
+    state = read_profile_state(args.serial)
+    if state is None:
+        return {'error': "No device connected"}
+    profile = profile_from_state(state)
+    try:
+        with open(args.path, 'w', encoding='utf-8') as f:
+            json.dump(profile, f, indent=2)
+    except OSError as e:
+        return {'error': str(e)}
+    return {'serial': args.serial, 'path': args.path, 'removed': len(profile['remove'])}
+
+def cmd_measure_fps(args):
+    sampler = FrameSampler(args.serial)
+    deadline = time.perf_counter() + args.seconds
+    while True:
+        stats = sampler.sample()
+        if time.perf_counter() >= deadline:
+            break
+        time.sleep(args.interval)
+    if args.expect and stats['panel_hz'] is not None and stats['panel_hz'] < args.expect - 1:
+        stats['error'] = f"Requested {args.expect} Hz but the panel runs at {stats['panel_hz']:g} Hz"
+    return dict(stats, serial=args.serial)
+
+def print_text(result):
+    if 'error' in result:
+        print(f"Error: {result['error']}", file=sys.stderr)
+    if 'devices' in result:
+        for device in result['devices']:
+            print(f"{device['serial']}\t{device['state']}")
+    elif 'packages' in result:
+        for pkg in result['packages']:
+            if 'version' in pkg:
+                print(f"{pkg['name']}\t{pkg['version']}\t{pkg['enabled']}\t{pkg['installer']}\t{format_size(pkg.get('code_size'))}")
+            else:
+                print(pkg['name'])
+    elif 'backups' in result:
+        for backup in result['backups']:
+            print(f"{backup['package']}\t{backup['files']} files\t{format_size(backup['size'])}\t"
+                  f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(backup['time']))}\t{backup['serial'] or ''}")
+    elif 'results' in result:
+        for pkg in result['results']:
+            if 'bytes' in pkg:
+                print(f"{pkg['name']}\t{pkg['error'] or 'Success'}\t{format_size(pkg['bytes'])} in {pkg['seconds']} s\t{pkg['mb_per_s']} MB/s")
+            else:
+                print(f"{pkg['name']}\t{pkg['error'] or 'Success'}")
+    elif 'rows' in result:
+        for row in result['rows']:
+            print('\t'.join(str(value) for value in row.values()))
+        if not result['rows']:
+            print("No matching records")
+    elif 'actions' in result:
+        for action in result['actions']:
+            print(f"{action['action']}\t{action['target']}\t{'Pending' if result['dry_run'] else action['error'] or 'Success'}")
+        if not result['actions']:
+            print("Device already matches profile")
+    else:
+        for key, value in result.items():
+            if key not in ('serial', 'error'):
+                print(f"{key}: {value}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='mi-adb-kit', description="Manage Android apps, resolution, DPI and FPS via ADB.")
+    parser.add_argument('-s', '--serial', help="device serial, required when more than one device is connected")
+    parser.add_argument('--json', action='store_true', help="print machine-readable JSON")
+    parser.add_argument('--trace', metavar='PATH', help="write a Chrome trace of every adb call to PATH")
+    parser.add_argument('--stats', action='store_true', help="print per-command adb latency statistics to stderr")
+    parser.add_argument('--db', metavar='PATH', default=STORE_PATH, help=f"inventory database (default {STORE_PATH})")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('devices', help="list connected devices").set_defaults(func=cmd_devices, needs_device=False)
+    sub.add_parser('info', help="show device and display information").set_defaults(func=cmd_info)
+    p = sub.add_parser('list', help="list packages")
+    p.add_argument('-u', '--uninstalled', action='store_true', help="list uninstalled packages instead of installed ones")
+    p.add_argument('-d', '--details', action='store_true', help="include version, state, installer, path, install times and sizes")
+    group = p.add_mutually_exclusive_group()
+    group.add_argument('--system', action='store_true', help="only system packages")
+    group.add_argument('--user', action='store_true', help="only user packages")
+    p.set_defaults(func=cmd_list)
+    p = sub.add_parser('uninstall', help="uninstall packages for user 0")
+    p.add_argument('packages', nargs='+', type=package_name)
+    p.add_argument('-k', '--keep-data', action='store_true', help="keep data of system apps for future reinstall")
+    p.add_argument('-b', '--backup', action='store_true', help="back up the APKs of user apps first and skip any that fail")
+    p.set_defaults(func=cmd_uninstall)
+    p = sub.add_parser('reinstall', help="reinstall previously uninstalled packages")
+    p.add_argument('packages', nargs='+', type=package_name)
+    p.set_defaults(func=cmd_reinstall)
+    p = sub.add_parser('install', help="stream APKs into the package installer; a directory or base.apk with split_*.apk files installs as one app")
+    p.add_argument('paths', nargs='+')
+    p.set_defaults(func=cmd_install)
+    p = sub.add_parser('backup', help="pull the APKs of packages into the local backup store")
+    p.add_argument('packages', nargs='+', type=package_name)
+    p.set_defaults(func=cmd_backup)
+    p = sub.add_parser('restore', help="install packages from the local backup store")
+    p.add_argument('packages', nargs='+', type=package_name)
+    p.add_argument('--from', dest='source', metavar='SERIAL', help="use the backup taken from this device instead of the target's own or the newest one")
+    p.set_defaults(func=cmd_restore)
+    sub.add_parser('backups', help="list packages in the local backup store").set_defaults(func=cmd_backups, needs_device=False)
+    p = sub.add_parser('record', help="record the device's package inventory in the inventory database, writing only changed packages")
+    p.add_argument('-a', '--all', action='store_true', help="record every connected device")
+    p.set_defaults(func=cmd_record, needs_device=False)
+    p = sub.add_parser('where', help="show which firmware versions in the inventory database ship a package")
+    p.add_argument('package')
+    p.set_defaults(func=cmd_where, needs_device=False)
+    p = sub.add_parser('diff', help="compare the recorded packages of two devices")
+    p.add_argument('serial_a')
+    p.add_argument('serial_b')
+    p.set_defaults(func=cmd_diff, needs_device=False)
+    p = sub.add_parser('history', help="show recorded state changes of a package across devices")
+    p.add_argument('package')
+    p.set_defaults(func=cmd_history, needs_device=False)
+    sub.add_parser('stored', help="list devices in the inventory database").set_defaults(func=cmd_stored, needs_device=False)
+    p = sub.add_parser('set-resolution', help="set resolution (WIDTHxHEIGHT) or reset")
+    p.add_argument('value')
+    p.set_defaults(func=cmd_set_resolution)
+    p = sub.add_parser('set-dpi', help="set DPI or reset")
+    p.add_argument('value')
+    p.set_defaults(func=cmd_set_dpi)
+    p = sub.add_parser('set-fps', help="set refresh rate")
+    p.add_argument('value', type=int)
+    p.set_defaults(func=cmd_set_fps)
+    p = sub.add_parser('measure-fps', help="measure the panel refresh rate, effective FPS and jank from SurfaceFlinger")
+    p.add_argument('--seconds', type=float, default=5)
+    p.add_argument('--interval', type=float, default=0.5, help="seconds between samples, SurfaceFlinger keeps only the last 127 frames")
+    p.add_argument('--expect', type=int, help="fail if the panel runs below this refresh rate")
+    p.set_defaults(func=cmd_measure_fps)
+    p = sub.add_parser('apply-profile', help="apply a JSON or TOML profile, sending only the changes the device needs")
+    p.add_argument('path')
+    p.add_argument('-n', '--dry-run', action='store_true', help="show the changes without applying them")
+    p.set_defaults(func=cmd_apply_profile)
+    p = sub.add_parser('save-profile', help="save the device's current packages and display settings as a JSON profile")
+    p.add_argument('path')
+    p.set_defaults(func=cmd_save_profile)
+    args = parser.parse_args(argv)
+    result = None
+    if getattr(args, 'needs_device', True):
+        args.serial, error = pick_serial(args.serial)
+        if error:
+            result = {'error': error}
+    if result is None:
+        result = args.func(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_text(result)
+    if args.trace:
+        export_trace(args.trace)
+    if args.stats:
+        for row in trace_summary():
+            print(f"{row['kind']}\t{row['command']}\tcount {row['count']}\terrors {row['errors']}\tavg {row['avg_ms']} ms\t"
+                  f"p95 {row['p95_ms']} ms\tmax {row['max_ms']} ms\t{row['bytes']} bytes", file=sys.stderr)
+    return 1 if 'error' in result or result.get('failed') or result.get('ok') is False else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
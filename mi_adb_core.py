@@ -0,0 +1,1746 @@
+import bisect
+import codecs
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import re
+import select
+import shlex
+import socket
+import struct
+import subprocess
+import threading
+import time
+import sys
+import weakref
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+ADB_SERVER = ("127.0.0.1", int(os.environ.get("ANDROID_ADB_SERVER_PORT", "5037")))
+ADB_POOL_SIZE = 3
+NO_WINDOW = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+SHELL_V2_STDIN, SHELL_V2_STDOUT, SHELL_V2_STDERR, SHELL_V2_EXIT = 0, 1, 2, 3
+adb_session_pool = {}
+adb_pool_lock = threading.Lock()
+adb_v1_serials = set()
+device_states = {}
+device_states_lock = threading.Lock()
+device_tracker_thread = None
+device_tracker_live = threading.Event()
+device_change_event = threading.Event()
+
+BATCH_SEPARATOR = "__MAK_BATCH__"
+DEVICE_PROPS = ['getprop ro.product.brand', 'getprop ro.product.model', 'getprop ro.product.device',
+                'getprop ro.system.build.version.incremental']
+INFO_QUERIES = DEVICE_PROPS + ['cat /proc/version', 'which su', 'getprop ro.boot.verifiedbootstate']
+DISPLAY_QUERIES = ['wm size', 'wm density', 'settings get secure miui_refresh_rate', 'settings get secure user_refresh_rate']
+UNKNOWN_DISPLAY_STATE = (("Unknown", "Unknown"), ("Unknown", "Unknown"), "Unknown", "Unknown")
+APP_DIR = os.path.join(os.environ.get("APPDATA") or os.path.expanduser("~"), "Mi_Adb_Kit")
+SNAPSHOT_DIR = os.path.join(APP_DIR, "snapshots")
+APK_STORE_DIR = os.path.join(APP_DIR, "apks")
+TRANSFER_STREAMS = 4
+SYNC_CHUNK = 65536
+INSTALL_CHUNK = 262144
+INSTALL_TIMEOUT = 300
+PREVIEW_HEIGHT = 400
+SCREENCAP_FORMATS = {1: (0, 2), 2: (0, 2), 5: (2, 0)}
+LOG_BUFFER_SIZE = 5000
+LOG_LEVELS = "VDIWEF"
+LOG_BACKLOG = 1000
+LOG_PID_REFRESH = 2
+PACKAGE_NAME_RE = re.compile(r'[\w.]+')
+SHA256_RE = re.compile(r'[0-9a-f]{64}')
+PACKAGE_CMDS = ('pm uninstall -k --user 0 ', 'pm uninstall --user 0 ', 'cmd package install-existing ', 'pm path ', 'pidof ')
+LOGCAT_RE = re.compile(r'(\d\d-\d\d \d\d:\d\d:\d\d\.\d+)\s+(\d+)\s+\d+\s+([VDIWEF])\s+(.*?)\s*: (.*)')
+PACKAGE_BATCH_SIZE = 10
+FRAME_BUFFER_SIZE = 600
+LAYER_CANDIDATES = 8
+PENDING_FENCE = 9223372036854775807
+ENABLED_STATES = {'0': "Enabled", '1': "Enabled", '2': "Disabled", '3': "Disabled by user", '4': "Disabled until used"}
+FLEET_WORKERS = 8
+PRIORITY_WRITE, PRIORITY_READ, PRIORITY_PREFETCH = 0, 1, 2
+SCHEDULER_PER_DEVICE = 3
+FPS_CHOICES = [30, 60, 90, 120, 144, 165]
+PROFILE_KEYS = {'remove', 'keep', 'keep_data', 'resolution', 'dpi', 'fps'}
+INSTALLED, SYSTEM = 1, 2
+INVENTORY_QUERIES = ['pm list packages', 'pm list packages -s -u', 'pm list packages -3 -u']
+SNAPSHOT_QUERIES = ['pm list packages', 'pm list packages -u']
+PROFILE_QUERIES = INVENTORY_QUERIES + DISPLAY_QUERIES
+READ_TTLS = {**dict.fromkeys(INFO_QUERIES, 600), **dict.fromkeys(DISPLAY_QUERIES, 30)}
+WRITE_EFFECTS = {'wm size': ['wm size'], 'wm density': ['wm density'],
+                 'settings put secure miui_refresh_rate': ['settings get secure miui_refresh_rate'],
+                 'settings put secure user_refresh_rate': ['settings get secure user_refresh_rate']}
+UNKNOWN_INFO_STATE = (("Unknown", "Unknown", "Unknown", "Unknown"), "Unknown", "Unknown", "Unknown")
+TRACE_LIMIT = 20000
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+TRACE_STARTED = time.perf_counter()
+
+fleet_pool = ThreadPoolExecutor(max_workers=FLEET_WORKERS)
+transfer_pool = ThreadPoolExecutor(max_workers=TRANSFER_STREAMS)
+trace_events = deque(maxlen=TRACE_LIMIT)
+trace_stats = {}
+trace_lock = threading.Lock()
+read_cache = {}
+read_cache_lock = threading.Lock()
+active_transports = {}
+active_transports_lock = threading.Lock()
+device_schedulers = weakref.WeakSet()
+
+def command_key(cmd):
+    if BATCH_SEPARATOR in cmd:
+        return f"batch of {cmd.count(BATCH_SEPARATOR)}"
+    words = cmd.replace(' 2>&1', '').split()
+    return ' '.join('*' if re.search(r'\d', word) or (words[0] in ('pm', 'cmd') and '.' in word) else word for word in words)
+
+def trace_call(kind, cmd, serial, started, size=0, outcome="ok"):
+    ended = time.perf_counter()
+    key = command_key(cmd)
+    ms = (ended - started) * 1000
+    with trace_lock:
+        trace_events.append((kind, key, cmd, serial, started, ended, size, outcome, threading.get_ident()))
+        stats = trace_stats.get((kind, key))
+        if stats is None:
+            stats = trace_stats[kind, key] = {'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'bytes': 0,
+                                              'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+        stats['count'] += 1
+        stats['errors'] += outcome != "ok"
+        stats['total_ms'] += ms
+        stats['max_ms'] = max(stats['max_ms'], ms)
+        stats['bytes'] += size
+        stats['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+
+def bucket_percentile(buckets, max_ms, q):
+    target = q * sum(buckets)
+    seen = 0
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= target and count:
+            return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else max_ms
+    return 0
+
+def trace_summary():
+    with trace_lock:
+        items = [(kind, key, dict(stats, buckets=list(stats['buckets']))) for (kind, key), stats in trace_stats.items()]
+    rows = []
+    for kind, key, stats in items:
+        rows.append({'kind': kind, 'command': key, 'count': stats['count'], 'errors': stats['errors'],
+                     'total_ms': round(stats['total_ms'], 1), 'avg_ms': round(stats['total_ms'] / stats['count'], 1),
+                     'p50_ms': bucket_percentile(stats['buckets'], stats['max_ms'], 0.5),
+                     'p95_ms': bucket_percentile(stats['buckets'], stats['max_ms'], 0.95),
+                     'max_ms': round(stats['max_ms'], 1), 'bytes': stats['bytes'],
+                     'histogram': dict(zip([f"<={ms}" for ms in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"], stats['buckets']))})
+    return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+def reset_trace():
+    with trace_lock:
+        trace_events.clear()
+        trace_stats.clear()
+
+def export_trace(path, chrome=True):
+    with trace_lock:
+        events = list(trace_events)
+    if chrome:
+        pid = os.getpid()
+        data = {'displayTimeUnit': 'ms', 'traceEvents': [
+            {'name': key, 'cat': kind, 'ph': 'X', 'pid': pid, 'tid': tid,
+             'ts': round((started - TRACE_STARTED) * 1e6), 'dur': round((ended - started) * 1e6),
+             'args': {'cmd': cmd, 'serial': serial, 'bytes': size, 'outcome': outcome}}
+            for kind, key, cmd, serial, started, ended, size, outcome, tid in events]}
+    else:
+        data = {'events': [{'kind': kind, 'command': key, 'cmd': cmd, 'serial': serial, 'start_ms': round((started - TRACE_STARTED) * 1000, 3),
+                            'duration_ms': round((ended - started) * 1000, 3), 'bytes': size, 'outcome': outcome}
+                           for kind, key, cmd, serial, started, ended, size, outcome, tid in events],
+                'stats': trace_summary()}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=1)
+
+def run_process(args, serial=None, timeout=None, text=True):
+    name = ' '.join([os.path.splitext(os.path.basename(args[0]))[0]] + [arg for arg in args[1:] if arg not in ('-s', serial)])
+    started = time.perf_counter()
+    try:
+        with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=text, creationflags=NO_WINDOW) as process:
+            track_transport(serial, process)
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+            except:
+                process.kill()
+                raise
+        result = subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+    except Exception as e:
+        trace_call('subprocess', name, serial, started, 0, type(e).__name__)
+        raise
+    trace_call('subprocess', name, serial, started, len(result.stdout or '') + len(result.stderr or ''),
+               "ok" if result.returncode == 0 else f"exit {result.returncode}")
+    return result
+
+def track_transport(serial, transport):
+    with active_transports_lock:
+        active_transports.setdefault(serial, weakref.WeakSet()).add(transport)
+
+def abort_device(serial):
+    with active_transports_lock:
+        transports = list(active_transports.pop(serial, ()))
+    for transport in transports:
+        try:
+            if isinstance(transport, subprocess.Popen):
+                transport.kill()
+            else:
+                transport.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    for scheduler in list(device_schedulers):
+        scheduler.cancel_device(serial)
+
+class DeviceScheduler:
+    def __init__(self, workers=4, per_device=SCHEDULER_PER_DEVICE):
+        self.per_device = per_device
+        self.queues = {}
+        self.running = {}
+        self.condition = threading.Condition()
+        self.counter = itertools.count()
+        self.stopped = False
+        for _ in range(workers):
+            threading.Thread(target=self.work, daemon=True).start()
+        device_schedulers.add(self)
+
+    def submit(self, serial, priority, work, *args):
+        future = Future()
+        with self.condition:
+            if self.stopped:
+                future.cancel()
+                return future
+            heapq.heappush(self.queues.setdefault(serial, []), (priority, next(self.counter), future, work, args))
+            self.condition.notify()
+        return future
+
+    def can_start(self, serial, priority):
+        running = self.running.get(serial, [0, 0, 0])
+        if priority == PRIORITY_PREFETCH and running[PRIORITY_PREFETCH]:
+            return False
+        return sum(running) < self.per_device and (priority == PRIORITY_WRITE or sum(running[1:]) < max(1, self.per_device - 1))
+
+    def next_task(self):
+        best = None
+        for serial, queue in self.queues.items():
+            while queue and queue[0][2].cancelled():
+                heapq.heappop(queue)
+            if queue and self.can_start(serial, queue[0][0]) and (best is None or queue[0][:2] < self.queues[best][0][:2]):
+                best = serial
+        if best is None:
+            return None, None
+        return best, heapq.heappop(self.queues[best])
+
+    def work(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.stopped:
+                        return
+                    serial, task = self.next_task()
+                    if task:
+                        break
+                    self.condition.wait()
+                priority, _, future, work, args = task
+                self.running.setdefault(serial, [0, 0, 0])[priority] += 1
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(work(*args))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self.condition:
+                    self.running[serial][priority] -= 1
+                    self.condition.notify_all()
+
+    def cancel_device(self, serial):
+        with self.condition:
+            queue = self.queues.pop(serial, [])
+        for entry in queue:
+            entry[2].cancel()
+
+    def shutdown(self):
+        with self.condition:
+            self.stopped = True
+            queues = list(self.queues.values())
+            self.queues.clear()
+            self.condition.notify_all()
+        for queue in queues:
+            for entry in queue:
+                entry[2].cancel()
+
+def check_adb_installed():
+    adb_path = os.path.join(os.path.dirname(sys.executable), "adb.exe")
+    if os.path.exists(adb_path):
+        run_process([adb_path, "start-server"], text=False)
+        return True
+    try:
+        result = run_process(['adb', '--version'], timeout=3)
+        return result.returncode == 0
+    except:
+        return False
+
+def adb_device_states():
+    if device_tracker_live.is_set():
+        with device_states_lock:
+            return dict(device_states)
+    try:
+        return adb_devices()
+    except (AdbError, OSError, ValueError):
+        pass
+    try:
+        result = run_process(['adb', 'devices'], timeout=3)
+        return parse_device_list(result.stdout)
+    except:
+        return {}
+
+def check_adb_connection(serial=None):
+    started = time.perf_counter()
+    states = adb_device_states()
+    if serial:
+        connected = states.get(serial) == 'device'
+    else:
+        connected = any(state == 'device' for state in states.values())
+    trace_call('check', 'check_adb_connection', serial, started, 0, "ok" if connected else "offline")
+    return connected
+
+class AdbError(Exception):
+    pass
+
+class AdbUnavailable(AdbError):
+    pass
+
+def adb_connect(timeout=5):
+    try:
+        sock = socket.create_connection(ADB_SERVER, timeout=timeout)
+    except OSError as e:
+        raise AdbUnavailable(str(e) or type(e).__name__) from e
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+def adb_recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise AdbError("Connection closed by adb server")
+        data += chunk
+    return bytes(data)
+
+def adb_recv_into(sock, view):
+    received = 0
+    while received < len(view):
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise AdbError("Connection closed by adb server")
+        received += count
+
+def adb_request(sock, request):
+    payload = request.encode()
+    sock.sendall(b'%04x' % len(payload) + payload)
+    status = adb_recv_exact(sock, 4)
+    if status == b'OKAY':
+        return
+    if status == b'FAIL':
+        length = int(adb_recv_exact(sock, 4), 16)
+        raise AdbError(adb_recv_exact(sock, length).decode(errors='replace'))
+    raise AdbError(f"Unexpected adb response: {status!r}")
+
+def adb_open_service(service, serial=None, timeout=5):
+    sock = adb_connect(timeout)
+    try:
+        adb_request(sock, f'host:transport:{serial}' if serial else 'host:transport-any')
+        adb_request(sock, service)
+    except:
+        sock.close()
+        raise
+    track_transport(serial, sock)
+    return sock
+
+def adb_decode(data):
+    return data.decode('utf-8', errors='replace').replace('\r\n', '\n')
+
+class AdbShellSession:
+    def __init__(self, serial=None, timeout=5):
+        self.serial = serial
+        self.sock = adb_open_service('shell,v2,raw:', serial, timeout)
+        self.counter = 0
+
+    def send(self, packet_id, data):
+        self.sock.sendall(struct.pack('<BI', packet_id, len(data)) + data)
+
+    def read_packet(self):
+        packet_id, length = struct.unpack('<BI', adb_recv_exact(self.sock, 5))
+        return packet_id, adb_recv_exact(self.sock, length)
+
+    def start(self, cmd, timeout=5):
+        if select.select([self.sock], [], [], 0)[0]:
+            raise ConnectionResetError("Shell session closed while idle")
+        self.counter += 1
+        marker = f'__MAK_{self.counter}__'.encode()
+        self.sock.settimeout(timeout)
+        self.send(SHELL_V2_STDIN, b'{ %s\n} </dev/null; echo "%s $?"; echo %s >&2\n' % (cmd.encode(), marker, marker))
+        return marker
+
+    def run(self, cmd, timeout=5):
+        return self.collect(self.start(cmd, timeout))
+
+    def collect(self, marker):
+        stdout = bytearray()
+        stderr = bytearray()
+        code = None
+        err_end = -1
+        while code is None or err_end < 0:
+            packet_id, data = self.read_packet()
+            if packet_id == SHELL_V2_STDOUT:
+                stdout += data
+                pos = stdout.find(marker)
+                end = stdout.find(b'\n', pos) if pos >= 0 else -1
+                if end >= 0:
+                    code = int(stdout[pos + len(marker):end])
+                    del stdout[pos:]
+            elif packet_id == SHELL_V2_STDERR:
+                stderr += data
+                err_end = stderr.find(marker + b'\n')
+            elif packet_id == SHELL_V2_EXIT:
+                raise AdbError("Shell session exited")
+        del stderr[err_end:]
+        return code, adb_decode(stdout), adb_decode(stderr)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+def adb_checkout_session(serial=None, timeout=5):
+    with adb_pool_lock:
+        idle = adb_session_pool.get(serial)
+        if idle:
+            return idle.pop(), True
+    return AdbShellSession(serial, timeout), False
+
+def adb_checkin_session(session):
+    with adb_pool_lock:
+        idle = adb_session_pool.setdefault(session.serial, [])
+        if len(idle) < ADB_POOL_SIZE:
+            idle.append(session)
+            return
+    session.close()
+
+def adb_close_sessions(serial=None):
+    with adb_pool_lock:
+        idle = adb_session_pool.pop(serial, [])
+    for session in idle:
+        session.close()
+
+def adb_shell_v1(cmd, serial=None, timeout=5):
+    sock = adb_open_service(f'shell:{cmd}', serial, timeout)
+    chunks = []
+    try:
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+    return None, adb_decode(b''.join(chunks)), ""
+
+def adb_native_shell(cmd, serial=None, timeout=5):
+    if serial in adb_v1_serials:
+        return adb_shell_v1(cmd, serial, timeout)
+    try:
+        session, pooled = adb_checkout_session(serial, timeout)
+    except AdbUnavailable:
+        raise
+    except AdbError:
+        result = adb_shell_v1(cmd, serial, timeout)
+        adb_v1_serials.add(serial)
+        return result
+    try:
+        marker = session.start(cmd, timeout)
+    except OSError:
+        session.close()
+        if not pooled:
+            raise
+        adb_close_sessions(serial)
+        session = AdbShellSession(serial, timeout)
+        try:
+            marker = session.start(cmd, timeout)
+        except:
+            session.close()
+            raise
+    try:
+        result = session.collect(marker)
+    except:
+        session.close()
+        raise
+    adb_checkin_session(session)
+    return result
+
+def adb_shell(cmd, serial=None, timeout=5):
+    started = time.perf_counter()
+    try:
+        _, stdout, stderr = adb_native_shell(cmd, serial, timeout)
+        trace_call('shell', cmd, serial, started, len(stdout) + len(stderr))
+        return stdout, stderr
+    except AdbUnavailable as e:
+        trace_call('shell', cmd, serial, started, 0, type(e).__name__)
+    except (AdbError, OSError, ValueError) as e:
+        trace_call('shell', cmd, serial, started, 0, type(e).__name__)
+        raise
+    args = ['adb', '-s', serial, 'shell', cmd] if serial else ['adb', 'shell', cmd]
+    result = run_process(args, serial, timeout)
+    return result.stdout, result.stderr
+
+def adb_stream_lines(cmd, serial=None, timeout=30):
+    started = time.perf_counter()
+    size = 0
+    try:
+        sock = adb_open_service(f'shell:{cmd}', serial, timeout)
+    except AdbUnavailable as e:
+        trace_call('stream', cmd, serial, started, 0, type(e).__name__)
+        yield from adb_process_lines(cmd, serial)
+        return
+    except (AdbError, OSError) as e:
+        trace_call('stream', cmd, serial, started, 0, type(e).__name__)
+        raise
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pending = ""
+    try:
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            size += len(chunk)
+            lines = (pending + decoder.decode(chunk)).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line.rstrip('\r')
+        pending += decoder.decode(b'', True)
+        if pending:
+            yield pending.rstrip('\r')
+    finally:
+        sock.close()
+        trace_call('stream', cmd, serial, started, size)
+
+def adb_process_lines(cmd, serial=None):
+    args = ['adb', '-s', serial, 'shell', cmd] if serial else ['adb', 'shell', cmd]
+    started = time.perf_counter()
+    size = 0
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, encoding='utf-8',
+                               errors='replace', creationflags=NO_WINDOW)
+    track_transport(serial, process)
+    try:
+        for line in process.stdout:
+            size += len(line)
+            yield line.rstrip('\r\n')
+    finally:
+        process.kill()
+        process.wait()
+        trace_call('subprocess', f'adb shell {cmd}', serial, started, size, "ok" if process.returncode in (0, -9) else f"exit {process.returncode}")
+
+def parse_device_list(payload):
+    states = {}
+    for line in payload.splitlines():
+        if '\t' in line:
+            serial, state = line.split('\t', 1)
+            states[serial] = state.strip()
+    return states
+
+def adb_devices(timeout=3):
+    started = time.perf_counter()
+    try:
+        sock = adb_connect(timeout)
+        try:
+            adb_request(sock, 'host:devices')
+            length = int(adb_recv_exact(sock, 4), 16)
+            payload = adb_recv_exact(sock, length)
+        finally:
+            sock.close()
+    except Exception as e:
+        trace_call('devices', 'host:devices', None, started, 0, type(e).__name__)
+        raise
+    trace_call('devices', 'host:devices', None, started, length)
+    return parse_device_list(adb_decode(payload))
+
+def update_device_states(states):
+    with device_states_lock:
+        removed = set(device_states) - set(states)
+        gone = {serial for serial, state in device_states.items() if state == 'device' and states.get(serial) != 'device'}
+        changed = states != device_states
+        device_states.clear()
+        device_states.update(states)
+    device_tracker_live.set()
+    if removed:
+        adb_close_sessions(None)
+        invalidate_reads(None)
+        for serial in removed:
+            adb_close_sessions(serial)
+            invalidate_reads(serial)
+    for serial in gone:
+        abort_device(serial)
+    if gone and 'device' not in states.values():
+        abort_device(None)
+    if changed:
+        device_change_event.set()
+
+def track_devices():
+    while True:
+        try:
+            sock = adb_connect()
+            try:
+                adb_request(sock, 'host:track-devices')
+                sock.settimeout(None)
+                while True:
+                    length = int(adb_recv_exact(sock, 4), 16)
+                    update_device_states(parse_device_list(adb_recv_exact(sock, length).decode(errors='replace')))
+            finally:
+                sock.close()
+        except (AdbError, OSError, ValueError):
+            pass
+        device_tracker_live.clear()
+        device_change_event.set()
+        time.sleep(1)
+
+def start_device_tracker():
+    global device_tracker_thread
+    if device_tracker_thread is None:
+        device_tracker_thread = threading.Thread(target=track_devices, daemon=True)
+        device_tracker_thread.start()
+    device_tracker_live.wait(1)
+
+def parse_dumpsys_packages(lines):
+    record = None
+    in_packages = False
+    user_section = None
+    for line in lines:
+        if not in_packages:
+            in_packages = line == 'Packages:'
+            continue
+        if line and not line.startswith(' '):
+            break
+        stripped = line.strip()
+        if stripped.startswith('Package [') and ']' in stripped:
+            if record:
+                yield record
+            record = {'name': stripped[9:stripped.index(']')], 'version': "", 'version_code': "", 'enabled': "Enabled",
+                      'installed': True, 'installer': "", 'path': "", 'first_install': "", 'last_update': "", 'system': False}
+            user_section = None
+            continue
+        if record is None:
+            continue
+        if stripped.startswith('User '):
+            user_section = stripped.split(':', 1)[0]
+            if user_section == 'User 0':
+                fields = dict(re.findall(r'(\w+)=(\S+)', stripped))
+                record['installed'] = fields.get('installed', 'true') == 'true'
+                record['enabled'] = ENABLED_STATES.get(fields.get('enabled'), "Enabled")
+            continue
+        if user_section:
+            continue
+        key, _, value = stripped.partition('=')
+        if key == 'versionName':
+            record['version'] = value
+        elif key == 'versionCode':
+            record['version_code'] = value.split()[0]
+        elif key == 'codePath':
+            record['path'] = value
+        elif key == 'installerPackageName':
+            record['installer'] = "" if value == 'null' else value
+        elif key == 'firstInstallTime':
+            record['first_install'] = value
+        elif key == 'lastUpdateTime':
+            record['last_update'] = value
+        elif key == 'pkgFlags':
+            record['system'] = ' SYSTEM ' in value
+    if record:
+        yield record
+
+def parse_diskstats(lines):
+    lists = {}
+    for line in lines:
+        key, _, value = line.partition(': ')
+        if key in ('Package Names', 'App Sizes', 'App Data Sizes', 'Cache Sizes'):
+            try:
+                lists[key] = json.loads(value)
+            except ValueError:
+                pass
+    names = lists.get('Package Names', [])
+    columns = [lists.get(key) or [None] * len(names) for key in ('App Sizes', 'App Data Sizes', 'Cache Sizes')]
+    return {name: sizes for name, *sizes in zip(names, *columns)}
+
+def fetch_package_metadata(serial=None):
+    metadata = {record['name']: record for record in parse_dumpsys_packages(run_adb_stream('dumpsys package packages', serial))}
+    for name, (code_size, data_size, cache_size) in parse_diskstats(run_adb_stream('dumpsys diskstats', serial)).items():
+        if name in metadata:
+            metadata[name].update(code_size=code_size, data_size=data_size, cache_size=cache_size)
+    return metadata
+
+def format_size(size):
+    if size is None:
+        return ""
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+def cached_reads(cmds, serial=None):
+    now = time.monotonic()
+    hits = {}
+    with read_cache_lock:
+        for cmd in cmds:
+            entry = read_cache.get((serial, cmd))
+            if entry and entry[0] > now:
+                hits[cmd] = list(entry[1])
+    for cmd in hits:
+        trace_call('cache', cmd, serial, time.perf_counter())
+    return hits
+
+def cache_reads(results, serial=None):
+    now = time.monotonic()
+    with read_cache_lock:
+        for cmd, lines in results.items():
+            ttl = READ_TTLS.get(cmd)
+            if ttl and not (lines and lines[0].startswith("Error:")):
+                read_cache[serial, cmd] = (now + ttl, tuple(lines))
+
+def invalidate_reads(serial=None, cmds=None):
+    with read_cache_lock:
+        for key in [key for key in read_cache if key[0] == serial and (cmds is None or key[1] in cmds)]:
+            del read_cache[key]
+
+def apply_write_effects(cmd, serial=None):
+    for prefix, reads in WRITE_EFFECTS.items():
+        if cmd.startswith(prefix + ' '):
+            invalidate_reads(serial, reads)
+
+def online_serials():
+    with device_states_lock:
+        return [serial for serial, state in device_states.items() if state == 'device']
+
+def is_package_name(name):
+    return PACKAGE_NAME_RE.fullmatch(name) is not None
+
+def is_allowed_cmd(cmd):
+    for prefix in PACKAGE_CMDS:
+        if cmd.startswith(prefix):
+            arg = cmd[len(prefix):]
+            return is_package_name(arg[:-5] if arg.endswith(' 2>&1') else arg)
+    allowed_cmds = ['pm list packages', 'pm list packages -u', 'pm uninstall -k --user 0',
+                    'pm uninstall --user 0', 'cmd package install-existing', 'getprop ro.product.brand',
+                    'getprop ro.product.model', 'getprop ro.product.device',
+                    'getprop ro.system.build.version.incremental', 'wm size',
+                    'wm density', 'settings get secure miui_refresh_rate', 'settings get secure user_refresh_rate', 
+                    'which su', 'getprop ro.boot.verifiedbootstate', 'cat /proc/version',
+                    'dumpsys package packages', 'dumpsys diskstats',
+                    'dumpsys SurfaceFlinger --latency', 'dumpsys SurfaceFlinger --list', 'pm path',
+                    'cmd package install-create', 'cmd package install-commit', 'cmd package install-abandon',
+                    'logcat -v threadtime', 'pidof']
+    return any(cmd.startswith(allowed) for allowed in allowed_cmds)
+
+def run_adb_cmd(cmd, serial=None):
+    if not is_allowed_cmd(cmd):
+        return ["Error: Invalid command"]
+    if not check_adb_connection(serial):
+        return ["Error: No device connected"]
+    hit = cached_reads([cmd], serial).get(cmd)
+    if hit is not None:
+        return hit
+    try:
+        stdout, _ = adb_shell(cmd, serial)
+    except:
+        return ["Error: ADB failed"]
+    lines = stdout.strip().split('\n')
+    cache_reads({cmd: lines}, serial)
+    return lines
+
+def run_adb_stream(cmd, serial=None):
+    if not is_allowed_cmd(cmd) or not check_adb_connection(serial):
+        return
+    try:
+        yield from adb_stream_lines(cmd, serial)
+    except (AdbError, OSError, ValueError):
+        return
+
+def run_adb_batch(cmds, timeout=10, serial=None):
+    cmds = list(dict.fromkeys(cmds))
+    results = {cmd: ["Error: Invalid command"] for cmd in cmds if not is_allowed_cmd(cmd)}
+    valid = [cmd for cmd in cmds if cmd not in results]
+    if not valid:
+        return results
+    if not check_adb_connection(serial):
+        results.update((cmd, ["Error: No device connected"]) for cmd in valid)
+        return results
+    results.update(cached_reads(valid, serial))
+    valid = [cmd for cmd in valid if cmd not in results]
+    if not valid:
+        return results
+    script = '; '.join(f'{cmd}; echo; echo {BATCH_SEPARATOR}' for cmd in valid)
+    try:
+        stdout, _ = adb_shell(script, serial, timeout)
+    except:
+        results.update((cmd, ["Error: ADB failed"]) for cmd in valid)
+        return results
+    parts = stdout.split(f'\n{BATCH_SEPARATOR}\n')
+    for i, cmd in enumerate(valid):
+        results[cmd] = parts[i].strip().split('\n') if i < len(parts) else [""]
+    cache_reads({cmd: results[cmd] for cmd in valid if cmd in READ_TTLS and len(parts) > len(valid)}, serial)
+    return results
+
+def parse_packages(output):
+    return [line.replace('package:', '') for line in output if line.startswith('package:')]
+
+def list_packages(cmd, serial=None):
+    return parse_packages(run_adb_cmd(cmd, serial))
+
+class PackageInventory:
+    def __init__(self, names=(), flags=b''):
+        self.names = [sys.intern(name) for name in names]
+        self.flags = bytearray(flags)
+        self.positions = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def from_lists(cls, installed, system_all, user_all):
+        installed = set(installed)
+        system_all = set(system_all)
+        names = sorted(installed | system_all | set(user_all))
+        return cls(names, bytes((INSTALLED if name in installed else 0) | (SYSTEM if name in system_all else 0) for name in names))
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['names'], bytes.fromhex(data['flags']))
+
+    def to_json(self):
+        return {'names': self.names, 'flags': self.flags.hex()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def flag(self, name):
+        i = self.positions.get(name)
+        return None if i is None else self.flags[i]
+
+    def has(self, name, flag):
+        i = self.positions.get(name)
+        return i is not None and self.flags[i] & flag == flag
+
+    def select(self, want, mask=INSTALLED):
+        return [name for name, flag in zip(self.names, self.flags) if flag & mask == want]
+
+    def count(self, want, mask=INSTALLED):
+        return sum(self.flags.count(value) for value in range(4) if value & mask == want)
+
+    def digest(self):
+        return hashlib.sha1('\n'.join(self.names).encode() + b'\0' + bytes(self.flags)).hexdigest()
+
+    def with_changes(self, uninstalled=(), removed=(), reinstalled=()):
+        flags = bytearray(self.flags)
+        for names, change in ((uninstalled, lambda flag: flag & ~INSTALLED), (reinstalled, lambda flag: flag | INSTALLED)):
+            for name in names:
+                i = self.positions.get(name)
+                if i is not None:
+                    flags[i] = change(flags[i])
+        removed = set(removed)
+        kept = [i for i, name in enumerate(self.names) if name not in removed]
+        return PackageInventory([self.names[i] for i in kept], bytes(flags[i] for i in kept))
+
+def inventory_from_output(out):
+    return PackageInventory.from_lists(*(parse_packages(out[cmd]) for cmd in INVENTORY_QUERIES))
+
+def fetch_inventory(serial=None):
+    return inventory_from_output(run_adb_batch(INVENTORY_QUERIES, serial=serial))
+
+def snapshot_path(key):
+    return os.path.join(SNAPSHOT_DIR, re.sub(r'[^A-Za-z0-9._-]', '_', '_'.join(key)) + '.json')
+
+def load_snapshot(key):
+    if key[0] is None or key[1] == "Unknown":
+        return None
+    try:
+        with open(snapshot_path(key), encoding='utf-8') as f:
+            return PackageInventory.from_json(json.load(f))
+    except (OSError, ValueError, KeyError):
+        return None
+
+def save_snapshot(key, inventory):
+    if key[0] is None or key[1] == "Unknown" or not len(inventory):
+        return
+    data = dict(inventory.to_json(), serial=key[0], build=key[1], hash=inventory.digest())
+    path = snapshot_path(key)
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        pass
+
+def patch_snapshot(key, uninstalled=(), removed=(), reinstalled=()):
+    inventory = load_snapshot(key)
+    if inventory is not None:
+        save_snapshot(key, inventory.with_changes(uninstalled, removed, reinstalled))
+
+def refresh_snapshot(key):
+    inventory = fetch_inventory(key[0])
+    save_snapshot(key, inventory)
+    return inventory
+
+def validate_snapshot(key, inventory):
+    out = run_adb_batch(SNAPSHOT_QUERIES, serial=key[0])
+    installed, names = (parse_packages(out[cmd]) for cmd in SNAPSHOT_QUERIES)
+    if not names:
+        return None
+    if all(name in inventory.positions for name in names):
+        system_all = [name for name in names if inventory.has(name, SYSTEM)]
+    else:
+        system_all = list_packages('pm list packages -s -u', key[0])
+    current = PackageInventory.from_lists(installed, system_all, names)
+    if current.digest() == inventory.digest():
+        return None
+    save_snapshot(key, current)
+    return current
+
+def load_device(serial=None):
+    if not check_adb_connection(serial):
+        return False, None, None, (serial, "Unknown"), False
+    out = run_adb_batch(INFO_QUERIES + DISPLAY_QUERIES, serial=serial)
+    key = (serial, parse_device_info(out)[3])
+    inventory = load_snapshot(key)
+    if inventory is not None:
+        return True, inventory, out, key, True
+    return True, refresh_snapshot(key), out, key, False
+
+def run_package_commands(cmds, serial=None, on_progress=None):
+    outputs = []
+    for start in range(0, len(cmds), PACKAGE_BATCH_SIZE):
+        chunk = [f'{cmd} 2>&1' for cmd in cmds[start:start + PACKAGE_BATCH_SIZE]]
+        out = run_adb_batch(chunk, timeout=5 * len(chunk), serial=serial)
+        outputs.extend(' '.join(out[cmd]).strip() for cmd in chunk)
+        if on_progress:
+            on_progress(len(outputs), len(cmds))
+    return outputs
+
+def uninstall_commands(packages, system_all, keep_data):
+    return [f'pm uninstall -k --user 0 {pkg}' if keep_data and pkg in system_all else f'pm uninstall --user 0 {pkg}' for pkg in packages]
+
+def package_error(output, success_words):
+    if output.startswith("Backup failed"):
+        return "Backup failed"
+    if any(word in output for word in success_words):
+        return None
+    if "Operation not allowed" in output or "Permission denied" in output:
+        return "System app protected"
+    return "Failed"
+
+def apk_paths(packages, serial=None):
+    paths = {}
+    for start in range(0, len(packages), PACKAGE_BATCH_SIZE):
+        chunk = packages[start:start + PACKAGE_BATCH_SIZE]
+        out = run_adb_batch([f'pm path {pkg}' for pkg in chunk], timeout=5 * len(chunk), serial=serial)
+        paths.update((pkg, parse_packages(out[f'pm path {pkg}'])) for pkg in chunk)
+    return paths
+
+def sync_pull(remote, f, serial=None, timeout=30):
+    started = time.perf_counter()
+    sha = hashlib.sha256()
+    buffer = memoryview(bytearray(SYNC_CHUNK))
+    size = 0
+    outcome = "ok"
+    sock = adb_open_service('sync:', serial, timeout)
+    try:
+        path = remote.encode()
+        sock.sendall(b'RECV' + struct.pack('<I', len(path)) + path)
+        while True:
+            command, length = struct.unpack('<4sI', adb_recv_exact(sock, 8))
+            if command == b'DONE':
+                break
+            if command == b'FAIL':
+                raise AdbError(adb_recv_exact(sock, length).decode(errors='replace'))
+            if command != b'DATA' or length > SYNC_CHUNK:
+                raise AdbError(f"Unexpected sync response: {command!r}")
+            chunk = buffer[:length]
+            adb_recv_into(sock, chunk)
+            sha.update(chunk)
+            f.write(chunk)
+            size += length
+        sock.sendall(b'QUIT' + struct.pack('<I', 0))
+    except (AdbError, OSError) as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        sock.close()
+        trace_call('sync', f'pull {remote}', serial, started, size, outcome)
+    return sha.hexdigest(), size
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def pull_apk(remote, path, serial=None):
+    try:
+        with open(path, 'wb') as f:
+            return sync_pull(remote, f, serial)
+    except (AdbError, OSError):
+        pass
+    args = ['adb', '-s', serial, 'pull', remote, path] if serial else ['adb', 'pull', remote, path]
+    result = run_process(args, serial, 600)
+    if result.returncode != 0:
+        raise AdbError(result.stderr.strip() or "adb pull failed")
+    return file_digest(path), os.path.getsize(path)
+
+def apk_object_path(digest):
+    return os.path.join(APK_STORE_DIR, 'objects', digest[:2], digest + '.apk')
+
+def backup_manifest_path(package, serial):
+    return os.path.join(APK_STORE_DIR, 'packages', package, re.sub(r'[^\w.-]', '_', serial or 'default') + '.json')
+
+def store_apk(remote, serial=None):
+    tmp_dir = os.path.join(APK_STORE_DIR, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp = os.path.join(tmp_dir, f'{os.getpid()}_{threading.get_ident()}.apk')
+    try:
+        digest, size = pull_apk(remote, tmp, serial)
+        path = apk_object_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return digest, size
+
+def save_backup(package, serial, files):
+    path = backup_manifest_path(package, serial)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}_{threading.get_ident()}.tmp'
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'package': package, 'serial': serial, 'time': int(time.time()), 'files': sorted(files, key=lambda file: file['name'])}, f, indent=1)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def is_backup_file(file):
+    return (isinstance(file, dict) and isinstance(file.get('name'), str) and isinstance(file.get('sha256'), str)
+            and SHA256_RE.fullmatch(file['sha256']) is not None and type(file.get('size')) is int and file['size'] >= 0)
+
+def read_backup(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            backup = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (not isinstance(backup, dict) or not isinstance(backup.get('package'), str) or not isinstance(backup.get('serial'), (str, type(None)))
+            or type(backup.get('time')) is not int):
+        return None
+    files = backup.get('files')
+    if not isinstance(files, list) or not files or not all(is_backup_file(file) for file in files):
+        return None
+    if not all(os.path.exists(apk_object_path(file['sha256'])) for file in files):
+        return None
+    return backup
+
+def package_backups(package):
+    directory = os.path.join(APK_STORE_DIR, 'packages', package)
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+    except OSError:
+        return []
+    return [backup for backup in (read_backup(os.path.join(directory, name)) for name in names) if backup is not None]
+
+def load_backup(package, serial=None):
+    backups = package_backups(package)
+    own = [backup for backup in backups if backup['serial'] == serial]
+    return max(own or backups, key=lambda backup: backup['time'], default=None)
+
+def list_backups():
+    try:
+        names = sorted(os.listdir(os.path.join(APK_STORE_DIR, 'packages')))
+    except OSError:
+        return []
+    return [backup for name in names for backup in package_backups(name)]
+
+def backup_packages(packages, serial=None, on_progress=None):
+    paths = apk_paths(packages, serial)
+    errors = {pkg: "No APK found" for pkg in packages if not paths.get(pkg)}
+    files = {pkg: [] for pkg in packages}
+    futures = {transfer_pool.submit(store_apk, remote, serial): (pkg, remote) for pkg in packages for remote in paths.get(pkg, ())}
+    for done, future in enumerate(as_completed(futures), 1):
+        pkg, remote = futures[future]
+        try:
+            digest, size = future.result()
+            files[pkg].append({'name': remote.rsplit('/', 1)[-1], 'sha256': digest, 'size': size})
+        except (AdbError, OSError) as e:
+            errors[pkg] = str(e) or type(e).__name__
+        if on_progress:
+            on_progress(done, len(futures))
+    for pkg in packages:
+        if pkg not in errors:
+            try:
+                save_backup(pkg, serial, files[pkg])
+            except OSError as e:
+                errors[pkg] = str(e)
+    return [errors.get(pkg) for pkg in packages]
+
+def stream_exec(cmd, path, serial=None, on_bytes=None, timeout=30):
+    started = time.perf_counter()
+    buffer = memoryview(bytearray(INSTALL_CHUNK))
+    size = 0
+    outcome = "ok"
+    try:
+        sock = adb_open_service(f'exec:{cmd}', serial, timeout)
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    count = f.readinto(buffer)
+                    if not count:
+                        break
+                    sock.sendall(buffer[:count])
+                    size += count
+                    if on_bytes:
+                        on_bytes(count)
+            sock.settimeout(INSTALL_TIMEOUT)
+            output = bytearray()
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                output += chunk
+        finally:
+            sock.close()
+    except (AdbError, OSError) as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        trace_call('exec', cmd, serial, started, size, outcome)
+    return adb_decode(output).strip()
+
+def install_apks_native(files, serial=None, on_bytes=None):
+    if len(files) == 1:
+        name, path, size = files[0]
+        output = stream_exec(f'cmd package install -r -S {size}', path, serial, on_bytes)
+        return None if "Success" in output else output or "Failed"
+    output = ' '.join(run_adb_cmd(f'cmd package install-create -r -S {sum(size for name, path, size in files)}', serial))
+    match = re.search(r'\[(\d+)\]', output)
+    if not match:
+        return output or "Failed"
+    session = match.group(1)
+    try:
+        for name, path, size in files:
+            output = stream_exec(f'cmd package install-write -S {size} {session} {shlex.quote(name)} -', path, serial, on_bytes)
+            if "Success" not in output:
+                raise AdbError(output or "install-write failed")
+    except (AdbError, OSError) as e:
+        run_adb_cmd(f'cmd package install-abandon {session}', serial)
+        if isinstance(e, AdbUnavailable):
+            raise
+        return str(e) or type(e).__name__
+    output = ' '.join(run_adb_cmd(f'cmd package install-commit {session}', serial))
+    return None if "Success" in output else output or "Failed"
+
+def install_apks(files, serial=None, on_bytes=None):
+    try:
+        return install_apks_native(files, serial, on_bytes)
+    except AdbUnavailable:
+        pass
+    except (AdbError, OSError) as e:
+        return str(e) or type(e).__name__
+    command = 'install-multiple' if len(files) > 1 else 'install'
+    paths = [path for name, path, size in files]
+    args = ['adb', '-s', serial, command, '-r'] + paths if serial else ['adb', command, '-r'] + paths
+    try:
+        result = run_process(args, serial, INSTALL_TIMEOUT)
+    except (OSError, subprocess.SubprocessError) as e:
+        return str(e) or type(e).__name__
+    output = (result.stdout + result.stderr).strip()
+    return None if "Success" in output else output or "Failed"
+
+def apk_sets(paths):
+    sets = {}
+    for path in paths:
+        if os.path.isdir(path):
+            sets[path] = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.lower().endswith('.apk')]
+        elif re.fullmatch(r'(base|split_.*)\.apk', os.path.basename(path), re.I):
+            sets.setdefault(os.path.dirname(os.path.abspath(path)), []).append(path)
+        else:
+            sets[path] = [path]
+    return list(sets.items())
+
+def install_apk_sets(sets, serial=None, on_progress=None):
+    sizes = {}
+    for label, paths in sets:
+        try:
+            sizes[label] = [(os.path.basename(path), path, os.path.getsize(path)) for path in paths]
+        except OSError as e:
+            sizes[label] = str(e)
+    total = sum(size for files in sizes.values() if isinstance(files, list) for name, path, size in files)
+    sent = 0
+    def on_bytes(count):
+        nonlocal sent
+        sent += count
+        if on_progress:
+            on_progress(sent, total)
+    results = []
+    for label, paths in sets:
+        files = sizes[label]
+        result = {'name': os.path.basename(label.rstrip('/\\')) or label, 'files': len(paths)}
+        if isinstance(files, str) or not files:
+            results.append(dict(result, error=files or "No APK files"))
+            continue
+        started = time.perf_counter()
+        error = install_apks(files, serial, on_bytes)
+        seconds = time.perf_counter() - started
+        size = sum(size for name, path, size in files)
+        results.append(dict(result, error=error, bytes=size, seconds=round(seconds, 3), mb_per_s=round(size / seconds / 1e6, 1) if seconds else None))
+    return results
+
+def restore_packages(packages, serial=None, on_progress=None, sources=None):
+    errors = []
+    for pkg in packages:
+        backup = load_backup(pkg, (sources or {}).get(pkg, serial))
+        if backup is None:
+            errors.append("No backup")
+        else:
+            errors.append(install_apks([(file['name'], apk_object_path(file['sha256']), file['size']) for file in backup['files']], serial))
+        if on_progress:
+            on_progress(len(errors), len(packages))
+    return errors
+
+def uninstall_with_backup(packages, system_all, keep_data, serial=None, on_backup=None, on_progress=None):
+    user_packages = [pkg for pkg in packages if pkg not in system_all]
+    errors = dict(zip(user_packages, backup_packages(user_packages, serial, on_backup)))
+    ready = [pkg for pkg in packages if errors.get(pkg) is None]
+    outputs = dict(zip(ready, run_package_commands(uninstall_commands(ready, system_all, keep_data), serial, on_progress)))
+    return [outputs[pkg] if pkg in outputs else f"Backup failed: {errors[pkg]}" for pkg in packages]
+
+def parse_first_line(output):
+    return output[0].strip() if output and output[0].strip() else "Unknown"
+
+def parse_wm(output, key):
+    original = current = "Unknown"
+    for line in output:
+        if f"Physical {key}" in line:
+            original = line.split(': ')[1].strip()
+        if f"Override {key}" in line:
+            current = line.split(': ')[1].strip()
+    if current == "Unknown":
+        current = original
+    return original, current
+
+def parse_fps(output):
+    return output[0].strip() if output and output[0].strip().isdigit() else "Unknown"
+
+def parse_device_info(out):
+    return tuple(parse_first_line(out[cmd]) for cmd in DEVICE_PROPS)
+
+def parse_kernel(output):
+    return output[0].strip().split()[2] if output and output[0].strip() else "Unknown"
+
+def parse_root(output):
+    return "Yes" if output and output[0].strip() and '/su' in output[0] else "No"
+
+def parse_bootloader(output):
+    return "Yes" if output and output[0].strip() in ['orange', 'yellow'] else "No"
+
+def get_display_state(out=None, serial=None):
+    if out is None:
+        if not check_adb_connection(serial):
+            return UNKNOWN_DISPLAY_STATE
+        out = run_adb_batch(DISPLAY_QUERIES, serial=serial)
+    return (parse_wm(out['wm size'], 'size'), parse_wm(out['wm density'], 'density'),
+            parse_fps(out['settings get secure miui_refresh_rate']), parse_fps(out['settings get secure user_refresh_rate']))
+
+def get_info_state(out=None, serial=None):
+    if out is None:
+        if not check_adb_connection(serial):
+            return UNKNOWN_INFO_STATE
+        out = run_adb_batch(INFO_QUERIES, serial=serial)
+    return (parse_device_info(out), parse_kernel(out['cat /proc/version']),
+            parse_root(out['which su']), parse_bootloader(out['getprop ro.boot.verifiedbootstate']))
+
+def get_resolution(serial=None):
+    if not check_adb_connection(serial):
+        return "Unknown", "Unknown"
+    return parse_wm(run_adb_cmd('wm size', serial), 'size')
+
+def get_dpi(serial=None):
+    if not check_adb_connection(serial):
+        return "Unknown", "Unknown"
+    return parse_wm(run_adb_cmd('wm density', serial), 'density')
+
+def get_fps(serial=None):
+    if not check_adb_connection(serial):
+        return "Unknown"
+    return parse_fps(run_adb_cmd('settings get secure miui_refresh_rate', serial))
+
+def get_user_fps(serial=None):
+    if not check_adb_connection(serial):
+        return "Unknown"
+    return parse_fps(run_adb_cmd('settings get secure user_refresh_rate', serial))
+
+def get_device_info(serial=None):
+    if not check_adb_connection(serial):
+        return "Unknown", "Unknown", "Unknown", "Unknown"
+    return parse_device_info(run_adb_batch(DEVICE_PROPS, serial=serial))
+
+def check_root(serial=None):
+    if not check_adb_connection(serial):
+        return "Unknown"
+    return parse_root(run_adb_cmd('which su', serial))
+
+def check_bootloader(serial=None):
+    if not check_adb_connection(serial):
+        return "Unknown"
+    return parse_bootloader(run_adb_cmd('getprop ro.boot.verifiedbootstate', serial))
+
+def get_kernel(serial=None):
+    if not check_adb_connection(serial):
+        return "Unknown"
+    return parse_kernel(run_adb_cmd('cat /proc/version', serial))
+
+def shell_output(cmd, serial=None):
+    try:
+        stdout, stderr = adb_shell(cmd, serial)
+    finally:
+        apply_write_effects(cmd, serial)
+    return stdout.strip() or stderr.strip()
+
+def write_wm(key, value, serial=None):
+    previous = cached_reads([f'wm {key}'], serial).get(f'wm {key}')
+    output = shell_output(f'wm {key} {value}', serial)
+    if value == 'reset':
+        ok = not output or "reset" in output.lower()
+    else:
+        ok = "override" in output.lower() or not output
+    if ok and previous:
+        lines = [line for line in previous if not line.startswith("Override")]
+        cache_reads({f'wm {key}': lines if value == 'reset' else lines + [f"Override {key}: {value}"]}, serial)
+    return ok
+
+def write_refresh_rate(fps_val, serial=None):
+    out = run_adb_batch(['settings get secure miui_refresh_rate', 'settings get secure user_refresh_rate'], serial=serial)
+    current_fps = parse_fps(out['settings get secure miui_refresh_rate'])
+    current_user_fps = parse_fps(out['settings get secure user_refresh_rate'])
+    if current_fps != "Unknown" and int(current_fps) == fps_val and current_user_fps != "Unknown" and int(current_user_fps) == fps_val:
+        return None
+    return put_refresh_rate(fps_val, serial)
+
+def put_refresh_rate(fps_val, serial=None):
+    output1 = shell_output(f'settings put secure miui_refresh_rate {fps_val}', serial)
+    output2 = shell_output(f'settings put secure user_refresh_rate {fps_val}', serial)
+    ok = (not output1 or "success" in output1.lower()) and (not output2 or "success" in output2.lower())
+    if ok:
+        cache_reads({'settings get secure miui_refresh_rate': [str(fps_val)], 'settings get secure user_refresh_rate': [str(fps_val)]}, serial)
+    return ok
+
+def parse_latency(output):
+    lines = [line.split() for line in output if line.strip()]
+    period = int(lines[0][0]) if lines and len(lines[0]) == 1 and lines[0][0].isdigit() else None
+    frames = [int(row[1]) for row in lines[1:] if len(row) == 3 and row[1].isdigit() and 0 < int(row[1]) < PENDING_FENCE]
+    return period, frames
+
+def percentile(values, q):
+    return values[min(len(values) - 1, round(q * (len(values) - 1)))]
+
+def latency_cmd(layer=None):
+    return f'dumpsys SurfaceFlinger --latency {shlex.quote(layer)}' if layer else 'dumpsys SurfaceFlinger --latency'
+
+class FrameSampler:
+    def __init__(self, serial=None, size=FRAME_BUFFER_SIZE):
+        self.serial = serial
+        self.intervals = deque(maxlen=size)
+        self.last = None
+        self.period = None
+        self.layer = None
+        self.idle = 0
+
+    def pick_layer(self):
+        layers = [line.strip() for line in run_adb_cmd('dumpsys SurfaceFlinger --list', self.serial) if '/' in line or 'SurfaceView' in line]
+        cmds = {layer: latency_cmd(layer) for layer in layers[:LAYER_CANDIDATES]}
+        out = run_adb_batch(list(cmds.values()), serial=self.serial)
+        best, best_count = None, 0
+        for layer, cmd in cmds.items():
+            frames = parse_latency(out[cmd])[1]
+            count = sum(frame > max(frames) - 1e9 for frame in frames) if frames else 0
+            if count > best_count:
+                best, best_count = layer, count
+        return best
+
+    def sample(self):
+        if self.layer is None:
+            self.layer = self.pick_layer()
+        cmds = [latency_cmd()] + ([latency_cmd(self.layer)] if self.layer else [])
+        out = run_adb_batch(cmds, serial=self.serial)
+        self.period = parse_latency(out[cmds[0]])[0] or self.period
+        if self.layer:
+            frames = sorted(parse_latency(out[cmds[1]])[1])
+            new = [frame for frame in frames if self.last is None or frame > self.last]
+            chain = [self.last] + new if self.last in frames else new
+            self.intervals.extend(b - a for a, b in zip(chain, chain[1:]) if 0 < b - a < 1e9)
+            self.last = new[-1] if new else self.last
+            self.idle = 0 if new else self.idle + 1
+            if self.idle >= 3:
+                self.layer = None
+                self.last = None
+                self.idle = 0
+        return self.stats()
+
+    def stats(self):
+        intervals = sorted(self.intervals)
+        result = {'panel_hz': round(1e9 / self.period, 1) if self.period else None, 'layer': self.layer, 'frames': len(intervals)}
+        if intervals:
+            result['fps'] = round(len(intervals) * 1e9 / sum(intervals), 1)
+            budget = 1.5 * (self.period or percentile(intervals, 0.5))
+            result['jank_pct'] = round(100 * sum(interval > budget for interval in intervals) / len(intervals), 1)
+            for q in (50, 90, 95, 99):
+                result[f'p{q}_ms'] = round(percentile(intervals, q / 100) / 1e6, 2)
+        return result
+
+class ScreenPreview:
+    def __init__(self, serial=None, max_height=PREVIEW_HEIGHT):
+        self.serial = serial
+        self.max_height = max_height
+        self.raw = bytearray()
+        self.size = 0
+        self.frame = bytearray()
+
+    def read(self):
+        started = time.perf_counter()
+        self.size = 0
+        try:
+            sock = adb_open_service('exec:screencap', self.serial, 10)
+        except AdbUnavailable as e:
+            trace_call('exec', 'screencap', self.serial, started, 0, type(e).__name__)
+            args = ['adb', '-s', self.serial, 'exec-out', 'screencap'] if self.serial else ['adb', 'exec-out', 'screencap']
+            data = run_process(args, self.serial, 10, text=False).stdout
+            self.raw[:len(data)] = data
+            self.size = len(data)
+            return
+        except (AdbError, OSError) as e:
+            trace_call('exec', 'screencap', self.serial, started, 0, type(e).__name__)
+            raise
+        try:
+            while True:
+                if self.size == len(self.raw):
+                    self.raw.extend(bytes(max(len(self.raw), 1 << 20)))
+                count = sock.recv_into(memoryview(self.raw)[self.size:])
+                if not count:
+                    break
+                self.size += count
+        finally:
+            sock.close()
+            trace_call('exec', 'screencap', self.serial, started, self.size)
+
+    def decode(self):
+        if self.size < 12:
+            raise AdbError("No screen data")
+        width, height, pixel_format = struct.unpack_from('<III', self.raw)
+        header = self.size - width * height * 4
+        if header not in (12, 16) or pixel_format not in SCREENCAP_FORMATS:
+            raise AdbError("Unsupported screencap format")
+        red, blue = SCREENCAP_FORMATS[pixel_format]
+        step = max(1, -(-height // self.max_height))
+        out_width, out_height = len(range(0, width, step)), len(range(0, height, step))
+        prefix = b'P6 %d %d 255\n' % (out_width, out_height)
+        size = len(prefix) + out_width * out_height * 3
+        if len(self.frame) != size:
+            self.frame = bytearray(size)
+        self.frame[:len(prefix)] = prefix
+        view = memoryview(self.raw)
+        pos = len(prefix)
+        row_size = out_width * 3
+        for y in range(0, height, step):
+            row = view[header + y * width * 4:header + (y + 1) * width * 4]
+            self.frame[pos:pos + row_size:3] = row[red::4 * step]
+            self.frame[pos + 1:pos + row_size:3] = row[1::4 * step]
+            self.frame[pos + 2:pos + row_size:3] = row[blue::4 * step]
+            pos += row_size
+        return bytes(self.frame), out_width, out_height
+
+    def grab(self):
+        try:
+            self.read()
+            return self.decode()
+        except (AdbError, OSError, subprocess.SubprocessError):
+            return None
+
+def parse_logcat_line(line):
+    match = LOGCAT_RE.match(line.rstrip('\r\n'))
+    return match.groups() if match else None
+
+class LogcatStream:
+    def __init__(self, serial=None, level='I', size=LOG_BUFFER_SIZE):
+        self.serial = serial
+        self.cmd = f"logcat -v threadtime -T {LOG_BACKLOG} '*:{level}'"
+        self.lines = deque(maxlen=size)
+        self.pending = deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.tag = ""
+        self.package = ""
+        self.pids = set()
+        self.pids_checked = 0
+        self.received = 0
+        self.dropped = 0
+        self.thread = None
+        self.process = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.process:
+            self.process.kill()
+
+    def set_filter(self, tag="", package=""):
+        with self.lock:
+            self.tag = tag.lower()
+            self.package = package
+            self.pids = set()
+            self.pids_checked = 0
+            self.pending.clear()
+            self.pending.extend(entry for entry in self.lines if self.matches(entry))
+
+    def matches(self, entry):
+        time_text, pid, level, tag, message = entry
+        if self.tag and self.tag not in tag.lower():
+            return False
+        return not self.package or pid in self.pids or self.package in message
+
+    def refresh_pids(self):
+        with self.lock:
+            package = self.package
+            if not package or not is_package_name(package) or time.monotonic() - self.pids_checked < LOG_PID_REFRESH:
+                return
+            self.pids_checked = time.monotonic()
+        pids = set(' '.join(run_adb_cmd(f'pidof {package}', self.serial)).split())
+        with self.lock:
+            if self.package == package:
+                self.pids = pids
+
+    def add_lines(self, lines):
+        entries = [entry for entry in map(parse_logcat_line, lines) if entry]
+        self.refresh_pids()
+        with self.lock:
+            self.received += len(entries)
+            self.lines.extend(entries)
+            for entry in entries:
+                if self.matches(entry):
+                    if len(self.pending) == self.pending.maxlen:
+                        self.dropped += 1
+                    self.pending.append(entry)
+
+    def drain(self):
+        with self.lock:
+            entries = list(self.pending)
+            self.pending.clear()
+        return entries
+
+    def run(self):
+        started = time.perf_counter()
+        size = 0
+        try:
+            sock = adb_open_service(f'shell:{self.cmd}', self.serial, 5)
+        except AdbUnavailable as e:
+            trace_call('stream', self.cmd, self.serial, started, 0, type(e).__name__)
+            return self.run_process()
+        except (AdbError, OSError) as e:
+            trace_call('stream', self.cmd, self.serial, started, 0, type(e).__name__)
+            return
+        sock.settimeout(0.5)
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        pending = ""
+        try:
+            while not self.stopped.is_set():
+                try:
+                    chunk = sock.recv(65536)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    break
+                size += len(chunk)
+                lines = (pending + decoder.decode(chunk)).split('\n')
+                pending = lines.pop()
+                self.add_lines(lines)
+        except OSError:
+            pass
+        finally:
+            sock.close()
+            trace_call('stream', self.cmd, self.serial, started, size)
+
+    def run_process(self):
+        args = ['adb', '-s', self.serial, 'shell', self.cmd] if self.serial else ['adb', 'shell', self.cmd]
+        try:
+            self.process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, encoding='utf-8',
+                                            errors='replace', creationflags=NO_WINDOW)
+        except OSError:
+            return
+        track_transport(self.serial, self.process)
+        if self.stopped.is_set():
+            self.process.kill()
+        for line in self.process.stdout:
+            self.add_lines([line])
+        self.process.wait()
+
+def run_fleet(serials, operation, *args, on_result=None):
+    futures = {fleet_pool.submit(operation, serial, *args): serial for serial in serials}
+    results = {}
+    for future in as_completed(futures):
+        serial = futures[future]
+        try:
+            results[serial] = future.result()
+        except Exception as e:
+            results[serial] = {'result': f"Error: {e}"}
+        if on_result:
+            on_result(serial, results[serial])
+    return results
+
+def fleet_status(serial):
+    invalidate_reads(serial, DISPLAY_QUERIES)
+    out = run_adb_batch(DEVICE_PROPS + DISPLAY_QUERIES + ['pm list packages'], serial=serial)
+    brand, model, code, version = parse_device_info(out)
+    (_, resolution), (_, dpi), fps, user_fps = get_display_state(out)
+    return {'model': f"{brand} {model}", 'packages': len(parse_packages(out['pm list packages'])),
+            'resolution': resolution, 'dpi': dpi, 'fps': fps, 'result': "OK" if model != "Unknown" else "No response"}
+
+def fleet_uninstall(serial, packages, keep_data=False, backup=False):
+    system_all = set(list_packages('pm list packages -s -u', serial)) if keep_data or backup else set()
+    if backup:
+        outputs = uninstall_with_backup(packages, system_all, keep_data, serial)
+    else:
+        outputs = run_package_commands(uninstall_commands(packages, system_all, keep_data), serial)
+    errors = [package_error(output, ["Success"]) for output in outputs]
+    return {'packages': len(list_packages('pm list packages', serial)), 'result': f"Uninstalled {errors.count(None)}/{len(packages)}"}
+
+def fleet_reinstall(serial, packages):
+    outputs = run_package_commands([f'cmd package install-existing {pkg}' for pkg in packages], serial)
+    errors = [package_error(output, ["Success", "Package"]) for output in outputs]
+    return {'packages': len(list_packages('pm list packages', serial)), 'result': f"Reinstalled {errors.count(None)}/{len(packages)}"}
+
+def fleet_install(serial, sets):
+    results = install_apk_sets(sets, serial)
+    installed = [result for result in results if result['error'] is None]
+    rate = sum(result['bytes'] for result in installed) / max(sum(result['seconds'] for result in installed), 0.001) / 1e6
+    return {'packages': len(list_packages('pm list packages', serial)),
+            'result': f"Installed {len(installed)}/{len(results)}" + (f" at {rate:.1f} MB/s" if installed else "")}
+
+def fleet_wm(serial, key, value):
+    ok = write_wm(key, value, serial)
+    (_, resolution), (_, dpi), _, _ = get_display_state(serial=serial)
+    label = "Resolution" if key == 'size' else "DPI"
+    return {'resolution': resolution, 'dpi': dpi, 'result': f"{label} {'reset' if value == 'reset' else 'set'}" if ok else f"Failed to set {label}"}
+
+def fleet_fps(serial, fps_val):
+    ok = write_refresh_rate(fps_val, serial)
+    return {'fps': get_fps(serial), 'result': "FPS already set" if ok is None else "FPS set" if ok else "Failed to set FPS"}
+
+def validate_profile(profile):
+    if not isinstance(profile, dict):
+        raise ValueError("Profile must be an object")
+    unknown = set(profile) - PROFILE_KEYS
+    if unknown:
+        raise ValueError(f"Unknown profile keys: {', '.join(sorted(unknown))}")
+    result = {'remove': [], 'keep': [], 'keep_data': bool(profile.get('keep_data', True))}
+    for key in ('remove', 'keep'):
+        packages = profile.get(key, [])
+        if not isinstance(packages, list) or not all(isinstance(pkg, str) and is_package_name(pkg) for pkg in packages):
+            raise ValueError(f"'{key}' must be a list of package names")
+        result[key] = list(dict.fromkeys(packages))
+    both = set(result['remove']) & set(result['keep'])
+    if both:
+        raise ValueError(f"Packages both removed and kept: {', '.join(sorted(both))}")
+    if 'resolution' in profile:
+        resolution = str(profile['resolution'])
+        if resolution != 'reset' and not re.fullmatch(r'[1-9]\d*x[1-9]\d*', resolution):
+            raise ValueError("'resolution' must be WIDTHxHEIGHT or reset")
+        result['resolution'] = resolution
+    if 'dpi' in profile:
+        dpi = str(profile['dpi'])
+        if dpi != 'reset' and not (dpi.isdigit() and int(dpi) > 0):
+            raise ValueError("'dpi' must be a positive number or reset")
+        result['dpi'] = dpi
+    if 'fps' in profile:
+        if profile['fps'] not in FPS_CHOICES:
+            raise ValueError(f"'fps' must be one of {', '.join(map(str, FPS_CHOICES))}")
+        result['fps'] = profile['fps']
+    return result
+
+def load_profile(path):
+    with open(path, 'rb') as f:
+        data = f.read().decode('utf-8')
+    if path.lower().endswith('.toml'):
+        if tomllib is None:
+            raise ValueError("TOML profiles need Python 3.11 or newer")
+        profile = tomllib.loads(data)
+    else:
+        profile = json.loads(data)
+    return validate_profile(profile)
+
+def read_profile_state(serial=None):
+    if not check_adb_connection(serial):
+        return None
+    out = run_adb_batch(PROFILE_QUERIES, serial=serial)
+    (original_res, current_res), (original_dpi, current_dpi), fps, user_fps = get_display_state(out)
+    return {'inventory': inventory_from_output(out),
+            'resolution': (original_res, current_res), 'dpi': (original_dpi, current_dpi), 'fps': (fps, user_fps)}
+
+def plan_profile(profile, state):
+    inventory = state['inventory']
+    plan = [('uninstall', pkg) for pkg in profile['remove'] if inventory.has(pkg, INSTALLED)]
+    plan += [('reinstall', pkg) for pkg in profile['keep'] if inventory.flag(pkg) in (0, SYSTEM)]
+    for key in ('resolution', 'dpi'):
+        original, current = state[key]
+        target = profile.get(key)
+        if target and current != (original if target == 'reset' else target):
+            plan.append((key, target))
+    if 'fps' in profile and state['fps'] != (str(profile['fps']),) * 2:
+        plan.append(('fps', profile['fps']))
+    return plan
+
+def apply_profile(profile, serial=None, dry_run=False, on_progress=None):
+    state = read_profile_state(serial)
+    if state is None:
+        raise AdbError("No device connected")
+    plan = plan_profile(profile, state)
+    if dry_run:
+        return [(action, target, None) for action, target in plan]
+    packages = [(action, target) for action, target in plan if action in ('uninstall', 'reinstall')]
+    system_all = {pkg for action, pkg in packages if state['inventory'].has(pkg, SYSTEM)}
+    cmds = [uninstall_commands([pkg], system_all, profile['keep_data'])[0] if action == 'uninstall' else f'cmd package install-existing {pkg}'
+            for action, pkg in packages]
+    outputs = dict(zip(packages, run_package_commands(cmds, serial, on_progress))) if cmds else {}
+    results = []
+    for action, target in plan:
+        if action == 'uninstall':
+            error = package_error(outputs[action, target], ["Success"])
+        elif action == 'reinstall':
+            error = package_error(outputs[action, target], ["Success", "Package"])
+        elif action == 'fps':
+            error = None if put_refresh_rate(target, serial) else "Failed"
+        else:
+            error = None if write_wm('size' if action == 'resolution' else 'density', target, serial) else "Failed"
+        results.append((action, target, error))
+    return results
+
+def profile_from_state(state):
+    (original_res, current_res), (original_dpi, current_dpi), (fps, _) = state['resolution'], state['dpi'], state['fps']
+    profile = {'remove': state['inventory'].select(0), 'keep': [], 'keep_data': True,
+               'resolution': current_res if current_res != original_res else 'reset',
+               'dpi': current_dpi if current_dpi != original_dpi else 'reset'}
+    if fps != "Unknown" and int(fps) in FPS_CHOICES:
+        profile['fps'] = int(fps)
+    return profile
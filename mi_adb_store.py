@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import time
+from mi_adb_core import APP_DIR, INFO_QUERIES, INSTALLED, INVENTORY_QUERIES, SYSTEM, get_info_state, inventory_from_output, run_adb_batch
+
+STORE_PATH = os.path.join(APP_DIR, "inventory.db")
+SCHEMA = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+CREATE TABLE IF NOT EXISTS devices (id INTEGER PRIMARY KEY, serial TEXT NOT NULL UNIQUE, brand TEXT, model TEXT, code TEXT,
+                                    firmware TEXT, kernel TEXT, digest TEXT, seen REAL);
+CREATE INDEX IF NOT EXISTS devices_firmware ON devices (firmware);
+CREATE TABLE IF NOT EXISTS packages (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS snapshots (id INTEGER PRIMARY KEY, device_id INTEGER NOT NULL, firmware TEXT, taken REAL NOT NULL,
+                                      packages INTEGER NOT NULL, changed INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS snapshots_device ON snapshots (device_id, taken);
+CREATE TABLE IF NOT EXISTS device_packages (device_id INTEGER NOT NULL, package_id INTEGER NOT NULL, flags INTEGER NOT NULL,
+                                            snapshot_id INTEGER NOT NULL, PRIMARY KEY (device_id, package_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS device_packages_package ON device_packages (package_id, flags);
+CREATE TABLE IF NOT EXISTS package_changes (package_id INTEGER NOT NULL, snapshot_id INTEGER NOT NULL, flags INTEGER,
+                                            PRIMARY KEY (package_id, snapshot_id)) WITHOUT ROWID;
+"""
+STATE_NAMES = {None: "absent", 0: "uninstalled", INSTALLED: "installed", SYSTEM: "system uninstalled", INSTALLED | SYSTEM: "system installed"}
+
+def open_store(path=STORE_PATH):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.executescript(SCHEMA)
+    return conn
+
+def package_ids(conn, names):
+    ids = dict(conn.execute("SELECT name, id FROM packages"))
+    missing = [(name,) for name in names if name not in ids]
+    if missing:
+        conn.executemany("INSERT OR IGNORE INTO packages (name) VALUES (?)", missing)
+        ids = dict(conn.execute("SELECT name, id FROM packages"))
+    return ids
+
+def record_inventory(conn, serial, info, kernel, inventory, taken=None):
+    brand, model, code, firmware = info
+    digest = inventory.digest()
+    taken = time.time() if taken is None else taken
+    with conn:
+        row = conn.execute("SELECT id, digest FROM devices WHERE serial = ?", (serial,)).fetchone()
+        if row is None:
+            device_id = conn.execute("INSERT INTO devices (serial) VALUES (?)", (serial,)).lastrowid
+            previous_digest = None
+        else:
+            device_id, previous_digest = row
+        conn.execute("UPDATE devices SET brand = ?, model = ?, code = ?, firmware = ?, kernel = ?, digest = ?, seen = ? WHERE id = ?",
+                     (brand, model, code, firmware, kernel, digest, taken, device_id))
+        changes = []
+        removed = []
+        if digest != previous_digest:
+            ids = package_ids(conn, inventory.names)
+            current = dict(conn.execute("SELECT package_id, flags FROM device_packages WHERE device_id = ?", (device_id,)))
+            changes = [(ids[name], flag) for name, flag in zip(inventory.names, inventory.flags) if current.get(ids[name]) != flag]
+            removed = current.keys() - {ids[name] for name in inventory.names}
+        snapshot_id = conn.execute("INSERT INTO snapshots (device_id, firmware, taken, packages, changed) VALUES (?, ?, ?, ?, ?)",
+                                   (device_id, firmware, taken, len(inventory), len(changes) + len(removed))).lastrowid
+        conn.executemany("INSERT OR REPLACE INTO device_packages (device_id, package_id, flags, snapshot_id) VALUES (?, ?, ?, ?)",
+                         [(device_id, package_id, flag, snapshot_id) for package_id, flag in changes])
+        conn.executemany("DELETE FROM device_packages WHERE device_id = ? AND package_id = ?", [(device_id, package_id) for package_id in removed])
+        conn.executemany("INSERT INTO package_changes (package_id, snapshot_id, flags) VALUES (?, ?, ?)",
+                         [(package_id, snapshot_id, flag) for package_id, flag in changes] + [(package_id, snapshot_id, None) for package_id in removed])
+    return {'serial': serial, 'snapshot': snapshot_id, 'inventory': len(inventory), 'changed': len(changes), 'removed': len(removed)}
+
+def record_snapshot(serial, info, kernel, inventory, path=STORE_PATH):
+    try:
+        conn = open_store(path)
+        try:
+            return record_inventory(conn, serial, info, kernel, inventory)
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError) as e:
+        return {'serial': serial, 'error': str(e)}
+
+def record_device(serial, path=STORE_PATH):
+    out = run_adb_batch(INFO_QUERIES + INVENTORY_QUERIES, serial=serial)
+    info, kernel, _, _ = get_info_state(out)
+    inventory = inventory_from_output(out)
+    if not len(inventory):
+        return {'serial': serial, 'error': "No packages returned"}
+    return record_snapshot(serial, info, kernel, inventory, path)
+
+def firmware_with_package(conn, package):
+    return [{'firmware': firmware, 'devices': devices, 'installed': installed} for firmware, devices, installed in conn.execute(
+        "SELECT d.firmware, COUNT(*), SUM(dp.flags & ?) FROM packages p JOIN device_packages dp ON dp.package_id = p.id "
+        "JOIN devices d ON d.id = dp.device_id WHERE p.name = ? GROUP BY d.firmware ORDER BY d.firmware", (INSTALLED, package))]
+
+def diff_devices(conn, serial_a, serial_b):
+    ids = [row[0] if row else None for row in (conn.execute("SELECT id FROM devices WHERE serial = ?", (serial,)).fetchone() for serial in (serial_a, serial_b))]
+    if None in ids:
+        return None
+    rows = conn.execute(
+        "SELECT p.name, a.flags, b.flags FROM (SELECT package_id FROM device_packages WHERE device_id IN (?, ?) "
+        "GROUP BY package_id HAVING COUNT(*) = 1 OR MIN(flags) != MAX(flags)) diff JOIN packages p ON p.id = diff.package_id "
+        "LEFT JOIN device_packages a ON a.device_id = ? AND a.package_id = diff.package_id "
+        "LEFT JOIN device_packages b ON b.device_id = ? AND b.package_id = diff.package_id ORDER BY p.name", ids + ids)
+    return [{'name': name, serial_a: STATE_NAMES[flags_a], serial_b: STATE_NAMES[flags_b]} for name, flags_a, flags_b in rows]
+
+def package_history(conn, package):
+    return [{'time': taken, 'serial': serial, 'firmware': firmware, 'state': STATE_NAMES[flags]} for taken, serial, firmware, flags in conn.execute(
+        "SELECT s.taken, d.serial, s.firmware, c.flags FROM packages p JOIN package_changes c ON c.package_id = p.id "
+        "JOIN snapshots s ON s.id = c.snapshot_id JOIN devices d ON d.id = s.device_id WHERE p.name = ? ORDER BY s.taken", (package,))]
+
+def stored_devices(conn):
+    return [{'serial': serial, 'model': f"{brand} {model}", 'firmware': firmware, 'kernel': kernel, 'packages': packages, 'snapshots': snapshots, 'seen': seen}
+            for serial, brand, model, firmware, kernel, seen, packages, snapshots in conn.execute(
+                "SELECT d.serial, d.brand, d.model, d.firmware, d.kernel, d.seen, "
+                "(SELECT COUNT(*) FROM device_packages dp WHERE dp.device_id = d.id), "
+                "(SELECT COUNT(*) FROM snapshots s WHERE s.device_id = d.id) FROM devices d ORDER BY d.serial")]
@@ -0,0 +1,763 @@
+import json
+import os
+import socket
+import struct
+import subprocess
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import mi_adb_core as core
+from mi_adb_bench import LOG_LINES, SCRIPT_RE, FakeAdbHandler, FakeAdbServer, FakeDevice
+
+class FragmentedShellHandler(FakeAdbHandler):
+    def shell_v2(self, device):
+        buffer = ""
+        while True:
+            packet_id, length = struct.unpack('<BI', self.recv_exact(5))
+            buffer += self.recv_exact(length).decode()
+            match = SCRIPT_RE.match(buffer)
+            if not match:
+                continue
+            buffer = buffer[match.end():]
+            cmd, marker = match.group(1), match.group(2)
+            if cmd == 'exit-shell':
+                self.request.sendall(struct.pack('<BI', core.SHELL_V2_EXIT, 1) + b'\0')
+                continue
+            code = 3 if cmd == 'fail' else 0
+            stdout = ("partial output\n" if cmd == 'fail' else device.run_script(cmd)) + f"{marker} {code}\n"
+            stderr = ("boom\n" if cmd == 'fail' else "") + marker + "\n"
+            for i, char in enumerate(stdout.encode()):
+                self.request.sendall(struct.pack('<BI', core.SHELL_V2_STDOUT, 1) + bytes([char]))
+                if i < len(stderr):
+                    self.request.sendall(struct.pack('<BI', core.SHELL_V2_STDERR, 1) + stderr.encode()[i:i + 1])
+            rest = stderr.encode()[len(stdout):]
+            if rest:
+                self.request.sendall(struct.pack('<BI', core.SHELL_V2_STDERR, len(rest)) + rest)
+
+class NoShellV2Handler(FakeAdbHandler):
+    def recv_exact(self, size):
+        data = super().recv_exact(size)
+        return b'shell,v2,unsupported' if data == b'shell,v2,raw:' else data
+
+class AdbTestCase(unittest.TestCase):
+    handler = None
+
+    def setUp(self):
+        self.device = FakeDevice("fake-0001", 4, 3)
+        self.server = FakeAdbServer([self.device], handler=self.handler)
+        self.saved_server = core.ADB_SERVER
+        core.ADB_SERVER = ('127.0.0.1', self.server.port)
+        self.reset_state()
+        self.calls = []
+        run = self.device.run
+        self.device.run = lambda cmd: (cmd.startswith('echo') or self.calls.append(cmd), run(cmd))[1]
+
+    def tearDown(self):
+        self.server.stop()
+        core.ADB_SERVER = self.saved_server
+        self.reset_state()
+
+    def reset_state(self):
+        for serial in list(core.adb_session_pool):
+            core.adb_close_sessions(serial)
+        core.adb_v1_serials.clear()
+        core.device_tracker_live.clear()
+        with core.read_cache_lock:
+            core.read_cache.clear()
+
+class AdbShellSessionTest(AdbTestCase):
+    handler = FragmentedShellHandler
+
+    def test_run_returns_stdout_and_exit_code(self):
+        session = core.AdbShellSession("fake-0001")
+        try:
+            self.assertEqual(session.run('getprop ro.product.model'), (0, "Fake fake-0001\n", ""))
+        finally:
+            session.close()
+
+    def test_run_splits_stderr_and_nonzero_exit_code(self):
+        session = core.AdbShellSession("fake-0001")
+        try:
+            self.assertEqual(session.run('fail'), (3, "partial output\n", "boom\n"))
+            self.assertEqual(session.run('echo next'), (0, "next\n", ""))
+        finally:
+            session.close()
+
+    def test_markers_are_unique_per_command(self):
+        session = core.AdbShellSession("fake-0001")
+        try:
+            outputs = [session.run(f'echo {i}')[1] for i in range(5)]
+        finally:
+            session.close()
+        self.assertEqual(outputs, [f"{i}\n" for i in range(5)])
+        self.assertEqual(session.counter, 5)
+
+    def test_exit_packet_raises(self):
+        session = core.AdbShellSession("fake-0001")
+        try:
+            with self.assertRaises(core.AdbError):
+                session.run('exit-shell')
+        finally:
+            session.close()
+
+class ShellFallbackTest(AdbTestCase):
+    def test_reuses_pooled_session(self):
+        core.adb_shell('echo one', "fake-0001")
+        session = core.adb_session_pool["fake-0001"][0]
+        self.assertEqual(core.adb_shell('echo two', "fake-0001"), ("two\n", ""))
+        self.assertIs(core.adb_session_pool["fake-0001"][0], session)
+
+    def test_stale_pooled_session_is_replaced_before_sending(self):
+        core.adb_shell('echo one', "fake-0001")
+        core.adb_session_pool["fake-0001"][0].sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(core.adb_shell('pm uninstall --user 0 com.user.app0', "fake-0001"), ("Success\n", ""))
+        self.assertEqual(self.calls.count('pm uninstall --user 0 com.user.app0'), 1)
+
+    def test_timeout_is_raised_without_rerunning(self):
+        self.server.latency = 0.5
+        with mock.patch.object(core, 'run_process') as run_process:
+            with self.assertRaises(OSError):
+                core.adb_shell('pm uninstall --user 0 com.user.app0', "fake-0001", timeout=0.1)
+        run_process.assert_not_called()
+        time.sleep(0.6)
+        self.assertEqual(self.calls.count('pm uninstall --user 0 com.user.app0'), 1)
+        self.assertNotIn("fake-0001", [serial for serial, idle in core.adb_session_pool.items() if idle])
+
+    def test_subprocess_fallback_when_server_unreachable(self):
+        self.server.stop()
+        result = subprocess.CompletedProcess([], 0, "from adb\n", "")
+        with mock.patch.object(core, 'run_process', return_value=result) as run_process:
+            self.assertEqual(core.adb_shell('getprop ro.product.model', "fake-0001"), ("from adb\n", ""))
+        run_process.assert_called_once_with(['adb', '-s', "fake-0001", 'shell', 'getprop ro.product.model'], "fake-0001", 5)
+
+class ShellV1FallbackTest(AdbTestCase):
+    handler = NoShellV2Handler
+
+    def test_falls_back_to_shell_v1(self):
+        self.assertEqual(core.adb_native_shell('getprop ro.product.model', "fake-0001"), (None, "Fake fake-0001\n", ""))
+        self.assertIn("fake-0001", core.adb_v1_serials)
+        self.assertEqual(core.adb_shell('echo again', "fake-0001"), ("again\n", ""))
+        self.assertNotIn("fake-0001", core.adb_session_pool)
+
+class RunAdbBatchTest(AdbTestCase):
+    def test_splits_outputs_per_command(self):
+        out = core.run_adb_batch(['getprop ro.product.brand', 'getprop ro.product.model', 'wm density'], serial="fake-0001")
+        self.assertEqual(out['getprop ro.product.brand'], ["Xiaomi"])
+        self.assertEqual(out['getprop ro.product.model'], ["Fake fake-0001"])
+        self.assertEqual(out['wm density'], ["Physical density: 440"])
+        self.assertEqual(len(self.calls), 3)
+
+    def test_empty_output_stays_empty(self):
+        out = core.run_adb_batch(['which su', 'getprop ro.product.brand'], serial="fake-0001")
+        self.assertEqual(out, {'which su': [""], 'getprop ro.product.brand': ["Xiaomi"]})
+
+    def test_duplicate_commands_run_once(self):
+        out = core.run_adb_batch(['pm list packages -s -u', 'pm list packages -s -u'], serial="fake-0001")
+        self.assertEqual(len(out['pm list packages -s -u']), 4)
+        self.assertEqual(self.calls, ['pm list packages -s -u'])
+
+    def test_rejects_invalid_commands_without_running_them(self):
+        out = core.run_adb_batch(['reboot', 'getprop ro.product.brand'], serial="fake-0001")
+        self.assertEqual(out['reboot'], ["Error: Invalid command"])
+        self.assertEqual(out['getprop ro.product.brand'], ["Xiaomi"])
+        self.assertEqual(self.calls, ['getprop ro.product.brand'])
+
+    def test_missing_device(self):
+        out = core.run_adb_batch(['getprop ro.product.brand'], serial="missing")
+        self.assertEqual(out['getprop ro.product.brand'], ["Error: No device connected"])
+        self.assertEqual(self.calls, [])
+
+    def test_failures_are_reported_per_command(self):
+        with mock.patch.object(core, 'adb_shell', side_effect=core.AdbError("boom")):
+            out = core.run_adb_batch(['getprop ro.product.model', 'pm list packages'], serial="fake-0001")
+        self.assertEqual(out, {'getprop ro.product.model': ["Error: ADB failed"], 'pm list packages': ["Error: ADB failed"]})
+
+class InstallApksTest(AdbTestCase):
+    def setUp(self):
+        super().setUp()
+        self.apk = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "base.apk")
+        with open(self.apk, 'wb') as f:
+            f.write(b"com.test.app\n" + b"x" * 4096)
+        self.files = [("base.apk", self.apk, os.path.getsize(self.apk))]
+
+    def test_streams_single_apk(self):
+        self.assertIsNone(core.install_apks(self.files, "fake-0001"))
+        self.assertEqual(self.device.packages["com.test.app"], [False, True])
+
+    def test_mid_stream_failure_is_returned_without_reinstalling(self):
+        def on_bytes(count):
+            raise ConnectionResetError("connection reset")
+        with mock.patch.object(core, 'run_process') as run_process:
+            self.assertEqual(core.install_apks(self.files, "fake-0001", on_bytes), "connection reset")
+        run_process.assert_not_called()
+
+    def test_falls_back_to_adb_install_when_server_unreachable(self):
+        self.server.stop()
+        result = subprocess.CompletedProcess([], 0, "Success\n", "")
+        with mock.patch.object(core, 'run_process', return_value=result) as run_process:
+            self.assertIsNone(core.install_apks(self.files, "fake-0001"))
+        run_process.assert_called_once_with(['adb', '-s', "fake-0001", 'install', '-r', self.apk], "fake-0001", core.INSTALL_TIMEOUT)
+
+class StreamLinesTest(AdbTestCase):
+    def test_streams_lines(self):
+        self.assertEqual(list(core.adb_stream_lines('pm list packages -s -u', "fake-0001"))[:1], ["package:com.android.system0"])
+
+    def test_subprocess_fallback_when_server_unreachable(self):
+        self.server.stop()
+        with mock.patch.object(core, 'adb_process_lines', return_value=iter(["from adb"])) as process_lines:
+            self.assertEqual(list(core.adb_stream_lines('getprop ro.product.model', "fake-0001")), ["from adb"])
+        process_lines.assert_called_once_with('getprop ro.product.model', "fake-0001")
+
+    def test_other_errors_are_raised(self):
+        with mock.patch.object(core, 'adb_open_service', side_effect=core.AdbError("device offline")), \
+             mock.patch.object(core, 'adb_process_lines') as process_lines:
+            with self.assertRaises(core.AdbError):
+                list(core.adb_stream_lines('getprop ro.product.model', "fake-0001"))
+        process_lines.assert_not_called()
+
+class ParseDumpsysPackagesTest(unittest.TestCase):
+    def test_fake_device_output(self):
+        device = FakeDevice("fake-0001", 2, 1)
+        device.packages["com.android.system0"][1] = False
+        records = {record['name']: record for record in core.parse_dumpsys_packages(device.dumpsys_package().split('\n'))}
+        self.assertEqual(sorted(records), ["com.android.system0", "com.miui.system1", "com.user.app0"])
+        system = records["com.android.system0"]
+        self.assertTrue(system['system'])
+        self.assertFalse(system['installed'])
+        self.assertEqual(system['installer'], "")
+        self.assertEqual(system['path'], "/system/app/com.android.system0")
+        user = records["com.user.app0"]
+        self.assertEqual((user['version'], user['version_code'], user['installer']), ("1.2", "3", "com.android.vending"))
+        self.assertEqual((user['first_install'], user['last_update']), ("2024-01-01 00:00:00", "2024-06-01 12:00:00"))
+        self.assertFalse(user['system'])
+
+    def test_user_sections(self):
+        lines = ["Packages:",
+                 "  Package [com.example] (abc):",
+                 "    versionName=2.0",
+                 "    User 0: ceDataInode=1 installed=true hidden=false enabled=3",
+                 "      lastDisabledCaller: com.android.settings",
+                 "    User 10: ceDataInode=2 installed=false hidden=false enabled=0",
+                 "      versionName=ignored",
+                 "  Package [com.other] (def):",
+                 "    User 0: installed=false enabled=0",
+                 "",
+                 "Hidden system packages:",
+                 "  Package [com.hidden] (0):"]
+        records = list(core.parse_dumpsys_packages(lines))
+        self.assertEqual([record['name'] for record in records], ["com.example", "com.other"])
+        self.assertEqual((records[0]['version'], records[0]['enabled'], records[0]['installed']), ("2.0", "Disabled by user", True))
+        self.assertFalse(records[1]['installed'])
+
+    def test_no_packages_section(self):
+        self.assertEqual(list(core.parse_dumpsys_packages(["Error: ADB failed"])), [])
+
+class PackageInventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.inventory = core.PackageInventory.from_lists(["com.a", "com.user"], ["com.a", "com.b"], ["com.user", "com.gone"])
+
+    def test_from_lists(self):
+        self.assertEqual(self.inventory.names, ["com.a", "com.b", "com.gone", "com.user"])
+        self.assertEqual(list(self.inventory.flags), [core.INSTALLED | core.SYSTEM, core.SYSTEM, 0, core.INSTALLED])
+
+    def test_with_changes(self):
+        changed = self.inventory.with_changes(uninstalled=["com.a", "com.missing"], removed=["com.user"], reinstalled=["com.b"])
+        self.assertEqual(changed.names, ["com.a", "com.b", "com.gone"])
+        self.assertEqual(changed.flag("com.a"), core.SYSTEM)
+        self.assertEqual(changed.flag("com.b"), core.INSTALLED | core.SYSTEM)
+        self.assertIsNone(changed.flag("com.user"))
+        self.assertIsNone(changed.flag("com.missing"))
+        self.assertEqual(changed.positions, {"com.a": 0, "com.b": 1, "com.gone": 2})
+
+    def test_with_changes_leaves_original_untouched(self):
+        digest = self.inventory.digest()
+        self.inventory.with_changes(uninstalled=["com.a"], removed=["com.b"])
+        self.assertEqual(self.inventory.digest(), digest)
+        self.assertEqual(len(self.inventory), 4)
+
+    def test_digest_tracks_flags(self):
+        self.assertNotEqual(self.inventory.with_changes(uninstalled=["com.a"]).digest(), self.inventory.digest())
+        self.assertEqual(self.inventory.with_changes().digest(), self.inventory.digest())
+
+class ReadCacheTest(AdbTestCase):
+    def test_caches_only_cacheable_reads(self):
+        cmds = ['getprop ro.product.model', 'pm list packages']
+        core.run_adb_batch(cmds, serial="fake-0001")
+        core.run_adb_batch(cmds, serial="fake-0001")
+        self.assertEqual(self.calls.count('getprop ro.product.model'), 1)
+        self.assertEqual(self.calls.count('pm list packages'), 2)
+
+    def test_cache_is_per_device(self):
+        core.run_adb_batch(['getprop ro.product.model'], serial="fake-0001")
+        core.invalidate_reads("fake-0001")
+        core.run_adb_batch(['getprop ro.product.model'], serial="fake-0001")
+        self.assertEqual(self.calls.count('getprop ro.product.model'), 2)
+
+    def test_expired_entries_are_refetched(self):
+        core.run_adb_batch(['wm size'], serial="fake-0001")
+        with mock.patch.object(core.time, 'monotonic', return_value=time.monotonic() + core.READ_TTLS['wm size'] + 1):
+            core.run_adb_batch(['wm size'], serial="fake-0001")
+        self.assertEqual(self.calls.count('wm size'), 2)
+
+    def test_write_invalidates_cached_read(self):
+        core.run_adb_batch(['wm density'], serial="fake-0001")
+        self.assertTrue(core.write_wm('density', '400', "fake-0001"))
+        self.assertEqual(core.run_adb_batch(['wm density'], serial="fake-0001")['wm density'],
+                         ["Physical density: 440", "Override density: 400"])
+        self.assertEqual(core.shell_output('wm density reset', "fake-0001"), "")
+        self.assertEqual(core.run_adb_batch(['wm density'], serial="fake-0001")['wm density'], ["Physical density: 440"])
+        self.assertEqual(self.calls.count('wm density'), 2)
+
+    def test_failures_are_not_cached(self):
+        with mock.patch.object(core, 'adb_shell', side_effect=core.AdbError("boom")):
+            core.run_adb_batch(['getprop ro.product.model'], serial="fake-0001")
+        self.assertEqual(core.run_adb_batch(['getprop ro.product.model'], serial="fake-0001")['getprop ro.product.model'], ["Fake fake-0001"])
+
+class ScreenPreviewTest(AdbTestCase):
+    def load(self, preview, data):
+        preview.raw[:] = data
+        preview.size = len(data)
+
+    def test_reads_screencap(self):
+        preview = core.ScreenPreview("fake-0001")
+        preview.read()
+        self.assertEqual(bytes(preview.raw[:preview.size]), self.device.screen)
+
+    def test_subprocess_fallback_when_server_unreachable(self):
+        self.server.stop()
+        result = subprocess.CompletedProcess([], 0, b"raw", b"")
+        preview = core.ScreenPreview("fake-0001")
+        with mock.patch.object(core, 'run_process', return_value=result) as run_process:
+            preview.read()
+        run_process.assert_called_once_with(['adb', '-s', "fake-0001", 'exec-out', 'screencap'], "fake-0001", 10, text=False)
+        self.assertEqual(bytes(preview.raw[:preview.size]), b"raw")
+
+    def test_other_errors_are_raised(self):
+        preview = core.ScreenPreview("fake-0001")
+        with mock.patch.object(core, 'adb_open_service', side_effect=core.AdbError("device offline")), \
+             mock.patch.object(core, 'run_process') as run_process:
+            self.assertIsNone(preview.grab())
+        run_process.assert_not_called()
+
+    def test_decode_swaps_channels_for_bgra(self):
+        preview = core.ScreenPreview()
+        pixels = bytes([1, 2, 3, 255, 4, 5, 6, 255])
+        self.load(preview, struct.pack('<III', 2, 1, 5) + pixels)
+        self.assertEqual(preview.decode(), (b'P6 2 1 255\n' + bytes([3, 2, 1, 6, 5, 4]), 2, 1))
+
+    def test_decode_downscales_to_max_height(self):
+        preview = core.ScreenPreview(max_height=2)
+        pixels = bytes(range(4 * 4 * 4))
+        self.load(preview, struct.pack('<IIII', 4, 4, 1, 0) + pixels)
+        frame, width, height = preview.decode()
+        self.assertEqual((width, height), (2, 2))
+        self.assertEqual(frame[-12:], bytes([0, 1, 2, 8, 9, 10, 32, 33, 34, 40, 41, 42]))
+
+    def test_decode_rejects_bad_data(self):
+        preview = core.ScreenPreview()
+        self.load(preview, b"short")
+        self.assertRaises(core.AdbError, preview.decode)
+        self.load(preview, struct.pack('<III', 2, 1, 9) + bytes(8))
+        self.assertRaises(core.AdbError, preview.decode)
+        self.load(preview, struct.pack('<III', 2, 2, 1) + bytes(8))
+        self.assertRaises(core.AdbError, preview.decode)
+
+class LogcatStreamTest(AdbTestCase):
+    def test_streams_lines_from_the_server(self):
+        stream = core.LogcatStream("fake-0001", size=LOG_LINES)
+        stream.run_process = mock.Mock()
+        stream.start()
+        deadline = time.monotonic() + 5
+        while stream.received < LOG_LINES and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stream.stop()
+        stream.thread.join(2)
+        self.assertEqual(stream.received, LOG_LINES)
+        stream.run_process.assert_not_called()
+
+    def test_subprocess_fallback_when_server_unreachable(self):
+        self.server.stop()
+        stream = core.LogcatStream("fake-0001")
+        with mock.patch.object(stream, 'run_process') as run_process:
+            stream.run()
+        run_process.assert_called_once_with()
+
+    def test_other_errors_end_the_stream(self):
+        stream = core.LogcatStream("fake-0001")
+        with mock.patch.object(core, 'adb_open_service', side_effect=core.AdbError("device offline")), \
+             mock.patch.object(stream, 'run_process') as run_process:
+            stream.run()
+        run_process.assert_not_called()
+
+class LogcatFilterTest(unittest.TestCase):
+    def test_parse_logcat_line(self):
+        self.assertEqual(core.parse_logcat_line("10-18 12:00:01.123  1234  1240 W ActivityManager: Slow operation: 52ms\r\n"),
+                         ("10-18 12:00:01.123", "1234", "W", "ActivityManager", "Slow operation: 52ms"))
+        self.assertIsNone(core.parse_logcat_line("--------- beginning of main"))
+
+    def test_level_is_quoted_for_the_device_shell(self):
+        self.assertTrue(core.LogcatStream(level='W').cmd.endswith(" '*:W'"))
+
+    def test_matches_tag_and_package(self):
+        stream = core.LogcatStream()
+        entry = ("10-18 12:00:01.123", "1234", "I", "ActivityManager", "Start proc com.user.app0")
+        self.assertTrue(stream.matches(entry))
+        stream.set_filter(tag="activity")
+        self.assertTrue(stream.matches(entry))
+        stream.set_filter(tag="window")
+        self.assertFalse(stream.matches(entry))
+        stream.set_filter(package="com.user.app0")
+        self.assertTrue(stream.matches(entry))
+        stream.set_filter(package="com.user.app1")
+        self.assertFalse(stream.matches(entry))
+        stream.pids = {"1234"}
+        self.assertTrue(stream.matches(entry))
+
+    def test_filter_replays_buffered_lines(self):
+        stream = core.LogcatStream()
+        stream.add_lines(["10-18 12:00:01.123  1234  1240 I Tag0: one", "10-18 12:00:01.124  1234  1240 I Tag1: two"])
+        self.assertEqual(len(stream.drain()), 2)
+        stream.set_filter(tag="tag1")
+        self.assertEqual([entry[4] for entry in stream.drain()], ["two"])
+
+    def test_refresh_pids(self):
+        stream = core.LogcatStream("fake-0001")
+        stream.set_filter(package="com.user.app0")
+        with mock.patch.object(core, 'run_adb_cmd', return_value=["1234 5678"]) as run_adb_cmd:
+            stream.refresh_pids()
+            stream.refresh_pids()
+        run_adb_cmd.assert_called_once_with('pidof com.user.app0', "fake-0001")
+        self.assertEqual(stream.pids, {"1234", "5678"})
+
+    def test_refresh_pids_is_dropped_when_filter_changes(self):
+        stream = core.LogcatStream("fake-0001")
+        stream.set_filter(package="com.user.app0")
+        def pidof(cmd, serial):
+            stream.set_filter(package="com.user.app1")
+            return ["1234"]
+        with mock.patch.object(core, 'run_adb_cmd', side_effect=pidof):
+            stream.refresh_pids()
+        self.assertEqual(stream.pids, set())
+
+    def test_invalid_package_is_not_passed_to_pidof(self):
+        stream = core.LogcatStream("fake-0001")
+        stream.set_filter(package="com.user.app0; reboot")
+        with mock.patch.object(core, 'run_adb_cmd') as run_adb_cmd:
+            stream.refresh_pids()
+        run_adb_cmd.assert_not_called()
+
+class BackupManifestTest(unittest.TestCase):
+    def setUp(self):
+        store = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(mock.patch.object(core, 'APK_STORE_DIR', store))
+        self.digest = "ab" * 32
+        path = core.apk_object_path(self.digest)
+        os.makedirs(os.path.dirname(path))
+        open(path, 'wb').close()
+        self.files = [{'name': "base.apk", 'sha256': self.digest, 'size': 10}]
+
+    def write_manifest(self, manifest, serial="bad"):
+        path = core.backup_manifest_path("com.user.app0", serial)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        return path
+
+    def test_save_and_read(self):
+        core.save_backup("com.user.app0", "dev:5555", self.files)
+        path = core.backup_manifest_path("com.user.app0", "dev:5555")
+        self.assertEqual(os.path.basename(path), "dev_5555.json")
+        backup = core.read_backup(path)
+        self.assertEqual((backup['package'], backup['serial'], backup['files']), ("com.user.app0", "dev:5555", self.files))
+        self.assertEqual(os.listdir(os.path.dirname(path)), ["dev_5555.json"])
+
+    def test_load_prefers_own_device_then_newest(self):
+        with mock.patch.object(core.time, 'time', return_value=100):
+            core.save_backup("com.user.app0", "a", self.files)
+        with mock.patch.object(core.time, 'time', return_value=200):
+            core.save_backup("com.user.app0", "b", self.files)
+        self.assertEqual(core.load_backup("com.user.app0", "a")['serial'], "a")
+        self.assertEqual(core.load_backup("com.user.app0", "c")['serial'], "b")
+        self.assertEqual(len(core.list_backups()), 2)
+
+    def test_missing_objects_are_not_a_backup(self):
+        core.save_backup("com.user.app0", "a", [{'name': "base.apk", 'sha256': "cd" * 32, 'size': 10}])
+        self.assertIsNone(core.load_backup("com.user.app0", "a"))
+
+    def test_malformed_manifests_are_not_a_backup(self):
+        good = {'package': "com.user.app0", 'serial': "bad", 'time': 1, 'files': self.files}
+        manifests = [[], {**good, 'files': None}, {**good, 'files': []}, {**good, 'files': ["base.apk"]},
+                     {**good, 'time': "1"}, {**good, 'serial': 5}, {k: v for k, v in good.items() if k != 'package'},
+                     {**good, 'files': [{'name': "base.apk", 'size': 10}]},
+                     {**good, 'files': [{'name': "base.apk", 'sha256': "../../x", 'size': 10}]},
+                     {**good, 'files': [{'name': "base.apk", 'sha256': self.digest, 'size': "10"}]},
+                     {**good, 'files': [{'sha256': self.digest, 'size': 10}]}]
+        for manifest in manifests:
+            self.assertIsNone(core.read_backup(self.write_manifest(manifest)), manifest)
+        self.assertEqual(core.read_backup(self.write_manifest(good)), good)
+
+    def test_restore_reports_malformed_manifest_as_missing(self):
+        self.write_manifest({'package': "com.user.app0", 'serial': "bad", 'time': 1, 'files': [{'name': "base.apk"}]})
+        with mock.patch.object(core, 'install_apks') as install_apks:
+            self.assertEqual(core.restore_packages(["com.user.app0"], "bad"), ["No backup"])
+        install_apks.assert_not_called()
+
+class SnapshotTest(AdbTestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch.object(core, 'SNAPSHOT_DIR', self.enterContext(tempfile.TemporaryDirectory())))
+        loaded = core.load_device("fake-0001")
+        self.key, self.inventory = loaded[3], loaded[1]
+        self.calls.clear()
+
+    def test_save_and_load(self):
+        self.assertEqual(len(self.inventory), 7)
+        self.assertEqual(self.key[0], "fake-0001")
+        self.assertEqual(core.load_snapshot(self.key).digest(), self.inventory.digest())
+        self.assertIsNone(core.load_snapshot(("fake-0001", "other")))
+        self.assertIsNone(core.load_snapshot(("fake-0001", "Unknown")))
+
+    def test_patch_snapshot(self):
+        core.patch_snapshot(self.key, uninstalled=["com.user.app0"])
+        self.assertEqual(core.load_snapshot(self.key).flag("com.user.app0"), 0)
+
+    def test_load_device_uses_snapshot(self):
+        loaded = core.load_device("fake-0001")
+        self.assertTrue(loaded[4])
+        self.assertEqual(loaded[1].digest(), core.load_snapshot(loaded[3]).digest())
+        self.assertFalse(any(cmd.startswith('pm list packages') for cmd in self.calls))
+
+    def test_validate_unchanged_snapshot_is_one_read(self):
+        self.assertIsNone(core.validate_snapshot(self.key, self.inventory))
+        self.assertEqual(self.calls, core.SNAPSHOT_QUERIES)
+
+    def test_validate_detects_install_state_changes(self):
+        self.device.packages["com.user.app0"][1] = False
+        self.device.packages["com.android.system0"][1] = False
+        current = core.validate_snapshot(self.key, self.inventory)
+        self.assertEqual(current.flag("com.user.app0"), 0)
+        self.assertEqual(current.flag("com.android.system0"), core.SYSTEM)
+        self.assertEqual(self.calls, core.SNAPSHOT_QUERIES)
+        self.assertEqual(core.load_snapshot(self.key).digest(), current.digest())
+
+    def test_validate_reads_system_list_for_new_packages(self):
+        self.device.packages["com.android.new"] = [True, True]
+        self.device.packages["com.user.new"] = [False, True]
+        del self.device.packages["com.user.app1"]
+        current = core.validate_snapshot(self.key, self.inventory)
+        self.assertEqual(current.digest(), core.fetch_inventory("fake-0001").digest())
+        self.assertEqual(current.flag("com.android.new"), core.INSTALLED | core.SYSTEM)
+        self.assertEqual(current.flag("com.user.new"), core.INSTALLED)
+        self.assertIsNone(current.flag("com.user.app1"))
+        self.assertIn('pm list packages -s -u', self.calls)
+
+class DeviceSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = core.DeviceScheduler(workers=0)
+        self.addCleanup(self.scheduler.shutdown)
+
+    def test_can_start(self):
+        can_start = self.scheduler.can_start
+        self.assertTrue(all(can_start("a", priority) for priority in range(3)))
+        self.scheduler.running["a"] = [0, 1, 1]
+        self.assertTrue(can_start("a", core.PRIORITY_WRITE))
+        self.assertFalse(can_start("a", core.PRIORITY_READ))
+        self.assertFalse(can_start("a", core.PRIORITY_PREFETCH))
+        self.assertTrue(can_start("b", core.PRIORITY_READ))
+        self.scheduler.running["a"] = [1, 1, 1]
+        self.assertFalse(can_start("a", core.PRIORITY_WRITE))
+        self.scheduler.running["a"] = [2, 0, 0]
+        self.assertTrue(can_start("a", core.PRIORITY_READ))
+        self.assertTrue(can_start("a", core.PRIORITY_PREFETCH))
+
+    def test_single_slot_still_runs_reads(self):
+        scheduler = core.DeviceScheduler(workers=0, per_device=1)
+        self.addCleanup(scheduler.shutdown)
+        self.assertTrue(scheduler.can_start("a", core.PRIORITY_READ))
+        scheduler.running["a"] = [0, 1, 0]
+        self.assertFalse(scheduler.can_start("a", core.PRIORITY_WRITE))
+
+    def test_next_task_orders_by_priority_then_submission(self):
+        futures = [self.scheduler.submit("a", priority, print) for priority in (core.PRIORITY_PREFETCH, core.PRIORITY_READ,
+                                                                                core.PRIORITY_WRITE, core.PRIORITY_READ)]
+        order = [self.scheduler.next_task()[1][2] for _ in futures]
+        self.assertEqual(order, [futures[2], futures[1], futures[3], futures[0]])
+        self.assertEqual(self.scheduler.next_task(), (None, None))
+
+    def test_cancel_device(self):
+        futures = [self.scheduler.submit(serial, core.PRIORITY_READ, print) for serial in ("a", "a", "b")]
+        self.scheduler.cancel_device("a")
+        self.assertEqual([future.cancelled() for future in futures], [True, True, False])
+        self.assertEqual(self.scheduler.next_task()[0], "b")
+
+    def test_runs_tasks(self):
+        scheduler = core.DeviceScheduler(workers=2)
+        self.addCleanup(scheduler.shutdown)
+        futures = [scheduler.submit("a", priority, pow, 2, priority) for priority in range(3)]
+        self.assertEqual([future.result(5) for future in futures], [1, 2, 4])
+        self.assertEqual(scheduler.running["a"], [0, 0, 0])
+
+    def test_shutdown_cancels_queued_tasks(self):
+        future = self.scheduler.submit("a", core.PRIORITY_READ, print)
+        self.scheduler.shutdown()
+        self.assertTrue(future.cancelled())
+        self.assertTrue(self.scheduler.submit("a", core.PRIORITY_READ, print).cancelled())
+
+class ProfileTest(AdbTestCase):
+    def state(self, resolution=("1080x2400", "1080x2400"), dpi=("440", "440"), fps=("120", "120")):
+        inventory = core.PackageInventory.from_lists(["com.sys.on", "com.user.on"], ["com.sys.on", "com.sys.off"], ["com.user.on", "com.user.off"])
+        return {'inventory': inventory, 'resolution': resolution, 'dpi': dpi, 'fps': fps}
+
+    def test_validate_profile(self):
+        profile = core.validate_profile({'remove': ["com.a", "com.a"], 'resolution': "720x1600", 'dpi': 320, 'fps': 60})
+        self.assertEqual(profile, {'remove': ["com.a"], 'keep': [], 'keep_data': True, 'resolution': "720x1600", 'dpi': "320", 'fps': 60})
+
+    def test_validate_profile_rejects_bad_values(self):
+        for profile in ([], {'colour': 1}, {'remove': "com.a"}, {'remove': ["com.a; reboot"]}, {'keep': [1]},
+                        {'remove': ["com.a"], 'keep': ["com.a"]}, {'resolution': "big"}, {'dpi': "0"}, {'fps': 75}):
+            with self.assertRaises(ValueError, msg=profile):
+                core.validate_profile(profile)
+
+    def test_plan_profile(self):
+        profile = core.validate_profile({'remove': ["com.sys.on", "com.user.off", "com.missing"], 'keep': ["com.sys.off", "com.user.on"],
+                                         'resolution': "reset", 'dpi': 400, 'fps': 60})
+        state = self.state(resolution=("1080x2400", "720x1600"))
+        self.assertEqual(core.plan_profile(profile, state), [('uninstall', "com.sys.on"), ('reinstall', "com.sys.off"),
+                                                             ('resolution', "reset"), ('dpi', "400"), ('fps', 60)])
+
+    def test_plan_profile_skips_settings_already_applied(self):
+        profile = core.validate_profile({'resolution': "reset", 'dpi': 440, 'fps': 120})
+        self.assertEqual(core.plan_profile(profile, self.state()), [])
+
+    def test_profile_from_state_round_trips(self):
+        state = self.state(dpi=("440", "400"), fps=("60", "120"))
+        profile = core.profile_from_state(state)
+        self.assertEqual(profile, {'remove': ["com.sys.off", "com.user.off"], 'keep': [], 'keep_data': True,
+                                   'resolution': "reset", 'dpi': "400", 'fps': 60})
+        self.assertEqual(core.validate_profile(profile), profile)
+        self.assertEqual(core.plan_profile(profile, state), [('fps', 60)])
+
+    def test_dry_run_does_not_write(self):
+        profile = core.validate_profile({'remove': ["com.user.app0"], 'dpi': 400})
+        self.assertEqual(core.apply_profile(profile, "fake-0001", dry_run=True), [('uninstall', "com.user.app0", None), ('dpi', "400", None)])
+        self.assertFalse(any(cmd.startswith(('pm uninstall', 'wm density 400')) for cmd in self.calls))
+        self.assertEqual(self.device.packages["com.user.app0"], [False, True])
+
+class DeviceTrackingTest(AdbTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(core.update_device_states, {})
+        core.device_change_event.clear()
+
+    def test_parse_device_list(self):
+        self.assertEqual(core.parse_device_list("abc\tdevice\ndef\tunauthorized\r\n\nnoise\n"), {"abc": "device", "def": "unauthorized"})
+
+    def test_adb_devices(self):
+        self.assertEqual(core.adb_devices(), {"fake-0001": "device"})
+
+    def test_tracked_states_are_used_for_checks(self):
+        core.update_device_states({"fake-0001": "device", "other": "offline"})
+        self.assertTrue(core.device_tracker_live.is_set())
+        self.assertTrue(core.device_change_event.is_set())
+        with mock.patch.object(core, 'adb_devices') as adb_devices:
+            self.assertTrue(core.check_adb_connection("fake-0001"))
+            self.assertFalse(core.check_adb_connection("other"))
+            self.assertEqual(core.online_serials(), ["fake-0001"])
+        adb_devices.assert_not_called()
+
+    def test_unchanged_states_do_not_signal(self):
+        core.update_device_states({"fake-0001": "device"})
+        core.device_change_event.clear()
+        core.update_device_states({"fake-0001": "device"})
+        self.assertFalse(core.device_change_event.is_set())
+
+    def test_removed_device_drops_sessions_and_cache(self):
+        core.update_device_states({"fake-0001": "device"})
+        core.run_adb_batch(['getprop ro.product.model'], serial="fake-0001")
+        self.assertIn("fake-0001", core.adb_session_pool)
+        core.update_device_states({})
+        self.assertNotIn("fake-0001", core.adb_session_pool)
+        self.assertEqual(core.cached_reads(['getprop ro.product.model'], "fake-0001"), {})
+
+    def test_device_going_offline_cancels_its_queued_tasks(self):
+        scheduler = core.DeviceScheduler(workers=0)
+        self.addCleanup(scheduler.shutdown)
+        core.update_device_states({"fake-0001": "device", "other": "device"})
+        futures = [scheduler.submit(serial, core.PRIORITY_READ, print) for serial in ("fake-0001", "other")]
+        core.update_device_states({"fake-0001": "offline", "other": "device"})
+        self.assertEqual([future.cancelled() for future in futures], [True, False])
+
+class PackageNameTest(AdbTestCase):
+    def test_is_package_name(self):
+        for name in ("com.user.app0", "com.android.phone", "a", "com.example_app.v2"):
+            self.assertTrue(core.is_package_name(name), name)
+        for name in ("", "com.user app", "com.a;reboot", "com.a && rm -rf /", "com.a\nreboot", "$(reboot)", "com.a|sh", "../x"):
+            self.assertFalse(core.is_package_name(name), name)
+
+    def test_package_commands_need_a_valid_name(self):
+        for prefix in core.PACKAGE_CMDS:
+            self.assertTrue(core.is_allowed_cmd(prefix + "com.user.app0"), prefix)
+            self.assertTrue(core.is_allowed_cmd(prefix + "com.user.app0 2>&1"), prefix)
+            self.assertFalse(core.is_allowed_cmd(prefix + "com.user.app0; reboot"), prefix)
+            self.assertFalse(core.is_allowed_cmd(prefix + "com.user.app0 2>&1; reboot 2>&1"), prefix)
+            self.assertFalse(core.is_allowed_cmd(prefix), prefix)
+
+    def test_invalid_names_never_reach_the_device(self):
+        outputs = core.run_package_commands(['pm uninstall --user 0 com.user.app0', 'pm uninstall --user 0 com.user.app1; reboot'], "fake-0001")
+        self.assertEqual(outputs, ["Success", "Error: Invalid command"])
+        self.assertEqual(self.calls, ['pm uninstall --user 0 com.user.app0 2>&1'])
+        self.assertEqual(self.device.packages["com.user.app1"], [False, True])
+
+class FrameSamplerTest(unittest.TestCase):
+    PERIOD = 8333333
+    LAYER = "com.user.app0/com.user.app0.MainActivity#0"
+
+    def dump(self, frames):
+        return [str(self.PERIOD)] + [f"{frame - 1000} {frame} {frame + 1000}" for frame in frames] + [f"0 {core.PENDING_FENCE} 0", ""]
+
+    def sampler(self, dumps):
+        def run_adb_batch(cmds, serial=None):
+            frames = dumps.pop(0) if core.latency_cmd() in cmds else dumps[0]
+            return {cmd: self.dump(frames) if self.LAYER in cmd else [str(self.PERIOD)] for cmd in cmds}
+        self.enterContext(mock.patch.object(core, 'run_adb_cmd', return_value=["Display 0", self.LAYER, "StatusBar"]))
+        self.enterContext(mock.patch.object(core, 'run_adb_batch', side_effect=run_adb_batch))
+        return core.FrameSampler("fake-0001")
+
+    def test_parse_latency(self):
+        self.assertEqual(core.parse_latency(self.dump([100, 200])), (self.PERIOD, [100, 200]))
+        self.assertEqual(core.parse_latency(["Error: ADB failed"]), (None, []))
+        self.assertEqual(core.parse_latency([]), (None, []))
+
+    def test_sample_chains_frames_across_dumps(self):
+        step = 16666666
+        frames = [i * step for i in range(1, 11)]
+        sampler = self.sampler([frames[:3], frames[:3], frames[:6], frames[3:10]])
+        stats = sampler.sample()
+        self.assertEqual((stats['layer'], stats['panel_hz'], stats['frames']), (self.LAYER, 120.0, 2))
+        self.assertEqual(stats['fps'], 60.0)
+        self.assertEqual(sampler.sample()['frames'], 2)
+        self.assertEqual(sampler.sample()['frames'], 5)
+        stats = sampler.sample()
+        self.assertEqual(stats['frames'], 9)
+        self.assertEqual((stats['fps'], stats['jank_pct'], stats['p50_ms']), (60.0, 100.0, 16.67))
+
+    def test_sample_does_not_bridge_a_gap_between_dumps(self):
+        step = 16666666
+        sampler = self.sampler([[step, 2 * step], [10 * step, 11 * step]])
+        sampler.sample()
+        stats = sampler.sample()
+        self.assertEqual(stats['frames'], 2)
+        self.assertEqual(stats['p99_ms'], 16.67)
+
+    def test_idle_layer_is_picked_again(self):
+        sampler = self.sampler([[100], [100], [100], [100], [100]])
+        for _ in range(4):
+            sampler.sample()
+        self.assertIsNone(sampler.layer)
+        self.assertIsNone(sampler.last)
+        self.assertEqual(sampler.sample()['layer'], self.LAYER)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+import mi_adb_core as core
+import Mi_Adb_Kit as app
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        installed = ["com.android.phone", "com.miui.gallery", "com.user.Maps", "com.user.notes", "org.example.mapper"]
+        system_all = ["com.android.phone", "com.miui.gallery", "com.miui.removed"]
+        self.inventory = core.PackageInventory.from_lists(installed, system_all, ["com.user.Maps", "com.user.notes", "org.example.mapper"])
+        self.index = app.build_search_index(self.inventory, core.INSTALLED)
+
+    def names(self, matches):
+        return [self.index['rows'][i] for i in matches]
+
+    def test_rows_list_system_packages_first(self):
+        self.assertEqual(self.index['rows'], ["com.android.phone", "com.miui.gallery", "com.user.Maps", "com.user.notes", "org.example.mapper"])
+        self.assertEqual(self.index['system'], [True, True, False, False, False])
+        uninstalled = app.build_search_index(self.inventory, 0)
+        self.assertEqual(uninstalled['rows'], ["com.miui.removed"])
+
+    def test_matches_substrings_case_insensitively(self):
+        self.assertEqual(self.names(app.search_packages(self.index, "MAP")), ["com.user.Maps", "org.example.mapper"])
+        self.assertEqual(self.names(app.search_packages(self.index, "mi")), ["com.miui.gallery"])
+        self.assertEqual(self.names(app.search_packages(self.index, "")), self.index['rows'])
+
+    def test_incremental_queries_match_a_full_scan(self):
+        queries = ["c", "co", "com", "com.", "com.u", "com.us", "com.user.n", "com.use", "o", "ma", "map", "mapp", "xyz", "", "gallery"]
+        for query in queries:
+            expected = [name for name in self.index['rows'] if query in name.lower()]
+            self.assertEqual(self.names(app.search_packages(self.index, query)), expected, query)
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+
+import mi_adb_core as core
+import mi_adb_store as store
+from mi_adb_bench import FakeAdbServer, FakeDevice
+
+INFO = ("Xiaomi", "Fake", "fake", "V14.0.1")
+
+def inventory(installed, system_all=(), user_all=()):
+    return core.PackageInventory.from_lists(installed, system_all, user_all)
+
+class InventoryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = store.open_store(":memory:")
+        self.addCleanup(self.conn.close)
+
+    def record(self, serial, inv, taken, firmware="V14.0.1"):
+        return store.record_inventory(self.conn, serial, INFO[:3] + (firmware,), "5.10.0", inv, taken)
+
+    def test_records_only_changes(self):
+        first = inventory(["com.a", "com.b"], ["com.a"], ["com.c"])
+        self.assertEqual(self.record("dev-1", first, 1), {'serial': "dev-1", 'snapshot': 1, 'inventory': 3, 'changed': 3, 'removed': 0})
+        self.assertEqual(self.record("dev-1", first, 2)['changed'], 0)
+        second = inventory(["com.a", "com.d"], ["com.a"], ["com.b"])
+        self.assertEqual(self.record("dev-1", second, 3), {'serial': "dev-1", 'snapshot': 3, 'inventory': 3, 'changed': 2, 'removed': 1})
+        rows = self.conn.execute("SELECT p.name, dp.flags FROM device_packages dp JOIN packages p ON p.id = dp.package_id ORDER BY p.name")
+        self.assertEqual(list(rows), [("com.a", core.INSTALLED | core.SYSTEM), ("com.b", 0), ("com.d", core.INSTALLED)])
+
+    def test_package_history(self):
+        self.record("dev-1", inventory(["com.a"]), 1)
+        self.record("dev-1", inventory([], user_all=["com.a"]), 2, "V14.0.2")
+        self.record("dev-1", inventory(["com.b"]), 3, "V14.0.2")
+        self.assertEqual(store.package_history(self.conn, "com.a"),
+                         [{'time': 1, 'serial': "dev-1", 'firmware': "V14.0.1", 'state': "installed"},
+                          {'time': 2, 'serial': "dev-1", 'firmware': "V14.0.2", 'state': "uninstalled"},
+                          {'time': 3, 'serial': "dev-1", 'firmware': "V14.0.2", 'state': "absent"}])
+        self.assertEqual(store.package_history(self.conn, "com.missing"), [])
+
+    def test_diff_devices(self):
+        self.record("dev-1", inventory(["com.a", "com.b"], ["com.a"]), 1)
+        self.record("dev-2", inventory(["com.b", "com.c"], ["com.a"]), 2)
+        self.assertEqual(store.diff_devices(self.conn, "dev-1", "dev-2"),
+                         [{'name': "com.a", 'dev-1': "system installed", 'dev-2': "system uninstalled"},
+                          {'name': "com.c", 'dev-1': "absent", 'dev-2': "installed"}])
+        self.assertIsNone(store.diff_devices(self.conn, "dev-1", "dev-3"))
+
+    def test_firmware_with_package(self):
+        self.record("dev-1", inventory(["com.a"]), 1, "V1")
+        self.record("dev-2", inventory([], user_all=["com.a"]), 2, "V1")
+        self.record("dev-3", inventory(["com.a"]), 3, "V2")
+        self.record("dev-4", inventory(["com.b"]), 4, "V2")
+        self.assertEqual(store.firmware_with_package(self.conn, "com.a"),
+                         [{'firmware': "V1", 'devices': 2, 'installed': 1}, {'firmware': "V2", 'devices': 1, 'installed': 1}])
+
+    def test_stored_devices(self):
+        self.record("dev-1", inventory(["com.a", "com.b"]), 1)
+        self.record("dev-1", inventory(["com.a"]), 2)
+        self.assertEqual(store.stored_devices(self.conn), [{'serial': "dev-1", 'model': "Xiaomi Fake", 'firmware': "V14.0.1", 'kernel': "5.10.0",
+                                                            'packages': 1, 'snapshots': 2, 'seen': 2}])
+
+class RecordDeviceTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeAdbServer([FakeDevice("fake-0001", 4, 3)])
+        self.addCleanup(self.server.stop)
+        saved = core.ADB_SERVER
+        core.ADB_SERVER = ('127.0.0.1', self.server.port)
+        self.addCleanup(setattr, core, 'ADB_SERVER', saved)
+        self.addCleanup(core.adb_close_sessions, "fake-0001")
+        self.path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "db", "inventory.db")
+
+    def test_record_device(self):
+        result = store.record_device("fake-0001", self.path)
+        self.assertEqual((result['inventory'], result['changed'], result['removed']), (7, 7, 0))
+        self.assertEqual(store.record_device("fake-0001", self.path)['changed'], 0)
+
+    def test_missing_device_is_an_error(self):
+        self.assertEqual(store.record_device("missing", self.path), {'serial': "missing", 'error': "No packages returned"})
+
+    def test_store_errors_are_returned(self):
+        os.makedirs(self.path)
+        result = store.record_snapshot("fake-0001", INFO, "5.10.0", inventory(["com.a"]), self.path)
+        self.assertEqual(result['serial'], "fake-0001")
+        self.assertIn('error', result)